@@ -0,0 +1,195 @@
+###
+##  Benchmarks for weather_utils, run against synthetic data so that no Synoptic token or network
+##  access is needed. Results are printed; nothing is written outside the scratch database.
+#
+#   python bench_weather_utils.py ingest -n 1000000              (legacy and bulk ingest)
+#   python bench_weather_utils.py rangemax -q 100000
+#   python bench_weather_utils.py timeutils -n 100000
+#
+
+import weather_config
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+TEMPLATE_FILE = 'data/synod_38.09_122.65_20191009.json'
+
+def synthetic_payload(nobs,nstations=100,seed=1):
+    # Build a Synoptic timeseries response holding nobs observations spread evenly across
+    # nstations stations, five minutes apart, using the first station of TEMPLATE_FILE as a model.
+    rng = random.Random(seed)
+    with open(TEMPLATE_FILE) as tf:
+        template = json.load(tf)
+    model = template['STATION'][0]
+    per_station = nobs // nstations
+    t0 = datetime(2019,1,1)
+    date_times = [(t0 + timedelta(minutes=5*i)).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(per_station)]
+    starr = []
+    for ist in range(nstations):
+        station = dict(model)
+        station['STID'] = 'BENCH' + str(ist)
+        station['ID'] = str(900000 + ist)
+        station['LATITUDE'] = str(37.0 + rng.random())
+        station['LONGITUDE'] = str(-122.0 - rng.random())
+        obs = {'date_time': date_times}
+        for okey in model['OBSERVATIONS'].keys():
+            if okey in ('date_time','volt_set_1'):     # volt_set_1 is added by WeatherDB.create
+                continue
+            if okey == 'wind_cardinal_direction_set_1d':
+                obs[okey] = [rng.choice(['N','E','S','W']) for i in range(per_station)]
+            else:
+                obs[okey] = [round(rng.uniform(0,40),2) for i in range(per_station)]
+        station['OBSERVATIONS'] = obs
+        starr.append(station)
+    return {'STATION':starr,'SUMMARY':{'RESPONSE_CODE':1,'NUMBER_OF_OBJECTS':nstations},
+            'UNITS':template['UNITS']}
+
+def legacy_add_observations(db_object,data):
+    # The per-station ingest that add_observations replaced, kept as the "before" of the ingest
+    # benchmark: a get_station lookup (and add_station of the whole payload for a new station) per
+    # station, rows built by tuple concatenation, one executemany per station.
+    import weather_utils
+    for station in data['STATION']:
+        sql = 'INSERT OR IGNORE INTO observations ('
+        stid = station['STID']
+        if db_object.get_station(stid) == {}:
+            db_object.add_station(data)
+        obar = []
+        qm = ''
+        for i in range(len(station['OBSERVATIONS']['date_time'])):
+            obtuple = ()
+            for okey in station['OBSERVATIONS'].keys():
+                var = okey.lower()
+                if var in weather_utils.db_schema:
+                    if i == 0:
+                        sql = sql + var + ','
+                        qm = qm + '?,'
+                    obtuple = obtuple + (station['OBSERVATIONS'][okey][i],)
+            obar.append(obtuple + (stid,))
+        sql = sql + 'stid) VALUES(' + qm + '?);'
+        db_object.connection.executemany(sql,obar)
+    db_object.connection.commit()
+
+def bench_ingest(args):
+    # Rows/sec of the bulk WeatherDB.add_observations and of the legacy per-station ingest, each
+    # into a new scratch database from the same payload. The bulk ingest also keeps the hourly
+    # rollup up to date, which the legacy ingest predates.
+    import weather_utils
+    logging.getLogger().setLevel(logging.WARNING)
+    payload = synthetic_payload(args.nobs,args.stations)
+    nrows = sum(len(st['OBSERVATIONS']['date_time']) for st in payload['STATION'])
+    modes = [('legacy',legacy_add_observations),('bulk',weather_utils.WeatherDB.add_observations)]
+    if args.mode != 'both':
+        modes = [mode for mode in modes if mode[0] == args.mode]
+    for (name,ingest) in modes:
+        for ext in ('','-wal','-shm'):
+            if os.path.isfile(args.db + ext):
+                os.remove(args.db + ext)
+        mydb = weather_utils.WeatherDB.create(args.db,payload)
+        if mydb.epoch_times and name == 'legacy':
+            print("legacy: skipped, it stores ISO text times and DB_EPOCH_TIMES is set")
+            mydb.close()
+            continue
+        start = time.perf_counter()
+        ingest(mydb,payload)
+        elapsed = time.perf_counter() - start
+        mydb.cursor.execute('SELECT count(*) FROM observations;')
+        stored = mydb.cursor.fetchone()[0]
+        mydb.close()
+        print(name.ljust(7) + "add_observations: " + str(nrows) + " rows in " + format(elapsed,'.2f') + " s, " +
+              format(nrows/elapsed,',.0f') + " rows/s (" + str(stored) + " stored)")
+
+def bench_rangemax(args):
+    # Window maximum queries over one station's gust series: a linear scan of each window, as in
+    # max_gust_kernel but only over the window itself, against a weather_index.SparseTableMax.
+    import numpy as np
+    import weather_index
+    rng = np.random.default_rng(1)
+    nobs = args.days*24*12                     # Five minute readings
+    epoch = 1546300800 + 300*np.arange(nobs,dtype=np.int64)
+    gust = np.round(rng.uniform(0,40,nobs),2)
+    gust[rng.random(nobs) < 0.05] = np.nan
+    tlo = rng.integers(epoch[0],epoch[-1],args.queries)
+    thi = tlo + 3600*rng.choice([1,2,12,24,36],args.queries)
+
+    start = time.perf_counter()
+    scan = []
+    for (lo,hi) in zip(tlo,thi):
+        window = gust[np.searchsorted(epoch,lo,'left'):np.searchsorted(epoch,hi,'right')]
+        valid = window[~np.isnan(window)]
+        scan.append(float(valid.max()) if len(valid) > 0 else None)
+    tscan = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = weather_index.SparseTableMax(gust)
+    tbuild = time.perf_counter() - start
+    start = time.perf_counter()
+    ilo = np.searchsorted(epoch,tlo,'left')
+    ihi = np.minimum(np.searchsorted(epoch,thi,'right') - 1,nobs - 1)
+    imax = table.argmax(ilo,ihi)
+    tquery = time.perf_counter() - start
+    for (iq,smax) in enumerate(scan):
+        assert smax == None or smax == table.values[imax[iq]]
+    print("range max, " + str(nobs) + " readings, " + str(args.queries) + " windows")
+    print("  linear scan:  " + format(tscan,'.3f') + " s, " + format(1e6*tscan/args.queries,'.1f') + " us/query")
+    print("  sparse table: " + format(tbuild,'.3f') + " s build, " + format(tquery,'.3f') + " s queries, " +
+          format(1e6*tquery/args.queries,'.2f') + " us/query")
+
+def bench_timeutils(args):
+    # TimeUtils constructions per second from Synoptic data and API strings: the general zulu.parse
+    # path, the fixed format fast path with an empty cache (every string new), and strings repeated
+    # from a pool of args.distinct, as an event run repeats its window bounds. EpochTime.parse is
+    # timed on the repeated strings too.
+    import weather_utils
+    import zulu
+    t0 = datetime(2015,1,1)
+    iso = [(t0 + timedelta(minutes=5*i)).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(args.n)]
+    synop = [(t0 + timedelta(minutes=5*i)).strftime('%Y%m%d%H%M') for i in range(args.n)]
+    repeated = [iso[i % args.distinct] for i in range(args.n)]
+
+    def rate(label,func,strings):
+        weather_utils.parse_time_string.cache_clear()
+        weather_utils.parse_epoch.cache_clear()
+        start = time.perf_counter()
+        for timestr in strings:
+            func(timestr)
+        elapsed = time.perf_counter() - start
+        print("  " + label.ljust(36) + format(len(strings)/elapsed,',.0f') + " /s")
+
+    print("TimeUtils constructions, " + str(args.n) + " strings, cache size " + str(weather_utils.time_cache_size))
+    rate('zulu.parse, YYYY-MM-DDTHH:MM:SSZ',zulu.parse,iso)
+    rate('TimeUtils, YYYY-MM-DDTHH:MM:SSZ',weather_utils.TimeUtils,iso)
+    rate('TimeUtils, YYYYMMDDHHMM',weather_utils.TimeUtils,synop)
+    rate('TimeUtils, ' + str(args.distinct) + ' repeated',weather_utils.TimeUtils,repeated)
+    rate('EpochTime.parse, ' + str(args.distinct) + ' repeated',weather_utils.EpochTime.parse,repeated)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='weather_utils benchmarks')
+    parser.add_argument('-f','--config',default=weather_config.DEFAULT_CONFIG,help='Configuration file')
+    subparsers = parser.add_subparsers(dest='bench',required=True)
+    ingest = subparsers.add_parser('ingest',help='WeatherDB.add_observations rows/sec')
+    ingest.add_argument('-n','--nobs',type=int,default=1000000,help='Number of observations')
+    ingest.add_argument('-s','--stations',type=int,default=100,help='Number of stations')
+    ingest.add_argument('--db',default='test/bench_weather_data.db',help='Scratch database')
+    ingest.add_argument('--mode',choices=['legacy','bulk','both'],default='both',
+                        help='Ingest timed: legacy per-station loop, bulk add_observations, or both')
+    ingest.set_defaults(func=bench_ingest)
+    rangemax = subparsers.add_parser('rangemax',help='Window maximum: linear scan against sparse table')
+    rangemax.add_argument('-q','--queries',type=int,default=100000,help='Number of windows')
+    rangemax.add_argument('-d','--days',type=int,default=365,help='Length of the gust series')
+    rangemax.set_defaults(func=bench_rangemax)
+    timeutils = subparsers.add_parser('timeutils',help='TimeUtils constructions/sec, with and without the parse cache')
+    timeutils.add_argument('-n',type=int,default=100000,help='Number of constructions')
+    timeutils.add_argument('--distinct',type=int,default=1000,help='Distinct strings in the repeated case')
+    timeutils.set_defaults(func=bench_timeutils)
+    args = parser.parse_args(argv)
+    weather_config.init(args.config)      # Before weather_utils is imported
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,21 @@
 # This tests two distributions.
 # Argument parsing, Excel features added from standard wind libraries
 # Joseph W. Mitchell   April 2025
+#
+# The second distribution can instead be binned from Monte Carlo control samples (weather_utils.py
+# mc), given with -m as an event table (.csv or .parquet) or as a sheet of the Excel file. Each
+# sample counts with its weight (the weight column of a table, or the -w column of a sheet), so
+# stratified or importance weighted control runs give unbiased bin counts. Without weights every
+# sample counts once. The tests below assume plain counts, so weighted counts are first rescaled to
+# the effective sample size sum(w)**2/sum(w**2) (Kish): the bin proportions are kept and the
+# counts carry about the information of a simple random sample of that size.
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.stats import chi2, ks_2samp, ttest_ind
 import argparse
+import csv
 from openpyxl import load_workbook
 import openpyxl
 import xlrd  # pip install
@@ -24,6 +33,11 @@ parse.add_argument('-l','--labels',help='Row Labels')
 parse.add_argument('-r','--row',help='Row 1')
 parse.add_argument('-n','--n',help='Number of Points')
 parse.add_argument('-z','--outcell',help="Output Cell")
+parse.add_argument('-m','--control',help='Control samples: event table (.csv, .parquet) or sheet of the Excel file, binned as column 2')
+parse.add_argument('-g','--gust',help='Gust of the control samples: table column, e.g. max_gust_2h_8mi, or sheet column letter')
+parse.add_argument('-w','--weight',help='Weight column letter of a control sheet (tables use their weight column)')
+parse.add_argument('-b','--bins',help='Bin edges of the rows for the control samples, e.g. 0,10,20,30,40,50,1000')
+parse.add_argument('--control-row',type=int,default=2,help='First sample row of a control sheet')
 
 program_args=parse.parse_args()
 
@@ -57,12 +71,75 @@ def pull_data_from_excel(xlfile,xlinsheet,xldata):
     return(labels,dist1,dist2)
     
     
+def pull_control_samples(xlfile,control,gust,weight,first_row):
+    # (gust values, weights) of the control samples. Samples without a gust are left out, and
+    # samples without a weight, or all of them when there is no weight column, have weight 1.
+    values = []
+    weights = []
+    if control.endswith('.csv'):
+        with open(control,newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                if row[gust] not in ('',None):
+                    values.append(float(row[gust]))
+                    weights.append(float(row['weight']) if row.get('weight') not in ('',None) else 1.0)
+    elif control.endswith('.parquet'):
+        import pyarrow.parquet as pq     # pip install
+        table = pq.read_table(control)
+        wcol = table.column('weight').to_pylist() if 'weight' in table.column_names else [None]*table.num_rows
+        for (val,wt) in zip(table.column(gust).to_pylist(),wcol):
+            if val != None:
+                values.append(float(val))
+                weights.append(float(wt) if wt != None else 1.0)
+    else:
+        wbk = load_workbook(filename=xlfile,read_only=True)
+        sht = wbk[control]
+        gcol = openpyxl.utils.column_index_from_string(gust) - 1
+        wcol = openpyxl.utils.column_index_from_string(weight) - 1 if weight != None else None
+        for row in sht.iter_rows(min_row=first_row,values_only=True):
+            val = row[gcol] if gcol < len(row) else None
+            if val in (None,''):
+                continue
+            wt = row[wcol] if wcol != None and wcol < len(row) else None
+            values.append(float(val))
+            weights.append(float(wt) if wt not in (None,'') else 1.0)
+        wbk.close()
+    return(np.array(values),np.array(weights))
+
+def weighted_bin_counts(values,weights,edges):
+    # Sum of the sample weights in each bin between successive edges
+    return np.histogram(values,bins=edges,weights=weights)[0]
+
+def effective_sample_size(weights):
+    # Kish effective sample size of weighted samples, len(weights) when all weights are equal
+    return weights.sum()**2/(weights**2).sum()
+
+def effective_bin_counts(values,weights,edges):
+    # Weighted bin counts rescaled to the effective sample size, for tests that expect counts
+    counts = weighted_bin_counts(values,weights,edges)
+    return counts*effective_sample_size(weights)/weights.sum()
+
 # --- Input your compressed distributions (counts) ---
 #dist_a = [3, 16, 16, 10, 5, 5]
 #dist_b = [22, 130, 86, 25, 9, 7]
 
 labels,dist_a,dist_b = pull_data_from_excel(xl_file,xl_insheet,xl_data)
 
+if program_args.control != None:
+    if program_args.gust == None or program_args.bins == None:
+        parse.error('--control needs --gust and --bins')
+    edges = [float(edge) for edge in program_args.bins.split(',')]
+    if len(edges) - 1 != len(dist_a):
+        parse.error('--bins needs ' + str(len(dist_a) + 1) + ' edges, one more than the rows')
+    ctl_values,ctl_weights = pull_control_samples(xl_file,program_args.control,program_args.gust,
+                                                  program_args.weight,program_args.control_row)
+    dist_b = list(effective_bin_counts(ctl_values,ctl_weights,edges))
+    ctl_note = "Control counts are weighted bin sums rescaled to the effective sample size " + \
+               format(effective_sample_size(ctl_weights),'.1f') + " (Kish approximation)"
+    print("Control samples: " + str(len(ctl_values)) + ", total weight " + format(ctl_weights.sum(),'.1f'))
+    print(ctl_note)
+else:
+    ctl_note = None
+
 # --- G-test per bin ---
 def g_test_per_bin(dist_a, dist_b):
     observed = np.vstack([dist_a, dist_b])
@@ -94,8 +171,15 @@ def chi2_test_per_bin(dist_a, dist_b):
     return list(zip(bins, chi2_stat_per_bin, p_val_per_bin))
 
 # --- Expand counts into samples for KS test ---
+# Fractional (rescaled) counts are rounded by largest remainder, so the samples total the rounded
+# sum of the counts rather than the sum of each bin rounded on its own
 def expand_to_samples(dist):
-    return np.concatenate([np.full(count, bin_idx) for bin_idx, count in enumerate(dist, start=1)])
+    dist = np.asarray(dist, dtype=float)
+    whole = np.floor(dist).astype(int)
+    short = int(round(dist.sum())) - whole.sum()
+    if short > 0:
+        whole[np.argsort(whole - dist)[:short]] += 1
+    return np.concatenate([np.full(count, bin_idx) for bin_idx, count in enumerate(whole, start=1)])
 
 # --- Run tests ---
 g_results = g_test_per_bin(dist_a, dist_b)
@@ -115,6 +199,8 @@ with pd.ExcelWriter(xl_file, engine="openpyxl",mode='a',if_sheet_exists='overlay
     ks_results_df.to_excel(writer,sheet_name=xl_outsheet,startcol=1,startrow=1,index=False)
     g_results_df.to_excel(writer,sheet_name=xl_outsheet,startcol=1,startrow=5,index=False)
     chi2_results_df.to_excel(writer,sheet_name=xl_outsheet,startcol=4,startrow=5,index=False)
+    if ctl_note != None:
+        pd.DataFrame({"Note":[ctl_note]}).to_excel(writer,sheet_name=xl_outsheet,startcol=4,startrow=1,index=False)
 
 #g_results_df.to_csv("g_test_results.csv", index=False)
 #chi2_results_df.to_csv("chi2_test_results.csv", index=False)
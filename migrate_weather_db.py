@@ -0,0 +1,28 @@
+###
+##  Migrates an existing weather database to store observation times as integer epoch seconds.
+#
+#   python migrate_weather_db.py -f weather.ini weather_data.db
+#
+#   Back up the database first. The observations table is rebuilt in a single transaction, so an
+#   interrupted migration leaves the database as it was.
+#
+
+import weather_config
+import argparse
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert WeatherDB observation times to epoch seconds')
+    parser.add_argument('-f','--config',default=weather_config.DEFAULT_CONFIG,help='Configuration file')
+    parser.add_argument('--no-vacuum',action='store_true',help='Skip reclaiming the space freed by the old table')
+    parser.add_argument('db',help='Database file')
+    args = parser.parse_args(argv)
+    weather_config.init(args.config)      # Before weather_utils is imported
+    import weather_utils
+    mydb = weather_utils.WeatherDB(args.db)
+    mydb.migrate_epoch_times()
+    if not args.no_vacuum:
+        mydb.vacuum()
+    mydb.close()
+
+if __name__ == '__main__':
+    main()
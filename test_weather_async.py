@@ -0,0 +1,113 @@
+###
+##  Test suite for weather_async.py, run against a local stub HTTP server
+
+import weather_config
+weather_config.init('weather.ini')
+import weather_utils
+import weather_async
+import weather_client
+import unittest
+import threading
+import time
+import json
+import os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubTimeseriesHandler(BaseHTTPRequestHandler):
+
+    # Answers every request with server.payload after server.delay seconds, tracking the largest
+    # number of requests in flight at once.
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.active += 1
+            srv.max_active = max(srv.max_active,srv.active)
+            srv.paths.append(self.path)
+        time.sleep(srv.delay)
+        with srv.lock:
+            srv.active -= 1
+        payload = json.dumps(srv.payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self,format,*args):
+        pass
+
+class PrefetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        self.test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',self.test_data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1',0),StubTimeseriesHandler)
+        self.server.lock = threading.Lock()
+        self.server.active = 0
+        self.server.max_active = 0
+        self.server.paths = []
+        self.server.delay = 0.2
+        self.server.payload = self.test_data
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        # Point the shared client at the stub server
+        self.saved = (weather_utils.api,weather_utils.synoptic_client)
+        weather_utils.api = 'http://127.0.0.1:' + str(self.server.server_port) + '/v2/'
+        weather_utils.synoptic_client = weather_client.SynopticClient('TESTTOKEN',timeout=5,retries=0)
+
+    def test_prefetch_radius(self):
+        freqs = [(38.09,-122.65,3,'2019-10-09T23:00:00Z','2019-10-10T04:00:00Z')]
+        freqs += [(38.09,-122.65,3,'2019-10-09T23:00:00Z','2019-10-10T0' + str(ih) + ':00:00Z')
+                  for ih in range(1,4)]
+        freqs += [('PG133','2019-10-09T23:00:00Z','2019-10-10T04:00:00Z')]
+        freqs += [(38.09+0.01*i,-122.65,3,'2019-10-09T23:00:00Z','2019-10-10T04:00:00Z') for i in range(1,4)]
+        (nfetched,failed) = weather_async.prefetch_observations(freqs,self.mydb,concurrency=3)
+        self.assertEqual(nfetched,8)
+        self.assertEqual(failed,[])
+        self.assertEqual(self.server.max_active,3)
+        self.mydb.cursor.execute('SELECT count(*) FROM observations;')
+        (count,) = self.mydb.cursor.fetchone()
+        self.assertEqual(count,154)
+
+        # The synchronous path is now answered from the database
+        t1 = weather_utils.TimeUtils('2019-10-09T23:00:00Z')
+        t2 = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+        obs = weather_utils.get_observations_by_radius_datetime(38.09,-122.65,3,t1,t2,self.mydb)
+        self.assertEqual(obs['SUMMARY']['FUNCTION_USED'],'weather_db')
+        self.assertEqual(len(self.server.paths),8)
+
+        # Covered requests are skipped
+        (nfetched,failed) = weather_async.prefetch_observations(freqs[0:4],self.mydb,concurrency=3)
+        self.assertEqual(nfetched,0)
+
+    def test_prefetch_failure(self):
+        weather_utils.api = 'http://127.0.0.1:1/v2/'
+        freqs = [(38.09,-122.65,3,'2019-10-09T23:00:00Z','2019-10-10T04:00:00Z')]
+        (nfetched,failed) = weather_async.prefetch_observations(freqs,self.mydb,concurrency=2)
+        self.assertEqual(nfetched,0)
+        self.assertEqual(len(failed),1)
+
+    def tearDown(self):
+        weather_utils.synoptic_client.close()
+        (weather_utils.api,weather_utils.synoptic_client) = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
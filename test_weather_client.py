@@ -0,0 +1,182 @@
+###
+##  Test suite for weather_client.py, run against a local stub HTTP server
+
+import weather_client
+import unittest
+import threading
+import json
+import os
+import shutil
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from requests.exceptions import HTTPError
+
+
+class StubSynopticHandler(BaseHTTPRequestHandler):
+
+    # Serves the scripted responses in server.script in order, as (status, headers, body) tuples,
+    # repeating the last one. Records each request path and client port.
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        srv = self.server
+        srv.requests.append((self.path,self.client_address[1]))
+        (status,headers,body) = srv.script[min(len(srv.requests),len(srv.script))-1]
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for (hk,hv) in headers.items():
+            self.send_header(hk,hv)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self,format,*args):
+        pass
+
+class SynopticClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1',0),StubSynopticHandler)
+        self.server.requests = []
+        self.server.script = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/v2/stations/timeseries'
+        self.waits = []
+        self.client = weather_client.SynopticClient('TESTTOKEN',timeout=5,retries=3,backoff=0.5,
+                                                    sleep=self.waits.append)
+
+    def test_token_and_keepalive(self):
+        ok = {'SUMMARY':{'RESPONSE_CODE':1,'NUMBER_OF_OBJECTS':0}}
+        self.server.script = [(200,{},ok)]
+        data = self.client.get(self.url,{'stid':'PG133'})
+        self.assertEqual(data,ok)
+        self.client.get(self.url,{'stid':'PG133'})
+        self.assertIn('token=TESTTOKEN',self.server.requests[0][0])
+        self.assertIn('stid=PG133',self.server.requests[0][0])
+        self.assertEqual(self.server.requests[0][1],self.server.requests[1][1])   # Same connection
+
+    def test_retry_server_error(self):
+        ok = {'SUMMARY':{'RESPONSE_CODE':1}}
+        self.server.script = [(503,{},{}),(502,{},{}),(200,{},ok)]
+        data = self.client.get(self.url,{})
+        self.assertEqual(data,ok)
+        self.assertEqual(self.waits,[0.5,1.0])
+
+    def test_rate_limit_retry_after(self):
+        ok = {'SUMMARY':{'RESPONSE_CODE':1}}
+        self.server.script = [(429,{'Retry-After':'7'},{}),(200,{},ok)]
+        data = self.client.get(self.url,{})
+        self.assertEqual(data,ok)
+        self.assertEqual(self.waits,[7.0])
+
+    def test_rate_limit_in_summary(self):
+        ok = {'SUMMARY':{'RESPONSE_CODE':1}}
+        limited = {'SUMMARY':{'RESPONSE_CODE':-1,'HTTP_STATUS_CODE':429}}
+        self.server.script = [(200,{},limited),(200,{},ok)]
+        data = self.client.get(self.url,{})
+        self.assertEqual(data,ok)
+        self.assertEqual(len(self.server.requests),2)
+
+    def test_retries_exhausted(self):
+        self.server.script = [(500,{},{})]
+        with self.assertRaises(HTTPError):
+            self.client.get(self.url,{})
+        self.assertEqual(len(self.server.requests),4)
+
+    def test_client_error_not_retried(self):
+        self.server.script = [(404,{},{})]
+        with self.assertRaises(HTTPError):
+            self.client.get(self.url,{})
+        self.assertEqual(len(self.server.requests),1)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = 'test/test_response_cache'
+        shutil.rmtree(self.cache_dir,ignore_errors=True)
+        self.server = HTTPServer(('127.0.0.1',0),StubSynopticHandler)
+        self.server.requests = []
+        self.server.script = [(200,{},json.load(open('data/synod_38.09_122.65_20191009.json')))]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/v2/stations/timeseries'
+        self.params = {'start':'201910092300','end':'201910100400','radius':'38.09,-122.65,8'}
+
+    def test_cache_roundtrip(self):
+        cache = weather_client.ResponseCache(self.cache_dir)
+        client = weather_client.SynopticClient('TOKEN1',retries=0,cache=cache)
+        data1 = client.get(self.url,self.params)
+        data2 = client.get(self.url,dict(self.params))
+        client.close()
+        self.assertEqual(data1,data2)
+        self.assertEqual(data1['SUMMARY']['NUMBER_OF_OBJECTS'],33)
+        self.assertEqual(len(self.server.requests),1)
+        self.assertTrue(cache.total_bytes > 0)
+
+    def test_token_excluded(self):
+        cache = weather_client.ResponseCache(self.cache_dir)
+        params1 = dict(self.params,token='TOKEN1')
+        params2 = dict(self.params,token='TOKEN2')
+        self.assertEqual(cache.key(self.url,params1),cache.key(self.url,params2))
+        self.assertNotEqual(cache.key(self.url,params1),cache.key(self.url,dict(self.params,end='201910100500')))
+
+    def test_replay(self):
+        cache = weather_client.ResponseCache(self.cache_dir)
+        client = weather_client.SynopticClient('TOKEN1',retries=0,cache=cache)
+        client.get(self.url,self.params)
+        client.close()
+        replay = weather_client.ResponseCache(self.cache_dir,mode='replay')
+        client = weather_client.SynopticClient('TOKEN2',retries=0,cache=replay)
+        data = client.get(self.url,self.params)
+        self.assertEqual(data['SUMMARY']['NUMBER_OF_OBJECTS'],33)
+        with self.assertRaises(weather_client.CacheMissError):
+            client.get(self.url,dict(self.params,end='201910100500'))
+        client.close()
+        self.assertEqual(len(self.server.requests),1)
+
+    def test_lru_eviction(self):
+        cache = weather_client.ResponseCache(self.cache_dir)
+        cache.put(self.url,{'n':1},{'SUMMARY':{'RESPONSE_CODE':1},'DATA':'x'*1000})
+        size = cache.total_bytes
+        cache.max_bytes = 2*size + size//2
+        cache.put(self.url,{'n':2},{'SUMMARY':{'RESPONSE_CODE':1},'DATA':'y'*1000})
+        time.sleep(0.01)
+        self.assertTrue(cache.get(self.url,{'n':1}) != None)     # Now more recently used than n=2
+        time.sleep(0.01)
+        cache.put(self.url,{'n':3},{'SUMMARY':{'RESPONSE_CODE':1},'DATA':'z'*1000})
+        self.assertTrue(cache.get(self.url,{'n':1}) != None)
+        self.assertEqual(cache.get(self.url,{'n':2}),None)
+        self.assertTrue(cache.get(self.url,{'n':3}) != None)
+        self.assertTrue(cache.total_bytes <= cache.max_bytes)
+
+    def test_compression_change(self):
+        cache = weather_client.ResponseCache(self.cache_dir)
+        key = cache.key(self.url,{'n':1})
+        os.makedirs(os.path.join(self.cache_dir,key[0:2]))
+        stale = os.path.join(self.cache_dir,key[0:2],key + '.json.zst')
+        with open(stale,'wb') as cf:        # Left by an earlier run with HTTP_CACHE_COMPRESSION zstd
+            cf.write(b'x'*100)
+        cache = weather_client.ResponseCache(self.cache_dir)
+        self.assertEqual(cache.total_bytes,100)
+        cache.put(self.url,{'n':1},{'SUMMARY':{'RESPONSE_CODE':1},'DATA':'x'*1000})
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(cache.total_bytes,sum(os.path.getsize(fn) for (fn,mtime) in cache._files()))
+        self.assertEqual(cache.get(self.url,{'n':1})['DATA'],'x'*1000)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir,ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+###
+##  Test suite for weather_index.py
+
+import weather_config
+weather_config.init('weather.ini')
+import weather_utils
+import weather_index
+import unittest
+import numpy as np
+import os
+
+
+class SparseTableMaxTestCase(unittest.TestCase):
+
+    def test_against_scan(self):
+        rng = np.random.default_rng(7)
+        values = rng.integers(0,50,size=3000).astype(float)    # Plenty of ties
+        values[rng.random(3000) < 0.2] = np.nan
+        table = weather_index.SparseTableMax(values)
+        for i in range(3000):
+            (lo,hi) = sorted(rng.integers(0,3000,size=2))
+            window = values[lo:hi+1]
+            valid = ~np.isnan(window)
+            self.assertEqual(int(table.count(lo,hi)),int(valid.sum()))
+            if valid.any():
+                wmax = np.nanmax(window)
+                self.assertEqual(int(table.argmax(lo,hi)),lo + int(np.flatnonzero(window == wmax)[-1]))
+
+    def test_vectorized(self):
+        values = np.array([3.0,1.0,3.0,np.nan,2.0])
+        table = weather_index.SparseTableMax(values)
+        self.assertEqual(list(table.argmax(np.array([0,1,3]),np.array([4,1,4]))),[2,1,4])
+        rng = np.random.default_rng(3)
+        values = rng.integers(0,50,size=5000).astype(float)
+        table = weather_index.SparseTableMax(values)
+        lo = rng.integers(0,5000,size=1000)
+        hi = np.minimum(lo + rng.integers(0,1500,size=1000),4999)
+        self.assertEqual(list(table.argmax(lo,hi)),[table.argmax(l,h) for (l,h) in zip(lo,hi)])
+
+class GustIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',test_data)
+        self.mydb.add_observations(test_data)
+        self.mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        self.gust_index = weather_index.GustIndex(self.mydb)
+
+    def test_window_max(self):
+        self.gust_index.load(['PG035'],'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        tlo = weather_utils.TimeUtils('2019-10-09T23:00:00Z').datetime.timestamp()
+        thi = weather_utils.TimeUtils('2019-10-10T01:00:00Z').datetime.timestamp()
+        self.assertTrue(self.gust_index.covers('PG035',tlo,thi))
+        self.assertFalse(self.gust_index.covers('PG133',tlo,thi))
+        (gmax,gtime,count) = self.gust_index.window_max('PG035',tlo,thi)
+        self.assertEqual((gmax,weather_utils.iso_times([gtime])[0],count),(5.42,'2019-10-10T00:10:00Z',13))
+        self.assertEqual(self.gust_index.window_max('PG035',0,1000),(None,None,0))
+
+    def test_max_gust(self):
+        tm = weather_utils.TimeUtils('2019-10-10T00:37:00Z')
+        ttpl = (1,2)
+        gtpl = (2,3)
+        (tlo,thi) = weather_utils.get_event_window(tm,ttpl,0)
+        self.assertEqual(weather_utils.get_max_gust_index(38.09,-122.65,tm,ttpl,gtpl,tlo,thi,self.mydb,self.gust_index),None)
+        self.gust_index.load_radius(38.09,-122.65,3,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        mgi = weather_utils.get_max_gust_index(38.09,-122.65,tm,ttpl,gtpl,tlo,thi,self.mydb,self.gust_index)
+        self.assertEqual(mgi,weather_utils.get_max_gust(38.09,-122.65,tm,ttpl,0,gtpl,self.mydb,rollup=False))
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
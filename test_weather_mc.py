@@ -0,0 +1,221 @@
+###
+##  Test suite for weather_mc.py
+
+import weather_config
+weather_config.init('weather.ini')
+import weather_utils
+import weather_pipeline
+import weather_mc
+import weather_client
+import unittest
+import numpy as np
+import threading
+import csv
+import os
+from http.server import ThreadingHTTPServer
+from test_weather_async import StubTimeseriesHandler
+
+
+class LocationReader(weather_pipeline.EventReader):
+
+    def events(self):
+        for (iloc,(lat,lon)) in enumerate([(38.09,-122.65),(38.1,-122.6),(38.08,-122.66)]):
+            yield weather_pipeline.Event(iloc+2,lat,lon,None,values=['loc' + str(iloc),lat,lon])
+
+class ListEventWriter(weather_pipeline.EventWriter):
+
+    def open(self,header):
+        self.rows = []
+
+    def write(self,event,result):
+        self.rows.append((event.event_id,event.values[0],event.time.iso(),result,event.weight))
+
+
+class DrawSamplesTestCase(unittest.TestCase):
+
+    def test_draw_samples(self):
+        (locs,epochs,weights) = weather_mc.draw_samples(np.random.default_rng(5),7,1000,1000000,2000000)
+        (locs2,epochs2,weights2) = weather_mc.draw_samples(np.random.default_rng(5),7,1000,1000000,2000000)
+        self.assertTrue((locs == locs2).all() and (epochs == epochs2).all())
+        self.assertTrue(locs.min() >= 0 and locs.max() <= 6 and epochs.min() >= 1000000 and epochs.max() < 2000000)
+        self.assertTrue((weights == 1).all())
+        order = np.lexsort((epochs,locs))
+        self.assertTrue((order == np.arange(1000)).all())      # Sorted by location, then time
+
+    def test_stratified(self):
+        # 2015 to 2019, with October counted three times over
+        (tstart,tend) = (1420070400,1577836800)
+        factors = np.ones(12)
+        factors[9] = 3
+        (locs,epochs,weights) = weather_mc.draw_samples(np.random.default_rng(2),5,2000,tstart,tend,'stratified',factors)
+        self.assertEqual(len(epochs),2000)
+        self.assertTrue(epochs.min() >= tstart and epochs.max() < tend)
+        october = epochs.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64) % 12 == 9
+        self.assertTrue(abs(october.sum() - 2000*3*155/(1826 + 2*155)) <= 1)
+        self.assertTrue(np.allclose(weights[october],(1826 + 2*155)/(3*1826)))
+        self.assertTrue(np.allclose(weights[~october],(1826 + 2*155)/1826))
+        # October and the other months are both drawn at every hour of the day
+        self.assertEqual(len(set(zip(october,epochs//3600 % 24))),48)
+        (locs,epochs,weights) = weather_mc.draw_samples(np.random.default_rng(2),5,2000,tstart,tend,'stratified')
+        self.assertTrue(np.allclose(weights,1))
+
+    def test_lhs(self):
+        (locs,epochs,weights) = weather_mc.draw_samples(np.random.default_rng(4),10,500,1000000,2000000,'lhs')
+        # One sample in each five hundredth of the period, and fifty at each location
+        self.assertEqual(sorted((epochs - 1000000)*500//1000000),list(range(500)))
+        self.assertEqual(np.bincount(locs).tolist(),[50]*10)
+        self.assertTrue((weights == 1).all())
+        self.assertRaises(ValueError,weather_mc.draw_samples,np.random.default_rng(4),10,500,1000000,2000000,'sobol')
+
+
+class MonteCarloTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',test_data)
+        self.mydb.add_observations(test_data)
+        self.mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        weather_config.config['MCTest'] = {'TIME_WINDOWS':'1,2','DISTANCE_WINDOWS':'2,4','FIRST_ROW':'2','EVENTS':'40',
+                                           'ROW_OFFSET':'10','START_DATE':'201910090300','END_DATE':'201910102000'}
+
+    def test_run_mc(self):
+        settings = weather_pipeline.load_settings('MCTest')
+        writer = ListEventWriter(settings)
+        self.assertEqual(weather_mc.run_mc(settings,self.mydb,seed=11,batch_size=16,writer=writer,
+                                           reader=LocationReader(settings)),11)
+        self.assertEqual([row[0] for row in writer.rows],list(range(12,52)))
+        lats = {'loc0':38.09,'loc1':38.1,'loc2':38.08}
+        lons = {'loc0':-122.65,'loc1':-122.6,'loc2':-122.66}
+        for (irow,loc,tm,result,weight) in writer.rows:
+            self.assertEqual(weight,1.0)
+            self.assertTrue('2019-10-09T03:00:00Z' <= tm < '2019-10-10T20:00:00Z')
+            self.assertEqual(result,weather_utils.get_max_gust(lats[loc],lons[loc],weather_utils.TimeUtils(tm),(1,2),0,(2,4),
+                                                              self.mydb))
+        again = ListEventWriter(settings)
+        weather_mc.run_mc(settings,self.mydb,seed=11,writer=again,reader=LocationReader(settings))
+        self.assertEqual(again.rows,writer.rows)
+
+    def test_shards(self):
+        weather_config.config['MCTest']['MC_SHARD_FILE'] = 'test/test_mc_shard{shard}of{shards}.jsonl'
+        settings = weather_pipeline.load_settings('MCTest')
+        self.assertRaises(ValueError,weather_mc.run_mc,settings,self.mydb,shard=(1,3),reader=LocationReader(settings))
+        for ishard in (3,1,2):          # In any order
+            weather_mc.run_mc(settings,self.mydb,seed=9,shard=(ishard,3),sampling='stratified',
+                              reader=LocationReader(settings))
+        writer = ListEventWriter(settings)
+        self.assertEqual(weather_mc.merge_shards(settings,3,reader=LocationReader(settings),writer=writer),40)
+        self.assertEqual([row[0] for row in writer.rows],list(range(12,52)))
+        self.assertEqual([weather_mc.parse_shard(raw) for raw in ('1/3','3/3')],[(1,3),(3,3)])
+        self.assertRaises(ValueError,weather_mc.parse_shard,'4/3')
+
+        # Rerunning a shard gives the same file, and the merge the same table
+        with open('test/test_mc_shard2of3.jsonl') as shard:
+            first = shard.read()
+        weather_mc.run_mc(settings,self.mydb,seed=9,shard=(2,3),sampling='stratified',reader=LocationReader(settings))
+        with open('test/test_mc_shard2of3.jsonl') as shard:
+            self.assertEqual(shard.read(),first)
+        again = ListEventWriter(settings)
+        weather_mc.merge_shards(settings,3,reader=LocationReader(settings),writer=again)
+        self.assertEqual(again.rows,writer.rows)
+
+        # A shard of another run, or a missing shard, stops the merge
+        weather_mc.run_mc(settings,self.mydb,seed=10,shard=(2,3),sampling='stratified',reader=LocationReader(settings))
+        self.assertRaises(ValueError,weather_mc.merge_shards,settings,3,LocationReader(settings),ListEventWriter(settings))
+        for ishard in (1,2,3):
+            os.remove('test/test_mc_shard' + str(ishard) + 'of3.jsonl')
+        self.assertRaises(ValueError,weather_mc.merge_shards,settings,3,LocationReader(settings),ListEventWriter(settings))
+
+        # A shard that cannot be opened raises its own error, not one from closing the writer
+        weather_config.config['MCTest']['MC_SHARD_FILE'] = 'test/no_such_dir/test_mc_shard{shard}of{shards}.jsonl'
+        settings = weather_pipeline.load_settings('MCTest')
+        self.assertRaises(FileNotFoundError,weather_mc.run_mc,settings,self.mydb,seed=9,shard=(1,3),
+                          reader=LocationReader(settings))
+
+    def test_weighted_table(self):
+        weather_config.config['MCTest']['EVENT_WRITER'] = 'csv'
+        weather_config.config['MCTest']['EVENT_OUTPUT_FILE'] = 'test/test_mc_samples.csv'
+        settings = weather_pipeline.load_settings('MCTest')
+        weather_mc.run_mc(settings,self.mydb,seed=7,reader=LocationReader(settings),sampling='stratified')
+        with open('test/test_mc_samples.csv',newline='') as csvfile:
+            rows = list(csv.reader(csvfile))
+        os.remove('test/test_mc_samples.csv')
+        self.assertEqual(rows[0][-1],'weight')
+        self.assertEqual(len(rows),41)
+        self.assertTrue(all(len(row) == len(rows[0]) and float(row[-1]) > 0 for row in rows[1:]))
+
+    def tearDown(self):
+        weather_config.config.remove_section('MCTest')
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+class ClimatologyPrefetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        self.test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',self.test_data)
+        weather_config.config['MCTest'] = {'TIME_WINDOWS':'1,2','DISTANCE_WINDOWS':'2,4','FIRST_ROW':'2','EVENTS':'40',
+                                           'START_DATE':'201910090300','END_DATE':'201910102000'}
+
+        # The stub answers station searches and station histories alike with the Novato payload
+        self.server = ThreadingHTTPServer(('127.0.0.1',0),StubTimeseriesHandler)
+        self.server.lock = threading.Lock()
+        (self.server.active,self.server.max_active,self.server.paths) = (0,0,[])
+        self.server.delay = 0
+        self.server.payload = self.test_data
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.saved = (weather_utils.api,weather_utils.synoptic_client)
+        weather_utils.api = 'http://127.0.0.1:' + str(self.server.server_port) + '/v2/'
+        weather_utils.synoptic_client = weather_client.SynopticClient('TESTTOKEN',timeout=5,retries=0)
+
+    def test_prefetch_climatology(self):
+        settings = weather_pipeline.load_settings('MCTest')
+        (tlo,thi) = weather_mc.get_climatology_window(settings)
+        self.assertEqual((tlo.iso(),thi.iso()),('2019-10-09T02:00:00Z','2019-10-10T21:00:00Z'))
+        self.assertEqual(weather_mc.prefetch_climatology(settings,self.mydb,reader=LocationReader(settings)),(3,3))
+        nstations = len(self.test_data['STATION'])
+        self.assertEqual(len(self.server.paths),3 + nstations)    # Three searches, one chunk per station
+        self.assertTrue(all(self.mydb.check_coverage(lat,lon,4,'2019-10-09T02:00:00Z','2019-10-10T21:00:00Z')
+                            for (lat,lon) in [(38.09,-122.65),(38.1,-122.6),(38.08,-122.66)]))
+
+        # Every sample is now answered from the database, and a second prefetch has nothing to do
+        writer = ListEventWriter(settings)
+        weather_mc.run_mc(settings,self.mydb,seed=3,writer=writer,reader=LocationReader(settings))
+        self.assertEqual(len(writer.rows),40)
+        self.assertEqual(weather_mc.prefetch_climatology(settings,self.mydb,reader=LocationReader(settings)),(3,3))
+        self.assertEqual(len(self.server.paths),3 + nstations)
+
+    def test_record_climatology_coverage(self):
+        (tlo,thi) = (weather_utils.TimeUtils('201910090000'),weather_utils.TimeUtils('201910100000'))
+        self.mydb.add_station_coverage('PG133','2019-10-09T00:00:00Z','2019-10-10T00:00:00Z')
+        self.mydb.add_station_coverage('NTCC1','2019-10-09T00:00:00Z','2019-10-09T12:00:00Z')
+        ncovered = weather_mc.record_climatology_coverage({(38.09,-122.65):['PG133'],(38.1,-122.6):['PG133','NTCC1'],
+                                                           (38.08,-122.66):[]},4,tlo,thi,self.mydb)
+        self.assertEqual(ncovered,2)
+        self.assertFalse(self.mydb.check_coverage(38.1,-122.6,4,'2019-10-09T00:00:00Z','2019-10-10T00:00:00Z'))
+
+    def tearDown(self):
+        (weather_utils.api,weather_utils.synoptic_client) = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        weather_config.config.remove_section('MCTest')
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
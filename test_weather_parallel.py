@@ -0,0 +1,93 @@
+###
+##  Test suite for weather_parallel.py
+
+import weather_config
+weather_config.init('weather.ini')
+import weather_utils
+import weather_parallel
+import unittest
+import sqlite3
+import os
+
+
+class ParallelEventsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',test_data)
+        self.mydb.add_observations(test_data)
+        self.mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        self.events = [(38.09,-122.65,'2019-10-10T00:37:00Z'),(38.1,-122.6,'2019-10-09T18:05:00Z'),
+                       (38.08,-122.66,weather_utils.TimeUtils('2019-10-10T05:00:00Z')),
+                       (38.09,-122.65,'2019-10-09T12:30:00Z'),(38.11,-122.64,'2019-10-10T09:15:00Z')]
+
+    def test_run_events(self):
+        ttpl = (1,2)
+        gtpl = (2,4)
+        sequential = [weather_utils.get_max_gust(lat,lon,weather_utils.TimeUtils(tm),ttpl,0,gtpl,self.mydb)
+                      for (lat,lon,tm) in self.events]
+        parallel = list(weather_parallel.run_events(self.events,ttpl,0,gtpl,self.mydb,workers=2))
+        self.assertEqual(parallel,sequential)
+        self.assertEqual(list(weather_parallel.run_events(self.events,ttpl,0,gtpl,self.mydb,workers=1)),sequential)
+        specs = [('wind_gust_set_1','max'),('air_temp_set_1','mean')]
+        extremes = list(weather_parallel.run_events(self.events,ttpl,0,gtpl,self.mydb,specs=specs,workers=3))
+        self.assertEqual(extremes,[weather_utils.get_window_extremes(lat,lon,weather_utils.TimeUtils(tm),ttpl,0,gtpl,
+                                                                     specs,self.mydb)
+                                   for (lat,lon,tm) in self.events])
+
+    def test_deferred_writes(self):
+        rodb = weather_parallel.DeferredWriteDB('test/test_weather_data.db')
+        with self.assertRaises(sqlite3.OperationalError):
+            rodb.cursor.execute("DELETE FROM coverage;")
+        rodb.connection.rollback()
+        self.assertTrue(rodb.check_coverage(38.09,-122.65,10,'2019-10-09T06:00:00Z','2019-10-10T00:00:00Z'))
+        rodb.add_coverage(38.09,-122.65,30,'2019-10-11T00:00:00Z','2019-10-12T00:00:00Z')
+        rodb.add_station_coverage('PG035','2019-10-11T00:00:00Z','2019-10-12T00:00:00Z')
+        self.assertFalse(rodb.check_coverage(38.09,-122.65,10,'2019-10-11T06:00:00Z','2019-10-11T12:00:00Z'))
+        writes = rodb.take_writes()
+        self.assertEqual(len(writes),2)
+        self.assertEqual(rodb.take_writes(),[])
+        weather_parallel.replay_writes(writes,self.mydb)
+        self.assertTrue(rodb.check_coverage(38.09,-122.65,10,'2019-10-11T06:00:00Z','2019-10-11T12:00:00Z'))
+        self.assertEqual(rodb.get_station_gaps('PG035','2019-10-11T00:00:00Z','2019-10-12T00:00:00Z'),[])
+        rodb.close()
+
+    def test_deferred_station(self):
+        # A station added in a worker is seen by get_station there, and written on replay
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        station = dict(test_data['STATION'][0])
+        station['STID'] = 'NEW01'
+        rodb = weather_parallel.DeferredWriteDB('test/test_weather_data.db')
+        self.assertEqual(rodb.get_station('NEW01'),{})
+        rodb.add_station({'STATION':[station],'SUMMARY':test_data['SUMMARY']})
+        self.assertEqual(rodb.get_station('NEW01')['STID'],'NEW01')
+        self.assertEqual(rodb.get_station('NEW01')['LATITUDE'],station['LATITUDE'])
+        writes = rodb.take_writes()
+        self.assertEqual([method for (method,args) in writes],['add_station'])
+        self.assertEqual(rodb.get_station('NEW01'),{})
+        weather_parallel.replay_writes(writes,self.mydb)
+        stored = self.mydb.get_station('NEW01')
+        self.assertEqual(set(weather_parallel.station_row(station)) - set(stored),set())
+        rodb.connection.rollback()          # Drop the stale read snapshot
+        self.assertEqual(rodb.get_station('NEW01')['STID'],'NEW01')
+        rodb.close()
+
+    def test_release(self):
+        self.mydb.release()
+        self.assertEqual(self.mydb.connection,None)
+        self.mydb.reconnect()
+        self.assertTrue(self.mydb.check_coverage(38.09,-122.65,10,'2019-10-09T06:00:00Z','2019-10-10T00:00:00Z'))
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,326 @@
+###
+##  Test suite for weather_pipeline.py
+
+import weather_config
+weather_config.init('weather.ini')
+import weather_utils
+import weather_pipeline
+import unittest
+import csv
+import datetime
+import importlib.util
+import json
+import os
+
+
+class ListEventReader(weather_pipeline.EventReader):
+
+    def __init__(self,settings,rows):
+        super().__init__(settings)
+        self.rows = rows
+
+    def header(self):
+        return [['time','latitude','longitude']]
+
+    def events(self):
+        for (irow,(tm,lat,lon)) in enumerate(self.rows):
+            yield weather_pipeline.Event(irow+2,lat,lon,tm,values=[tm,lat,lon])
+
+class ListEventWriter(weather_pipeline.EventWriter):
+
+    def open(self,header):
+        self.header = header
+        self.rows = []
+
+    def write(self,event,result):
+        self.rows.append((event.event_id,result))
+
+    def close(self,complete=True):
+        self.complete = complete
+
+class FailingEventWriter(ListEventWriter):
+
+    def write(self,event,result):
+        if self.rows != []:
+            raise RuntimeError("Disk full")
+        super().write(event,result)
+
+
+class EventTimeTestCase(unittest.TestCase):
+
+    def test_parse_windows(self):
+        self.assertEqual(weather_pipeline.parse_windows('1,2'),(1,2))
+        self.assertEqual(weather_pipeline.parse_windows('72,'),(72,))
+
+    def test_parse_event_time(self):
+        expected = datetime.datetime(2019,10,9,17,37)
+        parse = weather_pipeline.parse_event_time
+        self.assertEqual(parse(expected),expected)
+        self.assertEqual(parse(datetime.datetime(2019,10,9),datetime.time(17,37)),expected)
+        self.assertEqual(parse(datetime.datetime(2019,10,9),'17:37'),expected)
+        self.assertEqual(parse(datetime.datetime(2019,10,9),datetime.datetime(1899,12,30,17,37)),expected)
+        self.assertEqual(parse('2019/10/09','17:37'),expected)
+        self.assertEqual(parse('2019-10-09 17:37'),expected)
+        serial = (expected - datetime.datetime(1899,12,30)).total_seconds()/86400
+        self.assertEqual(parse(serial),expected)
+        self.assertEqual(parse(43747,serial - 43747),expected)
+        self.assertEqual(parse(43747,serial),expected)
+        with self.assertRaises(ValueError):
+            parse(43747,3)
+        with self.assertRaises(ValueError):
+            parse(None)
+
+    def test_normalize_times(self):
+        settings = {'time_zone':'America/Los_Angeles','time_shift':-1.0}
+        event = weather_pipeline.Event(2,38.09,-122.65,datetime.datetime(2019,10,9,17,37))
+        list(weather_pipeline.normalize_times([event],settings))
+        self.assertEqual(event.time.iso(),'2019-10-09T23:37:00Z')
+
+
+class ExcelLayoutTestCase(unittest.TestCase):
+
+    def test_column_index(self):
+        self.assertEqual([weather_pipeline.column_index(col) for col in ('A','z','AB','BA')],[0,25,27,52])
+
+    def test_output_row(self):
+        self.assertEqual(weather_pipeline.output_row([1,2],5,[7,8]),[1,2,None,None,7,8])
+        self.assertEqual(weather_pipeline.output_row([1,2,3,4],2,[9]),[1,9,3,4])
+        self.assertEqual(weather_pipeline.output_row(None,2,[9]),[None,9])
+
+    def test_output_results(self):
+        settings = {'weighted':False,'time_windows':(1,2),'distance_windows':(4,)}
+        event = weather_pipeline.Event(2,38.09,-122.65,None)
+        event.weight = 0.5
+        self.assertEqual(weather_pipeline.output_results(settings,event,[1,2]),[1,2])
+        settings['weighted'] = True
+        self.assertEqual(weather_pipeline.output_results(settings,event,list(range(12))),list(range(12)) + [0.5])
+        self.assertEqual(weather_pipeline.output_results(settings,event,[]),[None]*12 + [0.5])
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',test_data)
+        self.mydb.add_observations(test_data)
+        self.mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        weather_config.config['PipelineTest'] = {'WEATHER_DB':'test/test_weather_data.db',
+                                                 'TIME_WINDOWS':'1,2','DISTANCE_WINDOWS':'2,4,'}
+        self.rows = [(datetime.datetime(2019,10,9,17,37),38.09,-122.65),
+                     (datetime.datetime(2019,10,9,4,5),38.1,-122.6),
+                     (datetime.datetime(2019,10,9,22,0),38.08,-122.66)]
+
+    def test_settings(self):
+        settings = weather_pipeline.load_settings('PipelineTest',{'TIME_OFFSET':'-1','xl_lat_column':'J'})
+        self.assertEqual(settings['time_windows'],(1,2))
+        self.assertEqual(settings['distance_windows'],(2,4))
+        self.assertEqual(settings['time_offset'],-1.0)
+        self.assertEqual(settings['lat_column'],'J')
+        self.assertEqual((settings['reader'],settings['writer'],settings['prefetch']),('excel','excel',True))
+
+    def test_run_pipeline(self):
+        settings = weather_pipeline.load_settings('PipelineTest')
+        expected = []
+        for (tm,lat,lon) in self.rows:
+            utc = weather_utils.TimeUtils(tm.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(hours=7))
+            expected.append(weather_utils.get_max_gust(lat,lon,utc,(1,2),0,(2,4),self.mydb))
+        for workers in (1,2):
+            writer = ListEventWriter(settings)
+            nwritten = weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),writer,
+                                                     workers=workers)
+            self.assertEqual(nwritten,3)
+            self.assertTrue(writer.complete)
+            self.assertEqual(writer.header,[['time','latitude','longitude']])
+            self.assertEqual(writer.rows,[(2,expected[0]),(3,expected[1]),(4,expected[2])])
+        self.assertEqual(len(weather_pipeline.flatten_result(expected[0])),2*2*6)
+
+    def test_writer_closed_on_error(self):
+        settings = weather_pipeline.load_settings('PipelineTest')
+        settings['prefetch'] = False
+        with self.assertRaises(ValueError):
+            weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows + [('bad',38.0,-122.0)]),
+                                          ListEventWriter(settings),workers=1)
+        writer = FailingEventWriter(settings)
+        with self.assertRaises(RuntimeError):
+            weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),writer,workers=1)
+        self.assertEqual(len(writer.rows),1)
+        self.assertFalse(writer.complete)
+
+    def test_checkpoint_resume(self):
+        settings = weather_pipeline.load_settings('PipelineTest',{'CHECKPOINT_FILE':'test/test_events.checkpoint.jsonl'})
+        writer = FailingEventWriter(settings)
+        with self.assertRaises(RuntimeError):
+            weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),writer,workers=1)
+        with open('test/test_events.checkpoint.jsonl') as ledger:
+            records = [json.loads(line) for line in ledger]
+        self.assertEqual([rec.get('id') for rec in records],[None,'2','3'])
+        self.assertEqual(records[1]['result'],writer.rows[0][1])
+        # Mark the recorded result of event 2 and cut the last line short, as a crash would
+        records[1]['result'] = 'recorded'
+        with open('test/test_events.checkpoint.jsonl','w') as ledger:
+            ledger.write(json.dumps(records[0]) + '\n' + json.dumps(records[1]) + '\n' + json.dumps(records[2])[0:20])
+        writer = ListEventWriter(settings)
+        self.assertEqual(weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),writer,
+                                                       workers=1,resume=True),3)
+        self.assertEqual([row[1] for row in writer.rows[0:1]],['recorded'])
+        expected = ListEventWriter(settings)
+        weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),expected,workers=1)
+        self.assertEqual(writer.rows[1:],expected.rows[1:])
+        self.assertFalse(os.path.isfile('test/test_events.checkpoint.jsonl'))
+        # A ledger made with other windows is refused
+        with self.assertRaises(RuntimeError):
+            weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),FailingEventWriter(settings),
+                                          workers=1)
+        settings['time_windows'] = (1,3)
+        with self.assertRaises(ValueError):
+            weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),ListEventWriter(settings),
+                                          workers=1,resume=True)
+        os.remove('test/test_events.checkpoint.jsonl')
+
+    def test_checkpoint_changed_events(self):
+        settings = weather_pipeline.load_settings('PipelineTest',{'CHECKPOINT_FILE':'test/test_events.checkpoint.jsonl'})
+        with self.assertRaises(RuntimeError):
+            weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,self.rows),
+                                          FailingEventWriter(settings),workers=1)
+        with open('test/test_events.checkpoint.jsonl') as ledger:
+            records = [json.loads(line) for line in ledger]
+        self.assertEqual((records[1]['lat'],records[1]['lon'],records[1]['time']),(38.09,-122.65,'2019-10-10T00:37:00Z'))
+        records[1]['result'] = 'recorded'
+        with open('test/test_events.checkpoint.jsonl','w') as ledger:
+            ledger.write(json.dumps(records[0]) + '\n' + json.dumps(records[1]) + '\n')
+        # Row 2 now holds another event, whose recorded result must not be reused
+        rows = [(self.rows[0][0],38.1,-122.6)] + self.rows[1:]
+        writer = ListEventWriter(settings)
+        weather_pipeline.run_pipeline(settings,self.mydb,ListEventReader(settings,rows),writer,workers=1,resume=True)
+        self.assertNotEqual(writer.rows[0][1],'recorded')
+        # Other input settings are refused, as is a ledger without a readable settings line
+        for (content,overrides) in ((json.dumps(records[0]) + '\n',{'TIME_ZONE':'UTC'}),
+                                    (json.dumps(records[0]) + '\n',{'FIRST_ROW':'3'}),
+                                    ('{"settings": \n' + json.dumps(records[1]) + '\n',{}),
+                                    ('',{})):
+            with open('test/test_events.checkpoint.jsonl','w') as ledger:
+                ledger.write(content)
+            other = weather_pipeline.load_settings('PipelineTest',dict(overrides,CHECKPOINT_FILE='test/test_events.checkpoint.jsonl'))
+            with self.assertRaises(ValueError):
+                weather_pipeline.run_pipeline(other,self.mydb,ListEventReader(other,self.rows),ListEventWriter(other),
+                                              workers=1,resume=True)
+        os.remove('test/test_events.checkpoint.jsonl')
+
+    @unittest.skipUnless(importlib.util.find_spec('openpyxl'),'openpyxl is not installed')
+    def test_excel_stream(self):
+        from openpyxl import Workbook, load_workbook
+        wbk = Workbook()
+        sheet = wbk.active
+        sheet.title = 'Events'
+        sheet.append(['Id','Date','Time','Latitude','Longitude'])
+        for (irow,(tm,lat,lon)) in enumerate(self.rows):
+            sheet.append([irow+1,tm.replace(hour=0,minute=0),tm.time(),lat,lon])
+        wbk.save('test/test_events.xlsx')
+        settings = weather_pipeline.load_settings('PipelineTest',{'XL_DATA_FILE':'test/test_events.xlsx',
+                                                                  'XL_OUTPUT_FILE':'test/test_events_out.xlsx',
+                                                                  'XL_INPUT_SHEET':'Events','XL_OUTPUT_SHEET':'Wind',
+                                                                  'XL_DATE_COLUMN':'B','XL_TIME_COLUMN':'C',
+                                                                  'XL_LAT_COLUMN':'D','XL_LONG_COLUMN':'E',
+                                                                  'FREE_CELL':'7'})
+        self.assertEqual(weather_pipeline.run_pipeline(settings,self.mydb,workers=1),3)
+        out = load_workbook('test/test_events_out.xlsx',read_only=True)
+        rows = list(out['Wind'].iter_rows(values_only=True))
+        self.assertEqual(out.sheetnames,['Wind'])
+        self.assertEqual(rows[0][0:5],('Id','Date','Time','Latitude','Longitude'))
+        self.assertEqual(len(rows),4)
+        self.assertEqual(rows[1][3:5],(38.09,-122.65))
+        self.assertEqual(rows[1][5],None)
+        self.assertEqual(len(rows[1]),6 + 2*2*6)
+        out.close()
+        for xlfile in ('test/test_events.xlsx','test/test_events_out.xlsx'):
+            os.remove(xlfile)
+
+    @unittest.skipUnless(importlib.util.find_spec('openpyxl'),'openpyxl is not installed')
+    def test_excel_in_place(self):
+        from openpyxl import Workbook, load_workbook
+        from openpyxl.styles import Font
+        wbk = Workbook()
+        sheet = wbk.active
+        sheet.title = 'Events'
+        sheet.append(['Ignitions 2019'])
+        sheet['A1'].font = Font(bold=True)
+        sheet.append(['Id','Date','Time','Latitude','Longitude'])
+        for (irow,(tm,lat,lon)) in enumerate(self.rows):
+            sheet.append([irow+1,tm.replace(hour=0,minute=0),tm.time(),lat,lon])
+        sheet.append([])
+        sheet.append(['Source: utility data request'])
+        wbk.create_sheet('Notes')['A1'] = 'Keep me'
+        wbk.save('test/test_events.xlsx')
+        overrides = {'XL_DATA_FILE':'test/test_events.xlsx','XL_INPUT_SHEET':'Events','XL_OUTPUT_SHEET':'Wind',
+                     'XL_DATE_COLUMN':'B','XL_TIME_COLUMN':'C','XL_LAT_COLUMN':'D','XL_LONG_COLUMN':'E',
+                     'FIRST_ROW':'3','LAST_ROW':'5','FREE_CELL':'7'}
+        self.assertEqual(weather_pipeline.run_section('PipelineTest',overrides,workers=1,prefetch=False),3)
+        out = load_workbook('test/test_events.xlsx')
+        self.assertEqual(out.sheetnames,['Events','Notes','Wind'])
+        self.assertEqual(out['Notes']['A1'].value,'Keep me')
+        self.assertEqual(out['Events'].max_column,5)
+        wind = out['Wind']
+        self.assertEqual(wind['A1'].value,'Ignitions 2019')
+        self.assertTrue(wind['A1'].font.bold)
+        self.assertEqual(wind['A2'].value,'Id')
+        self.assertEqual(wind['A7'].value,'Source: utility data request')
+        self.assertEqual(wind['G7'].value,None)
+        for (irow,(tm,lat,lon)) in enumerate(self.rows):
+            utc = weather_utils.TimeUtils(tm.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(hours=7))
+            expected = weather_pipeline.flatten_result(weather_utils.get_max_gust(lat,lon,utc,(1,2),0,(2,4),self.mydb))
+            values = [cell.value for cell in wind[irow+3]]
+            self.assertEqual(values[0:5:3],[irow+1,lat])
+            self.assertEqual(values[5],None)
+            self.assertEqual(values[6:6+len(expected)],expected)
+            self.assertEqual(values[6+len(expected):],[None]*(2*2*6 - len(expected)))
+        out.close()
+        os.remove('test/test_events.xlsx')
+
+    def test_event_tables(self):
+        with open('test/test_events.csv','w',newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['id','time','lat','lon'])
+            writer.writerow(['A','2019-10-10T00:37:00Z','38.09','-122.65'])
+            writer.writerow(['B','2019-10-09 21:05','38.1','-122.6'])      # Local time
+        settings = weather_pipeline.load_settings('PipelineTest',{'EVENT_READER':'csv','EVENT_WRITER':'csv',
+                                                                  'EVENT_FILE':'test/test_events.csv',
+                                                                  'EVENT_OUTPUT_FILE':'test/test_events_out.csv'})
+        self.assertEqual(weather_pipeline.run_pipeline(settings,self.mydb,workers=1),2)
+        with open('test/test_events_out.csv',newline='') as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        self.assertEqual([(row['id'],row['time']) for row in rows],[('A','2019-10-10T00:37:00Z'),('B','2019-10-10T04:05:00Z')])
+        expected = weather_utils.get_max_gust(38.09,-122.65,weather_utils.TimeUtils('2019-10-10T00:37:00Z'),(1,2),0,(2,4),
+                                              self.mydb)
+        self.assertEqual(rows[0]['max_gust_2h_4mi'],str(expected[1][1][4]))
+        self.assertEqual(rows[0]['stid_1h_2mi'],str(expected[0][0][0] or ''))
+        self.assertEqual(len(rows[0]),4 + 2*2*6)
+        if importlib.util.find_spec('pyarrow'):
+            import pyarrow.parquet as pq
+            self.assertEqual(weather_pipeline.convert_events(settings,'test/test_events.parquet'),2)
+            settings = weather_pipeline.load_settings('PipelineTest',{'EVENT_READER':'parquet','EVENT_WRITER':'parquet',
+                                                                      'EVENT_FILE':'test/test_events.parquet',
+                                                                      'EVENT_OUTPUT_FILE':'test/test_events_out.parquet'})
+            self.assertEqual(weather_pipeline.run_pipeline(settings,self.mydb,workers=1),2)
+            table = pq.read_table('test/test_events_out.parquet').to_pydict()
+            self.assertEqual(table['id'],['A','B'])
+            self.assertEqual(table['max_gust_2h_4mi'][0],expected[1][1][4])
+            self.assertEqual(table['count_2h_4mi'][0],expected[1][1][5])
+            os.remove('test/test_events.parquet')
+            os.remove('test/test_events_out.parquet')
+        for csvname in ('test/test_events.csv','test/test_events_out.csv'):
+            os.remove(csvname)
+
+    def tearDown(self):
+        weather_config.config.remove_section('PipelineTest')
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,8 +5,10 @@ import weather_config
 weather_config.init('weather.ini')
 import weather_utils
 import unittest
+import numpy as np
 import os
 import sqlite3
+import zulu
 
 
 
@@ -99,6 +101,30 @@ class TimeUtilsTest(unittest.TestCase):
         tudt1 = weather_utils.TimeUtils(dt1)
         sydt1 = tudt1.synop()
         self.assertEqual(sydt1,'201910100340')
+
+    def test_fast_path(self):
+        # The fixed formats give the same times as the general parser, other formats still parse
+        for dt in ('2019-10-10T03:40:07Z','201910092311'):
+            self.assertEqual(weather_utils.TimeUtils(dt).datetime,weather_utils.parse_time_string(dt))
+        self.assertEqual(weather_utils.TimeUtils('2019-10-10T03:40:07Z').datetime,zulu.parse('2019-10-10T03:40:07Z'))
+        self.assertEqual(weather_utils.TimeUtils('2019-10-10T03:40:07+00:00').iso(),'2019-10-10T03:40:07Z')
+        self.assertEqual(weather_utils.TimeUtils('20191009').iso(),'2019-10-09T00:00:00Z')
+        for dt in ('2019-13-10T03:40:00Z','201913092311'):
+            with self.assertRaises(ValueError):
+                weather_utils.TimeUtils(dt)
+        hits = weather_utils.parse_time_string.cache_info().hits
+        weather_utils.TimeUtils('201910092311')
+        self.assertEqual(weather_utils.parse_time_string.cache_info().hits,hits + 1)
+
+    def test_epoch_time(self):
+        et = weather_utils.EpochTime.parse('201910092311')
+        self.assertEqual(et.epoch,1570662660)
+        self.assertEqual((et.iso(),et.synop()),('2019-10-09T23:11:00Z','201910092311'))
+        self.assertEqual(et.timeutils().iso(),'2019-10-09T23:11:00Z')
+        self.assertEqual(weather_utils.EpochTime.parse('2019-10-09T23:11:00Z'),et)
+        self.assertTrue(et < weather_utils.EpochTime(et.epoch + 1))
+        with self.assertRaises(AttributeError):
+            et.zone = 'UTC'             # No __dict__
         
 class WeatherDBTest(unittest.TestCase):
 
@@ -317,6 +343,216 @@ class TestGetStationBySTIDTestCase(unittest.TestCase):
             pass
         
 
+class StationsWithinTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        self.test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        db_name = 'test/test_weather_data.db'
+        self.mydb = weather_utils.WeatherDB.create(db_name,self.test_data)
+        self.mydb.add_station(self.test_data)
+
+    def test_stations_within(self):
+        stdist = self.mydb.stations_within(38.09,-122.65,3)
+        self.assertEqual([st for (st,dist) in stdist],['PG035','PG133','PG087','E0433'])
+        self.assertAlmostEqual(stdist[3][1],2.52,places=2)
+        stdist = self.mydb.stations_within(38.09,-122.65,2)
+        self.assertEqual([st for (st,dist) in stdist],['PG035'])
+
+    def test_connection_profile(self):
+        self.mydb.cursor.execute('PRAGMA journal_mode;')
+        self.assertEqual(self.mydb.cursor.fetchone()[0],'wal')
+        sql = "EXPLAIN QUERY PLAN SELECT max(wind_gust_set_1) FROM observations WHERE stid = 'PG133' \
+        AND date_time BETWEEN '2019-10-09T23:00:00Z' AND '2019-10-10T01:00:00Z';"
+        self.mydb.cursor.execute(sql)
+        plan = ' '.join(str(row[-1]) for row in self.mydb.cursor.fetchall())
+        self.assertIn('COVERING INDEX observations_gust',plan)
+        self.mydb.analyze()
+        self.mydb.optimize()
+        self.mydb.cursor.execute("SELECT count(*) FROM sqlite_master WHERE name='sqlite_stat1';")
+        self.assertEqual(self.mydb.cursor.fetchone()[0],1)
+
+    def test_index_on_reopen(self):
+        self.mydb.close()
+        self.mydb = weather_utils.WeatherDB('test/test_weather_data.db')
+        self.mydb.cursor.execute('SELECT count(*) FROM station_rtree;')
+        (count,) = self.mydb.cursor.fetchone()
+        self.assertEqual(count,4)
+        self.assertEqual(len(self.mydb.stations_within(38.09,-122.65,3)),4)
+
+    def test_index_payload_only(self):
+        self.mydb.cursor.execute("DELETE FROM station_rtree WHERE sid = (SELECT sid FROM station WHERE stid='PG087');")
+        self.mydb.add_station({'STATION':[st for st in self.test_data['STATION'] if st['STID'] == 'PG035']})
+        self.assertEqual([st for (st,dist) in self.mydb.stations_within(38.09,-122.65,3)],['PG035','PG133','E0433'])
+        self.mydb.close()
+        self.mydb = weather_utils.WeatherDB('test/test_weather_data.db')
+        self.assertEqual(len(self.mydb.stations_within(38.09,-122.65,3)),4)
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+class BulkIngestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        self.test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',self.test_data)
+
+    def test_add_observations(self):
+        self.mydb.add_observations(self.test_data)       # Stations are added in the same transaction
+        self.mydb.cursor.execute('SELECT count(*) FROM station;')
+        self.assertEqual(self.mydb.cursor.fetchone()[0],4)
+        nobs = sum(len(st['OBSERVATIONS']['date_time']) for st in self.test_data['STATION'])
+        self.mydb.cursor.execute('SELECT count(*) FROM observations;')
+        self.assertEqual(self.mydb.cursor.fetchone()[0],nobs)
+        obs = self.mydb.get_observations('PG035','2019-10-10T00:10:00Z','2019-10-10T00:10:00Z')
+        self.assertEqual(obs[0]['WIND_GUST_SET_1'],5.42)
+        self.mydb.add_observations(self.test_data['STATION'][0])    # Single station, duplicates ignored
+        self.mydb.cursor.execute('SELECT count(*) FROM observations;')
+        self.assertEqual(self.mydb.cursor.fetchone()[0],nobs)
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+class StationCoverageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',test_data)
+
+    def test_merge_and_gaps(self):
+        self.mydb.add_station_coverage('PG133','2019-10-01T00:00:00Z','2019-10-05T00:00:00Z')
+        self.mydb.add_station_coverage('PG133','2019-10-10T00:00:00Z','2019-10-12T00:00:00Z')
+        self.mydb.add_station_coverage('PG133','2019-10-05T00:00:00Z','2019-10-06T00:00:00Z')
+        self.mydb.add_station_coverage('PG035','2019-10-06T00:00:00Z','2019-10-10T00:00:00Z')
+        self.mydb.cursor.execute("SELECT count(*) FROM station_coverage WHERE stid = 'PG133';")
+        (count,) = self.mydb.cursor.fetchone()
+        self.assertEqual(count,2)
+        gaps = self.mydb.get_station_gaps('PG133','2019-09-30T00:00:00Z','2019-10-11T00:00:00Z')
+        self.assertEqual(gaps,[('2019-09-30T00:00:00Z','2019-10-01T00:00:00Z'),
+                               ('2019-10-06T00:00:00Z','2019-10-10T00:00:00Z')])
+        self.assertEqual(self.mydb.get_station_gaps('PG133','2019-10-02T00:00:00Z','2019-10-04T00:00:00Z'),[])
+
+    def test_fetch_chunks(self):
+        self.mydb.add_station_coverage('PG133','2019-03-01T00:00:00Z','2019-10-01T00:00:00Z')
+        t1 = weather_utils.TimeUtils('2019-01-01T00:00:00Z')
+        t2 = weather_utils.TimeUtils('2019-10-15T00:00:00Z')
+        chunks = weather_utils.get_station_fetch_chunks('PG133',t1,t2,self.mydb)
+        self.assertEqual([(clo.iso(),chi.iso()) for (clo,chi) in chunks],
+                         [('2019-01-01T00:00:00Z','2019-01-31T00:00:00Z'),
+                          ('2019-01-31T00:00:00Z','2019-03-01T00:00:00Z'),
+                          ('2019-10-01T00:00:00Z','2019-10-15T00:00:00Z')])
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+class CoverageLedgerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        self.test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        db_name = 'test/test_weather_data.db'
+        self.mydb = weather_utils.WeatherDB.create(db_name,self.test_data)
+        self.mydb.add_observations(self.test_data)
+
+    def test_haversine(self):
+        # PG035 is reported by Synoptic at 1.63 miles from the query point
+        dist = weather_utils.haversine(38.09,-122.65,38.07679,-122.67475)
+        self.assertAlmostEqual(dist,1.63,places=2)
+
+    def test_not_covered(self):
+        t1 = weather_utils.TimeUtils('2019-10-09T23:00:00Z')
+        t2 = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+        obs = weather_utils.check_db_radius_datetime(38.09,-122.65,3,t1,t2,self.mydb)
+        self.assertFalse(obs)
+
+    def test_covered_by_union(self):
+        self.mydb.add_coverage(38.09,-122.65,5,'2019-10-09T23:00:00Z','2019-10-10T00:00:00Z')
+        self.mydb.add_coverage(38.09,-122.65,5,'2019-10-09T23:50:00Z','2019-10-10T02:00:00Z')
+        t1 = weather_utils.TimeUtils('2019-10-09T23:00:00Z')
+        t2 = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+        obs = weather_utils.check_db_radius_datetime(38.09,-122.65,3,t1,t2,self.mydb)
+        self.assertEqual(obs['SUMMARY']['NUMBER_OF_OBJECTS'],4)
+        self.assertEqual(obs['STATION'][0]['STID'],'PG035')
+        self.assertEqual(obs['STATION'][0]['DISTANCE'],1.63)
+        self.assertEqual(obs['STATION'][0]['OBSERVATIONS']['date_time'][0],'2019-10-09T23:00:00Z')
+        self.assertEqual(len(obs['STATION'][0]['OBSERVATIONS']['date_time']),13)
+        # The overlapping windows of the footprint are merged into one ledger row
+        self.mydb.add_coverage(38.09,-122.65,5,'2019-10-10T03:00:00Z','2019-10-10T04:00:00Z')
+        self.mydb.cursor.execute('SELECT start, stop FROM coverage WHERE radius = 5 ORDER BY start;')
+        self.assertEqual(self.mydb.cursor.fetchall(),[('2019-10-09T23:00:00Z','2019-10-10T02:00:00Z'),
+                                                      ('2019-10-10T03:00:00Z','2019-10-10T04:00:00Z')])
+        self.mydb.cursor.execute('EXPLAIN QUERY PLAN SELECT rowid FROM coverage WHERE latitude = 1 AND longitude = 2 \
+        AND radius = 3 AND stop >= 4 AND start <= 5;')
+        self.assertIn('coverage_footprint',' '.join(str(row[-1]) for row in self.mydb.cursor.fetchall()))
+
+    def test_observations_columns(self):
+        cols = self.mydb.get_observations_columns(['PG133','PG035'],'2019-10-09T23:00:00Z',
+                                                  '2019-10-10T01:00:00Z',['wind_gust_set_1','air_temp_set_1'])
+        self.assertEqual(cols['stids'],['PG133','PG035'])
+        self.assertEqual(len(cols['epoch']),len(cols['station']))
+        self.assertEqual(int((cols['station'] == 1).sum()),13)
+        self.assertTrue((np.diff(cols['station']) >= 0).all())
+        obs = self.mydb.get_observations('PG035','2019-10-09T23:00:00Z','2019-10-10T01:00:00Z')
+        ipg035 = cols['station'] == 1
+        self.assertEqual(list(cols['epoch'][ipg035]),
+                         list(weather_utils.epoch_seconds([ob['DATE_TIME'] for ob in obs])))
+        self.assertEqual(list(cols['air_temp_set_1'][ipg035]),[ob['AIR_TEMP_SET_1'] for ob in obs])
+        with self.assertRaises(ValueError):
+            self.mydb.get_observations_columns('PG035','2019-10-09T23:00:00Z','2019-10-10T01:00:00Z',['stid'])
+
+    def test_observation_arrays(self):
+        # Arrays read from the columns match those converted from the API format
+        wmobs = self.mydb.get_observations_by_radius(38.09,-122.65,3,'2019-10-09T23:00:00Z','2019-10-10T01:00:00Z')
+        (starr,stpos) = self.mydb.get_observation_arrays(38.09,-122.65,3,'2019-10-09T23:00:00Z','2019-10-10T01:00:00Z')
+        expected = weather_utils.observation_arrays(wmobs)
+        self.assertEqual([st[0:3] for st in starr],[st[0:3] for st in expected])
+        for (st,ex) in zip(starr,expected):
+            self.assertEqual(list(st[3]),list(ex[3]))
+            np.testing.assert_array_equal(st[4],ex[4])
+            self.assertEqual(st[5],None)
+            self.assertEqual(weather_utils.iso_times(st[3]),ex[5])
+        self.assertEqual(set(stpos.keys()),set(st[0] for st in starr))
+
+    def test_footprint_not_contained(self):
+        self.mydb.add_coverage(38.09,-122.65,5,'2019-10-09T23:00:00Z','2019-10-10T02:00:00Z')
+        t1 = weather_utils.TimeUtils('2019-10-09T23:00:00Z')
+        t2 = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+        obs = weather_utils.check_db_radius_datetime(38.15,-122.65,3,t1,t2,self.mydb)
+        self.assertFalse(obs)
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
 class GetMaxGustTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -336,7 +572,7 @@ class GetMaxGustTestCase(unittest.TestCase):
         lat = 38.801857
         lon = -122.817551
         tm = weather_utils.TimeUtils('201609251734')
-        mg = weather_utils.get_max_gust(lat,lon,tm,ttpl,gtpl,self.mydb)
+        mg = weather_utils.get_max_gust(lat,lon,tm,ttpl,0,gtpl,self.mydb)
         self.assertEqual(mg[0][1][0],'HWKC1')
         self.assertEqual(mg[1][1][4]/mg[0][1][4],2)  # Should be double in tm window
 
@@ -346,5 +582,219 @@ class GetMaxGustTestCase(unittest.TestCase):
         except:
             pass
         
+class MaxGustKernelTestCase(unittest.TestCase):
+
+    def test_max_gust_kernel(self):
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        ttpl = (1,2)
+        gtpl = (2,3)
+        tm = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+        starr = weather_utils.observation_arrays(test_data)
+        mg = weather_utils.max_gust_kernel(starr,weather_utils.get_time_bins(tm,ttpl),ttpl,gtpl)
+        self.assertEqual(mg[0][0],['PG035','229',1.63,'2019-10-10T00:10:00Z',5.42,13])
+        self.assertEqual(mg[1][1],['PG133','229',2.17,'2019-10-09T23:20:00Z',7.42,109])
+
+class WindowExtremesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        self.test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',self.test_data)
+        self.mydb.add_observations(self.test_data)
+        self.mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        self.specs = [('air_temp_set_1','max'),('relative_humidity_set_1','min'),('wind_speed_set_1','mean'),
+                      ('wind_gust_set_1','p95'),('wind_gust_set_1','max')]
+
+    def test_window_extremes_kernel(self):
+        ttpl = (1,2)
+        gtpl = (2,3)
+        tm = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+        starr = weather_utils.observation_arrays(self.test_data,[spec[0] for spec in self.specs])
+        ex = weather_utils.window_extremes_kernel(starr,weather_utils.get_time_bins(tm,ttpl),ttpl,gtpl,self.specs)
+        self.assertEqual(ex[1][1][4],['PG133','229',2.17,'2019-10-09T23:20:00Z',7.42,109])   # As max_gust_kernel
+        # Pooled readings of every station within 3 miles, 2019-10-09T22:30Z to 2019-10-10T02:30Z
+        readings = {var:[] for (var,reducer) in self.specs}
+        for st in self.test_data['STATION']:
+            obs = st['OBSERVATIONS']
+            for (i,dt) in enumerate(obs['date_time']):
+                if '2019-10-09T22:30:00Z' <= dt <= '2019-10-10T02:30:00Z':
+                    for var in readings:
+                        if obs.get(var,[None]*(i+1))[i] != None:
+                            readings[var].append(obs[var][i])
+        self.assertEqual(ex[1][1][0][4],max(readings['air_temp_set_1']))
+        self.assertEqual(ex[1][1][1][4],min(readings['relative_humidity_set_1']))
+        self.assertAlmostEqual(ex[1][1][2][4],np.mean(readings['wind_speed_set_1']))
+        self.assertEqual(ex[1][1][2][0:4],[None,None,None,None])
+        self.assertAlmostEqual(ex[1][1][3][4],np.percentile(readings['wind_gust_set_1'],95))
+        self.assertEqual(ex[1][1][3][5],len(readings['wind_gust_set_1']))
+
+    def test_database_matches_api_format(self):
+        ttpl = (1,2)
+        gtpl = (2,3)
+        tm = weather_utils.TimeUtils('2019-10-10T00:37:00Z')
+        ex = weather_utils.get_window_extremes(38.09,-122.65,tm,ttpl,0,gtpl,self.specs,self.mydb)
+        (tlo,thi) = weather_utils.get_event_window(tm,ttpl,0)
+        wmobs = self.mydb.get_observations_by_radius(38.09,-122.65,3,tlo.iso(),thi.iso())
+        starr = weather_utils.observation_arrays(wmobs,[spec[0] for spec in self.specs])
+        self.assertEqual(ex,weather_utils.window_extremes_kernel(starr,weather_utils.get_time_bins(tm,ttpl),ttpl,gtpl,self.specs))
+        mg = weather_utils.get_max_gust(38.09,-122.65,tm,ttpl,0,gtpl,self.mydb)
+        self.assertEqual([[cells[4] for cells in row] for row in ex],mg)
+
+    def test_reducers(self):
+        self.assertEqual(weather_utils.parse_reducer(('wind_gust_set_1','P99.5')),('wind_gust_set_1','percentile',99.5))
+        with self.assertRaises(ValueError):
+            weather_utils.parse_reducer(('wind_gust_set_1','median'))
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+class MaxGustBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        db_name = 'test/test_weather_data.db'
+        self.mydb = weather_utils.WeatherDB.create(db_name,test_data)
+        self.mydb.add_observations(test_data)
+        # Mark the test data as fetched so that no API calls are needed
+        self.mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+
+    def test_batch_matches_single(self):
+        ttpl = (1,2)
+        gtpl = (2,3)
+        events = [(38.09,-122.65,weather_utils.TimeUtils('2019-10-10T01:00:00Z')),
+                  (38.10,-122.66,'2019-10-10T00:30:00Z'),
+                  (38.25,-122.65,weather_utils.TimeUtils('2019-10-10T01:00:00Z'))]
+        mgb = weather_utils.get_max_gust_batch(events,ttpl,0,gtpl,self.mydb)
+        for (ievt,(lat,lon,tm)) in enumerate(events):
+            mg = weather_utils.get_max_gust(lat,lon,weather_utils.TimeUtils(tm),ttpl,0,gtpl,self.mydb)
+            self.assertEqual(mgb[ievt],mg)
+        self.assertEqual(mgb[0][1][1][0],'E0433')
+        self.assertEqual(mgb[2][1][1][5],0)
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+class HourlyRollupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+        self.test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.mydb = weather_utils.WeatherDB.create('test/test_weather_data.db',self.test_data)
+
+    def hourly_rows(self):
+        self.mydb.cursor.execute('SELECT * FROM hourly ORDER BY stid, hour;')
+        return self.mydb.cursor.fetchall()
+
+    def test_incremental(self):
+        # Add each station's observations in two overlapping parts, splitting within an hour
+        for station in self.test_data['STATION']:
+            part = dict(station)
+            part['OBSERVATIONS'] = {k:v[0:20] for (k,v) in station['OBSERVATIONS'].items()}
+            self.mydb.add_observations(part)
+        self.mydb.add_observations(self.test_data)
+        rows = self.hourly_rows()
+        self.mydb.rebuild_rollup()
+        self.assertEqual(rows,self.hourly_rows())
+        gusts = [st for st in self.test_data['STATION'] if st['STID'] == 'PG035'][0]['OBSERVATIONS']['wind_gust_set_1']
+        gusts = [g for g in gusts if g != None]
+        cols = self.mydb.get_rollup_columns(['PG035'],0,2**40)
+        self.assertEqual(int(cols['max_gust_count'].sum()),len(gusts))
+        self.assertEqual(float(np.nanmax(cols['max_gust'])),max(gusts))
+
+    def test_max_gust_rollup(self):
+        self.mydb.add_observations(self.test_data)
+        self.mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        ttpl = (2,4)
+        gtpl = (2,3)
+        for offset in (-1,0,1):
+            tm = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+            (tlo,thi) = weather_utils.get_event_window(tm,ttpl,offset)
+            mgr = weather_utils.get_max_gust_rollup(38.09,-122.65,tm,ttpl,gtpl,tlo,thi,self.mydb)
+            self.assertNotEqual(mgr,None)
+            self.assertEqual(mgr,weather_utils.get_max_gust(38.09,-122.65,tm,ttpl,offset,gtpl,self.mydb,rollup=False))
+        # Not on the hour
+        tm = weather_utils.TimeUtils('2019-10-10T00:30:00Z')
+        (tlo,thi) = weather_utils.get_event_window(tm,ttpl,0)
+        self.assertEqual(weather_utils.get_max_gust_rollup(38.09,-122.65,tm,ttpl,gtpl,tlo,thi,self.mydb),None)
+
+    def tearDown(self):
+        self.mydb.close()
+        try:
+            os.remove('test/test_weather_data.db')
+        except:
+            pass
+
+class EpochTimesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        for db_name in ('test/test_weather_data.db','test/test_weather_epoch.db'):
+            try:
+                os.remove(db_name)
+            except:
+                pass
+        test_data = eval(open('test/test_novato_1.dat', 'r').read())
+        self.isodb = weather_utils.WeatherDB.create('test/test_weather_data.db',test_data,epoch_times=False)
+        self.isodb.add_observations(test_data)
+        self.epochdb = weather_utils.WeatherDB.create('test/test_weather_epoch.db',test_data,epoch_times=True)
+        self.epochdb.add_observations(test_data)
+        self.t1 = '2019-10-09T23:00:00Z'
+        self.t2 = '2019-10-10T01:00:00Z'
+
+    def test_epoch_storage(self):
+        self.assertFalse(self.isodb.epoch_times)
+        self.assertTrue(self.epochdb.epoch_times)
+        self.epochdb.cursor.execute("SELECT DISTINCT typeof(date_time) FROM observations;")
+        self.assertEqual(self.epochdb.cursor.fetchall(),[('integer',)])
+        self.assertEqual(self.epochdb.get_observations('PG035',self.t1,self.t2),
+                         self.isodb.get_observations('PG035',self.t1,self.t2))
+        self.assertEqual(self.epochdb.get_observations_by_radius(38.09,-122.65,3,self.t1,self.t2),
+                         self.isodb.get_observations_by_radius(38.09,-122.65,3,self.t1,self.t2))
+
+    def test_max_gust(self):
+        tm = weather_utils.TimeUtils('2019-10-10T01:00:00Z')
+        for mydb in (self.isodb,self.epochdb):
+            mydb.add_coverage(38.09,-122.65,30,'2019-10-09T00:00:00Z','2019-10-11T00:00:00Z')
+        self.assertEqual(weather_utils.get_max_gust(38.09,-122.65,tm,(1,2),0,(2,3),self.epochdb),
+                         weather_utils.get_max_gust(38.09,-122.65,tm,(1,2),0,(2,3),self.isodb))
+
+    def test_migrate(self):
+        expected = self.isodb.get_observations_by_radius(38.09,-122.65,3,self.t1,self.t2)
+        self.isodb.migrate_epoch_times()
+        self.isodb.close()
+        self.isodb = weather_utils.WeatherDB('test/test_weather_data.db')
+        self.assertTrue(self.isodb.epoch_times)
+        self.assertEqual(self.isodb.get_observations_by_radius(38.09,-122.65,3,self.t1,self.t2),expected)
+        self.isodb.cursor.execute("SELECT count(*) FROM observations WHERE typeof(date_time) != 'integer';")
+        self.assertEqual(self.isodb.cursor.fetchone()[0],0)
+        self.isodb.cursor.execute("SELECT count(*) FROM sqlite_master WHERE name IN ('observations_date_time','observations_gust');")
+        self.assertEqual(self.isodb.cursor.fetchone()[0],2)
+
+    def tearDown(self):
+        for mydb in (self.isodb,self.epochdb):
+            mydb.close()
+        for db_name in ('test/test_weather_data.db','test/test_weather_epoch.db'):
+            try:
+                os.remove(db_name)
+            except:
+                pass
+
 if __name__ == '__main__':
     unittest.main()
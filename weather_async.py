@@ -0,0 +1,103 @@
+# Module for concurrent prefetching of Synoptic observations into a WeatherDB.
+#
+# Runs are otherwise latency bound: each spreadsheet row waits for its API response before the next
+# row starts. prefetch_observations issues a list of requests concurrently, up to a limit, and writes
+# each response into the database from a single writer, so that sqlite only ever sees one writer.
+# Radius queries are recorded in the coverage ledger, so the synchronous functions in weather_utils
+# then answer them from the database.
+#
+import weather_config
+import weather_utils
+import asyncio
+import concurrent.futures
+import logging
+
+def get_fetch_concurrency():
+    # Maximum number of requests in flight, from FETCH_CONCURRENCY in the [Default] section
+    return int(weather_config.config['Default'].get('FETCH_CONCURRENCY','8'))
+
+def prefetch_observations(fetch_requests,db_object,concurrency=None):
+    # Fetch observations for a list of requests concurrently and store them in db_object.
+    # Each request is either a radius request (latitude, longitude, radius, firstdt, lastdt) or a
+    # station request (stid, firstdt, lastdt), with times as TimeUtils objects or anything TimeUtils
+    # accepts. Radius requests already covered by the coverage ledger are skipped, and station
+    # requests are reduced to the chunked gaps in the station coverage ledger.
+    # Returns (number of requests fetched, list of requests that failed). Failed requests are left
+    # for the synchronous functions to retry.
+    if concurrency == None:
+        concurrency = get_fetch_concurrency()
+    return asyncio.run(prefetch_observations_async(fetch_requests,db_object,concurrency))
+
+async def prefetch_observations_async(fetch_requests,db_object,concurrency):
+    pending = []
+    for freq in fetch_requests:
+        freq = _normalize_request(freq)
+        if len(freq) == 5:
+            if not db_object.check_coverage(freq[0],freq[1],freq[2],
+                                            weather_utils.EpochTime.parse(freq[3].synop()).iso(),
+                                            weather_utils.EpochTime.parse(freq[4].synop()).iso()):
+                pending.append(freq)
+        else:
+            # Only the gaps in the station coverage ledger, in chunks
+            chunks = weather_utils.get_station_fetch_chunks(freq[0],freq[1],freq[2],db_object)
+            pending.extend((freq[0],clo,chi) for (clo,chi) in chunks)
+    logging.info("Prefetching " + str(len(pending)) + " requests for " + str(len(fetch_requests)) + " asked")
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+    failed = []
+    client = weather_utils.get_synoptic_client()
+    url = weather_utils.get_base_api_request_url('timeseries')
+
+    async def fetch(freq):
+        async with semaphore:
+            try:
+                data = await loop.run_in_executor(executor,client.get,url,_api_arguments(freq))
+            except Exception as e:
+                logging.warning("Prefetch of " + str(freq) + " failed: " + str(e))
+                failed.append(freq)
+                return
+        await queue.put((freq,data))
+
+    async def writer():
+        nwritten = 0
+        while True:
+            item = await queue.get()
+            if item == None:
+                return nwritten
+            (freq,data) = item
+            try:
+                _store(freq,data,db_object)
+                nwritten += 1
+            except Exception as e:
+                logging.warning("Storing " + str(freq) + " failed: " + str(e))
+                failed.append(freq)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        writer_task = asyncio.create_task(writer())
+        await asyncio.gather(*[fetch(freq) for freq in pending])
+        await queue.put(None)
+        nwritten = await writer_task
+    return (nwritten,failed)
+
+def _normalize_request(freq):
+    # Convert request times to TimeUtils objects
+    freq = tuple(freq)
+    if len(freq) not in (3,5):
+        raise ValueError("Unrecognized prefetch request " + str(freq))
+    times = tuple(dt if isinstance(dt,weather_utils.TimeUtils) else weather_utils.TimeUtils(dt)
+                  for dt in freq[-2:])
+    return freq[:-2] + times
+
+def _api_arguments(freq):
+    if len(freq) == 5:
+        return weather_utils.get_radius_api_arguments(*freq)
+    (stid,firstdt,lastdt) = freq
+    return {"start":firstdt.synop(),"end":lastdt.synop(),"stid":stid,"units":weather_utils.units}
+
+def _store(freq,data,db_object):
+    if len(freq) == 5:
+        weather_utils.store_radius_observations(data,*freq,db_object)
+    else:
+        weather_utils.store_station_observations(data,*freq,db_object)
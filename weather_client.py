@@ -0,0 +1,224 @@
+# Module providing a shared HTTP client for the Synoptic API.
+#
+# A SynopticClient keeps a pool of keep-alive connections, so that a run of many requests does not
+# pay a new TCP/TLS handshake each time, and retries transient failures with exponential backoff.
+# Retried failures are connection errors, timeouts, rate limiting (HTTP 429) and server errors (5xx).
+# Synoptic can also report these inside an HTTP 200 body, via SUMMARY HTTP_STATUS_CODE.
+#
+# An optional ResponseCache stores the raw JSON responses on disk, compressed and keyed by a hash of
+# the request, so that a database can be rebuilt without downloading the data again.
+#
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
+import logging
+import time
+import os
+import os.path
+import json
+import gzip
+import hashlib
+import tempfile
+import threading
+try:
+    import zstandard      # Optional, pip install zstandard
+except ImportError:
+    zstandard = None
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class CacheMissError(LookupError):
+    # Raised in replay mode when a request is not in the response cache
+    pass
+
+class ResponseCache(object):
+
+    # Class ResponseCache keeps raw Synoptic responses on disk under directory, one compressed JSON
+    # file per request. The key is a SHA-256 hash of the URL and the sorted request arguments with
+    # the token left out, so the cache can be shared between tokens. The total size is capped at
+    # max_bytes, evicting least recently used files first; a cache hit refreshes the file time.
+    # In 'replay' mode the client serves only cached responses and never touches the network.
+    # compression is 'gzip' or 'zstd'; zstd needs the zstandard package.
+
+    def __init__(self,directory,max_bytes=1024**3,mode='readwrite',compression='gzip'):
+        if mode not in ('readwrite','replay'):
+            raise ValueError('Invalid response cache mode: ' + mode)
+        if compression == 'zstd' and zstandard == None:
+            logging.warning("zstandard is not installed, response cache will use gzip")
+            compression = 'gzip'
+        elif compression not in ('gzip','zstd'):
+            raise ValueError('Invalid response cache compression: ' + compression)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.compression = compression
+        self.lock = threading.Lock()       # Size bookkeeping is shared by prefetch threads
+        os.makedirs(directory,exist_ok=True)
+        self.total_bytes = sum(os.path.getsize(fn) for (fn,mtime) in self._files())
+
+    def key(self,url,params):
+        # Normalized hash of the request. Values are compared as strings, so 3 and '3' match.
+        norm = {str(k):str(v) for (k,v) in params.items() if k != 'token'}
+        keystr = json.dumps([url,sorted(norm.items())],separators=(',',':'))
+        return hashlib.sha256(keystr.encode()).hexdigest()
+
+    def get(self,url,params):
+        # Returns the cached response, or None if the request has not been cached
+        key = self.key(url,params)
+        for ext in ('.json.zst','.json.gz'):
+            fn = os.path.join(self.directory,key[0:2],key + ext)
+            try:
+                with open(fn,'rb') as cf:
+                    raw = cf.read()
+            except FileNotFoundError:
+                continue
+            os.utime(fn)           # Most recently used
+            if ext == '.json.zst':
+                if zstandard == None:
+                    logging.warning("Skipping " + fn + ", zstandard is not installed")
+                    continue
+                raw = zstandard.ZstdDecompressor().decompress(raw)
+            else:
+                raw = gzip.decompress(raw)
+            return json.loads(raw)
+        return None
+
+    def put(self,url,params,data):
+        key = self.key(url,params)
+        raw = json.dumps(data).encode()
+        if self.compression == 'zstd':
+            (ext,raw) = ('.json.zst',zstandard.ZstdCompressor().compress(raw))
+        else:
+            (ext,raw) = ('.json.gz',gzip.compress(raw))
+        subdir = os.path.join(self.directory,key[0:2])
+        os.makedirs(subdir,exist_ok=True)
+        fn = os.path.join(subdir,key + ext)
+        (fd,tmpname) = tempfile.mkstemp(dir=subdir)     # Write then rename, so readers never see a partial file
+        with os.fdopen(fd,'wb') as cf:
+            cf.write(raw)
+        with self.lock:
+            # Also drop the same response stored under the other compression, which get would
+            # otherwise keep serving (it tries .json.zst first) and which would still count toward max_bytes
+            for oldext in ('.json.zst','.json.gz'):
+                oldfn = os.path.join(subdir,key + oldext)
+                if os.path.isfile(oldfn):
+                    self.total_bytes -= os.path.getsize(oldfn)
+                    if oldext != ext:
+                        os.remove(oldfn)
+            os.replace(tmpname,fn)
+            self.total_bytes += len(raw)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def evict(self):
+        # Remove least recently used files until the cache is within max_bytes
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        for (fn,mtime) in sorted(self._files(),key=lambda fm: fm[1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            size = os.path.getsize(fn)
+            os.remove(fn)
+            self.total_bytes -= size
+            logging.debug("Evicted " + fn + " from response cache")
+
+    def _files(self):
+        files = []
+        for (dirpath,dirnames,filenames) in os.walk(self.directory):
+            for fname in filenames:
+                if fname.endswith('.json.gz') or fname.endswith('.json.zst'):
+                    fn = os.path.join(dirpath,fname)
+                    files.append((fn,os.path.getmtime(fn)))
+        return files
+
+class SynopticClient(object):
+
+    # Class SynopticClient wraps a requests.Session for calls to the Synoptic API. The API token
+    # is added to every request, so callers pass only the query arguments. timeout is in seconds,
+    # retries is the number of further attempts after a failure, and the wait before attempt n is
+    # backoff * 2**n seconds, capped at max_backoff, unless the server asks for a longer wait
+    # with a Retry-After header. An optional ResponseCache is consulted before the network.
+
+    def __init__(self,token,timeout=60.0,retries=5,backoff=1.0,max_backoff=60.0,pool_size=10,sleep=time.sleep,
+                 cache=None):
+        self.token = token
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size,max_retries=0)
+        self.session.mount('https://',adapter)
+        self.session.mount('http://',adapter)
+
+    def get(self,url,params):
+        # GET url with params plus the token and return the decoded JSON response.
+        # Raises HTTPError, ConnectionError or Timeout once the retries are used up, or
+        # CacheMissError for an uncached request in replay mode.
+        if self.cache != None:
+            data = self.cache.get(url,params)
+            if data != None:
+                return data
+            if self.cache.mode == 'replay':
+                raise CacheMissError("No cached response for " + url + " " + str(params))
+        data = self._fetch(url,params)
+        if self.cache != None and self._cacheable(data):
+            self.cache.put(url,params,data)
+        return data
+
+    def _fetch(self,url,params):
+        arguments = dict(params)
+        arguments['token'] = self.token
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                resp = self.session.get(url,params=arguments,timeout=self.timeout)
+                status = resp.status_code
+                retry_after = resp.headers.get('Retry-After')
+                if status not in RETRY_STATUS:
+                    resp.raise_for_status()
+                    data = resp.json()
+                    status = self._summary_status(data)
+                    if status not in RETRY_STATUS:
+                        return data
+                error = HTTPError(str(status) + " response from " + url,response=resp)
+            except (requests.exceptions.ConnectionError,requests.exceptions.Timeout) as e:
+                error = e
+            if attempt >= self.retries:
+                raise error
+            wait = self._wait(attempt,retry_after)
+            logging.warning("Synoptic request failed (" + str(error) + "), retry " + str(attempt+1) +
+                            " in " + str(wait) + "s")
+            self.sleep(wait)
+            attempt += 1
+
+    def _cacheable(self,data):
+        # Only keep definite answers: data, or a valid "nothing found". Not token or query errors.
+        try:
+            return data['SUMMARY']['RESPONSE_CODE'] in (1,2)
+        except (KeyError,TypeError):
+            return True
+
+    def _summary_status(self,data):
+        # Synoptic may report an error status inside the SUMMARY of an HTTP 200 response
+        try:
+            return int(data['SUMMARY']['HTTP_STATUS_CODE'])
+        except (KeyError,TypeError,ValueError):
+            return 200
+
+    def _wait(self,attempt,retry_after):
+        wait = min(self.backoff*2**attempt,self.max_backoff)
+        if retry_after != None:
+            try:
+                wait = max(wait,float(retry_after))
+            except ValueError:
+                pass     # HTTP-date form is not used by Synoptic
+        return wait
+
+    def close(self):
+        self.session.close()
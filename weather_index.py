@@ -0,0 +1,152 @@
+# Module providing in-memory range maximum indexes over station observations.
+#
+# Monte Carlo control runs ask for the maximum gust at the same stations over thousands of random
+# time windows. A GustIndex loads each station's gust series from a WeatherDB once and builds a
+# range maximum index over it, after which the maximum, its time and the reading count for any
+# window are found in O(1) (plus an O(log n) search for the window ends, and a scan of at most one
+# block for short windows), rather than by rescanning the window.
+# Pass a GustIndex to weather_utils.get_max_gust as gust_index to use it.
+#
+import weather_utils
+import logging
+import numpy as np   #Needs pip install
+
+class SparseTableMax(object):
+
+    # Class SparseTableMax answers range maximum queries over a fixed array of values. The array is
+    # cut into blocks of BLOCK values. A sparse table over the block maxima (level k holds the
+    # index of the maximum of each run of 2**k blocks) covers the whole blocks of a range with two
+    # overlapping runs, and prefix and suffix maxima within each block cover the partial blocks at
+    # its ends, so memory stays O(n). A range inside one block is scanned. Missing values (NaN)
+    # never win and, as in a sequential scan with >=, ties go to the later index.
+
+    BLOCK = 64
+
+    def __init__(self,values):
+        values = np.asarray(values,dtype=float)
+        self.values = np.where(np.isnan(values),-np.inf,values)
+        self.valid = np.concatenate(([0],np.cumsum(~np.isnan(values))))   # Prefix counts of readings
+        n = len(values)
+        nblocks = -(-n//self.BLOCK)
+        blocks = np.concatenate((self.values,np.full(nblocks*self.BLOCK - n,-np.inf))).reshape(nblocks,self.BLOCK)
+        pos = np.arange(self.BLOCK)
+        base = (self.BLOCK*np.arange(nblocks))[:,np.newaxis]
+        # Prefix: the last maximum of the block up to each position
+        runmax = np.maximum.accumulate(blocks,axis=1)
+        isnew = np.ones(blocks.shape,dtype=bool)
+        isnew[:,1:] = blocks[:,1:] >= runmax[:,:-1]
+        self.prefix = (base + np.maximum.accumulate(np.where(isnew,pos,-1),axis=1)).ravel()[0:n]
+        # Suffix: the last maximum of the block from each position on
+        rblocks = blocks[:,::-1]
+        runmax = np.maximum.accumulate(rblocks,axis=1)
+        isnew[:,1:] = rblocks[:,1:] > runmax[:,:-1]
+        self.suffix = (base + self.BLOCK - 1 - np.maximum.accumulate(np.where(isnew,pos,-1),axis=1)[:,::-1]).ravel()[0:n]
+        # Sparse table over whole blocks, starting from the last maximum of each block
+        levels = [self.suffix[0::self.BLOCK].astype(np.int64)]
+        k = 1
+        while (1 << k) <= nblocks:
+            prev = levels[-1]
+            span = nblocks - (1 << k) + 1
+            ia = prev[0:span]
+            ib = prev[(1 << (k-1)):(1 << (k-1)) + span]
+            levels.append(np.where(self.values[ib] >= self.values[ia],ib,ia))
+            k += 1
+        self.levels = levels
+
+    def argmax(self,lo,hi):
+        # Index of the last maximum of values[lo:hi+1]. lo and hi may be integers or arrays of
+        # integers, with lo <= hi.
+        scalar = np.ndim(lo) == 0 and np.ndim(hi) == 0
+        lo = np.atleast_1d(np.asarray(lo,dtype=np.int64))
+        hi = np.atleast_1d(np.asarray(hi,dtype=np.int64))
+        (blo,bhi) = (lo//self.BLOCK,hi//self.BLOCK)
+        best = np.empty(len(lo),dtype=np.int64)
+        for iq in np.flatnonzero(blo == bhi):              # Within one block
+            window = self.values[lo[iq]:hi[iq]+1]
+            best[iq] = hi[iq] - np.argmax(window[::-1])
+        span = np.flatnonzero(blo != bhi)
+        if len(span) > 0:
+            best[span] = self.suffix[lo[span]]
+            inner = span[bhi[span] - blo[span] > 1]
+            if len(inner) > 0:
+                (ba,bb) = (blo[inner] + 1,bhi[inner] - 1)
+                k = np.floor(np.log2(bb - ba + 1)).astype(np.int64)
+                for kk in np.unique(k):
+                    sel = k == kk
+                    ia = self.levels[kk][ba[sel]]
+                    ib = self.levels[kk][bb[sel] - (1 << kk) + 1]
+                    imid = np.where(self.values[ib] >= self.values[ia],ib,ia)
+                    iq = inner[sel]
+                    best[iq] = np.where(self.values[imid] >= self.values[best[iq]],imid,best[iq])
+            ipre = self.prefix[hi[span]]
+            best[span] = np.where(self.values[ipre] >= self.values[best[span]],ipre,best[span])
+        return int(best[0]) if scalar else best
+
+    def count(self,lo,hi):
+        # Number of readings (not NaN) in values[lo:hi+1]
+        return self.valid[np.asarray(hi) + 1] - self.valid[np.asarray(lo)]
+
+class GustIndex(object):
+
+    # Class GustIndex holds a SparseTableMax per station for a variable (wind_gust_set_1 by
+    # default), built from the observations in db_object over the time span given to load. Load
+    # after the data has been fetched into the database; later additions are not seen until the
+    # stations are loaded again.
+
+    def __init__(self,db_object,variable='wind_gust_set_1'):
+        self.db_object = db_object
+        self.variable = variable
+        self.stations = {}     # stid: (first epoch, last epoch, epoch array, SparseTableMax)
+
+    def load(self,stids,dtlow,dthigh):
+        # Load stations stids for dtlow to dthigh, ISO text times. Stations already loaded for the
+        # span are skipped, and a station loaded for an overlapping or adjoining span is reloaded
+        # for the combined span.
+        tlo = int(weather_utils.epoch_seconds([dtlow])[0])
+        thi = int(weather_utils.epoch_seconds([dthigh])[0])
+        loads = {}
+        for stid in stids:
+            span = (tlo,thi)
+            if self.covers(stid,tlo,thi):
+                continue
+            if stid in self.stations:
+                (slo,shi) = self.stations[stid][0:2]
+                if slo <= thi + 1 and tlo <= shi + 1:
+                    span = (min(slo,tlo),max(shi,thi))
+            loads.setdefault(span,[]).append(stid)
+        for ((slo,shi),stgroup) in loads.items():
+            (isolo,isohi) = weather_utils.iso_times([slo,shi])
+            columns = self.db_object.get_observations_columns(stgroup,isolo,isohi,(self.variable,))
+            bounds = np.searchsorted(columns['station'],np.arange(len(stgroup)+1))
+            for (ist,stid) in enumerate(stgroup):
+                (lo,hi) = (bounds[ist],bounds[ist+1])
+                self.stations[stid] = (slo,shi,columns['epoch'][lo:hi],
+                                       SparseTableMax(columns[self.variable.lower()][lo:hi]))
+        logging.debug("Gust index loaded " + str(len(stids)) + " stations from " + dtlow + " to " + dthigh)
+
+    def load_radius(self,latitude,longitude,radius,dtlow,dthigh):
+        # Load every station within radius miles of (latitude, longitude)
+        stids = [st for (st,dist) in self.db_object.stations_within(latitude,longitude,radius)]
+        self.load(stids,dtlow,dthigh)
+
+    def covers(self,stid,tlo,thi):
+        # True if station stid is loaded for the whole of tlo to thi, epoch seconds
+        if stid not in self.stations:
+            return False
+        (slo,shi) = self.stations[stid][0:2]
+        return slo <= tlo and thi <= shi
+
+    def window_max(self,stid,tlo,thi):
+        # Returns (maximum, epoch seconds of its last occurrence, number of readings) for station
+        # stid between tlo and thi epoch seconds inclusive, or (None, None, 0) if there are no
+        # readings.
+        (slo,shi,epoch,table) = self.stations[stid]
+        lo = int(np.searchsorted(epoch,tlo,'left'))
+        hi = int(np.searchsorted(epoch,thi,'right')) - 1
+        if hi < lo:
+            return (None,None,0)
+        count = int(table.count(lo,hi))
+        if count == 0:
+            return (None,None,0)
+        imax = table.argmax(lo,hi)
+        return (float(table.values[imax]),int(epoch[imax]),count)
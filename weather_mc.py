@@ -0,0 +1,487 @@
+# Module providing the Monte Carlo control sampler behind the weather_utils mc command.
+#
+# A control run draws random (location, time) samples, the locations from the events of a
+# configuration section and the times between START_DATE and END_DATE, and finds the maximum gusts
+# around each, as a baseline for the gusts found around the events themselves. All samples are
+# drawn up front from a seeded numpy Generator, so a run is reproduced by its seed. They are sorted
+# by location and then time, so that samples sharing data are computed together, and computed in
+# batches with weather_utils.get_max_gust_batch. Results are written as they are computed, with
+# the writers of weather_pipeline, one row per sample from row FIRST_ROW + ROW_OFFSET on, each
+# followed by the weight of the sample.
+#
+# Times are drawn in one of three ways (MC_SAMPLING, or --sampling):
+#   uniform: uniformly over the period, every weight 1
+#   stratified: from strata of year, month and hour of day (UTC), with counts allocated in
+#               proportion to the stratum durations times the MC_MONTH_FACTORS of their months. Each
+#               sample is weighted by the stratum share of the period over its allocated share of
+#               the samples, so weighted statistics estimate the uniform ones. Factors above 1 for the windy
+#               months put more of the samples, at lower weights, where the high gusts are.
+#   lhs: Latin hypercube over time and location, every weight 1
+#
+# A run can be split into shards, run anywhere against a local or replicated database. With
+# --shard i/N and a master seed, shard i draws and computes its slice of the samples from its own
+# stream, spawned from the master seed with numpy SeedSequence, and writes them to a shard file.
+# mc --merge N then writes the N shards, in order, as the table of the whole run. The merged table
+# depends only on the master seed and N, not on where or in what order the shards ran.
+#
+# The locations and the sampling period are known before any sample is drawn, so the data a run
+# needs can be loaded first, in bulk: the prefetch command loads the whole history of every station
+# within the largest radius of each location, in time chunks, and records each location as covered
+# for the period, so that every sample is then answered from the database.
+#
+#   python weather_utils.py -f weather_sdge_ign_mc.ini prefetch -u SDGE
+#   python weather_utils.py -f weather_sdge_ign_mc.ini mc -u SDGE --seed 1
+#   python weather_utils.py -f weather_sdge_ign_mc.ini mc -u SDGE --seed 1 -n 10000 --shard 3/8
+#   python weather_utils.py -f weather_sdge_ign_mc.ini mc -u SDGE --merge 8
+#
+import weather_config
+import weather_utils
+import weather_pipeline
+import weather_async
+import datetime
+import json
+import logging
+import os
+import numpy as np   #Needs pip install
+
+def get_mc_seed(settings):
+    # Seed of a run: MC_SEED in the section, or fresh entropy if it is not set
+    conf = settings['config']
+    if 'MC_SEED' in conf:
+        return int(conf['MC_SEED'])
+    return np.random.SeedSequence().entropy
+
+def get_sample_period(settings):
+    # (start, end) epoch seconds of the sampling period, START_DATE to END_DATE
+    conf = settings['config']
+    return (int(weather_utils.TimeUtils(conf['START_DATE']).datetime.timestamp()),
+            int(weather_utils.TimeUtils(conf['END_DATE']).datetime.timestamp()))
+
+SAMPLING = ('uniform','stratified','lhs')
+
+def get_month_factors(settings):
+    # Allocation factors of the twelve months for stratified sampling, from MC_MONTH_FACTORS
+    # (twelve comma separated numbers, January first), default all 1
+    raw = settings['config'].get('MC_MONTH_FACTORS')
+    if raw == None:
+        return np.ones(12)
+    factors = np.array([float(f) for f in raw.split(',')])
+    if len(factors) != 12 or (factors <= 0).any():
+        raise ValueError("MC_MONTH_FACTORS needs twelve positive factors: " + raw)
+    return factors
+
+def get_time_strata(tstart,tend):
+    # Splits tstart to tend (epoch seconds) into the hours of the clock. Returns (cell start, cell
+    # seconds, cell stratum, stratum keys), where the strata are the distinct (year, month, hour of
+    # day) of the cells, UTC, and key (year*12 + month - 1)*24 + hour.
+    hours = np.arange(tstart//3600*3600,tend,3600,dtype=np.int64)
+    cell_start = np.maximum(hours,tstart)
+    cell_seconds = np.minimum(hours + 3600,tend) - cell_start
+    months = hours.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64) + 1970*12
+    (keys,cell_stratum) = np.unique(months*24 + (hours//3600) % 24,return_inverse=True)
+    return (cell_start,cell_seconds,cell_stratum,keys)
+
+def draw_stratified_times(rng,nsamples,tstart,tend,month_factors=None):
+    # Draws nsamples epoch seconds from tstart up to tend, stratified by year, month and hour of day
+    # (get_time_strata), with stratum counts in proportion to stratum duration times the factor of
+    # its month, rounded systematically so they add up to nsamples and are on average the
+    # allocation. Times are uniform within their stratum. Returns (epochs, weights), weights the
+    # stratum share of the period over its allocated share of the samples, so that the weighted
+    # mean of any sample statistic is an unbiased estimate of its mean over the period.
+    (cell_start,cell_seconds,cell_stratum,keys) = get_time_strata(tstart,tend)
+    seconds = np.bincount(cell_stratum,weights=cell_seconds).astype(np.int64)
+    share = seconds/seconds.sum()
+    alloc = share*(month_factors[(keys//24) % 12] if month_factors is not None else 1.0)
+    alloc = alloc/alloc.sum()
+    cum = np.cumsum(alloc)*nsamples
+    cum[-1] = nsamples
+    edges = np.floor(np.concatenate(([0.0],cum)) + rng.random()).astype(np.int64)
+    counts = np.diff(edges)
+    strata = np.repeat(np.arange(len(keys)),counts)
+    # A uniform second of each sample's stratum, located among the stratum's hour cells
+    corder = np.argsort(cell_stratum,kind='stable')
+    cend = np.cumsum(cell_seconds[corder])
+    offsets = np.concatenate(([0],np.cumsum(seconds)))[strata]
+    x = offsets + np.floor(rng.random(len(strata))*seconds[strata]).astype(np.int64)
+    icell = np.searchsorted(cend,x,'right')
+    epochs = cell_start[corder][icell] + x - (cend[icell] - cell_seconds[corder][icell])
+    weights = share[strata]/alloc[strata]
+    return (epochs,weights)
+
+def draw_samples(rng,nlocations,nsamples,tstart,tend,sampling='uniform',month_factors=None):
+    # Draws nsamples (location index, epoch seconds) samples with numpy Generator rng: locations
+    # from range(nlocations) and times, to the second, from tstart up to tend, as set by sampling
+    # (see SAMPLING). Returns the location, time and weight arrays, sorted by location and then time.
+    if sampling == 'uniform':
+        locations = rng.integers(0,nlocations,size=nsamples)
+        epochs = rng.integers(tstart,tend,size=nsamples)
+        weights = np.ones(nsamples)
+    elif sampling == 'stratified':
+        locations = rng.integers(0,nlocations,size=nsamples)
+        (epochs,weights) = draw_stratified_times(rng,nsamples,tstart,tend,month_factors)
+    elif sampling == 'lhs':
+        # One sample in each of nsamples equal slices of the period and of the locations, the
+        # slices paired at random
+        tslice = (rng.permutation(nsamples) + rng.random(nsamples))/nsamples
+        lslice = (rng.permutation(nsamples) + rng.random(nsamples))/nsamples
+        epochs = tstart + np.floor(tslice*(tend - tstart)).astype(np.int64)
+        locations = np.floor(lslice*nlocations).astype(np.int64)
+        weights = np.ones(nsamples)
+    else:
+        raise ValueError("Unknown sampling " + str(sampling) + ", use one of " + ', '.join(SAMPLING))
+    order = np.lexsort((epochs,locations))
+    return (locations[order],epochs[order],weights[order])
+
+class Sample(weather_pipeline.Event):
+
+    # Class Sample is a Monte Carlo sample: an event at the location (and with the row values) of
+    # location event number location, at a sampled time, with a sample weight.
+
+    def __init__(self,event_id,locations,location,time,weight):
+        loc = locations[location]
+        super().__init__(event_id,loc.latitude,loc.longitude,None,values=loc.values)
+        self.location = location
+        self.time = time
+        self.weight = weight
+
+def sample_events(locations,sample_locations,sample_epochs,sample_weights,first_id):
+    # Sample objects for the samples, numbered from first_id
+    return [Sample(first_id + isample,locations,int(iloc),
+                   weather_utils.TimeUtils(datetime.datetime.fromtimestamp(int(epoch),datetime.timezone.utc)),float(weight))
+            for (isample,(iloc,epoch,weight)) in enumerate(zip(sample_locations,sample_epochs,sample_weights))]
+
+def read_location_events(settings,reader=None):
+    # (location events, header rows) of the reader of settings. The location events are those with
+    # a latitude and longitude, in input order.
+    if reader == None:
+        reader = weather_pipeline.READERS[settings['reader']](settings)
+    try:
+        locations = [loc for loc in reader.events() if loc.latitude != None and loc.longitude != None]
+        header = reader.header()
+    finally:
+        reader.close()
+    return (locations,header)
+
+def parse_shard(raw):
+    # (i, N) from a shard given as i/N, 1 <= i <= N
+    try:
+        (ishard,nshards) = (int(part) for part in raw.split('/'))
+    except ValueError:
+        raise ValueError("Shards are given as i/N, not " + str(raw))
+    if not 1 <= ishard <= nshards:
+        raise ValueError("Shard " + raw + " is not one of 1/" + str(nshards) + " to " + str(nshards) + "/" + str(nshards))
+    return (ishard,nshards)
+
+def shard_slice(nsamples,ishard,nshards):
+    # (index of the first sample, number of samples) of shard ishard of nshards
+    first = nsamples*(ishard-1)//nshards
+    return (first,nsamples*ishard//nshards - first)
+
+def shard_file(settings,ishard,nshards):
+    # Result file of a shard: MC_SHARD_FILE, formatted with {shard} and {shards}, or next to the
+    # output
+    conf = settings['config']
+    output = settings['output_file'] if settings['writer'] == 'excel' else settings['event_output_file']
+    template = conf.get('MC_SHARD_FILE',str(output) + '.shard{shard}of{shards}.jsonl')
+    return template.format(shard=ishard,shards=nshards)
+
+def mc_fingerprint(settings,nsamples,seed,sampling,nshards):
+    # The parameters a sharded run must share across its shards
+    return {'seed':seed,'samples':nsamples,'shards':nshards,'sampling':sampling,
+            'month_factors':get_month_factors(settings).tolist(),'period':list(get_sample_period(settings)),
+            'time_windows':list(settings['time_windows']),'distance_windows':list(settings['distance_windows']),
+            'time_offset':settings['time_offset']}
+
+class ShardWriter(weather_pipeline.EventWriter):
+
+    # Writes the samples of a shard to a JSON lines shard file: a first line with the run
+    # fingerprint (mc_fingerprint), then one line per sample with its id, location number, time,
+    # weight and result. The file is written under a .part name and only takes its own name once the
+    # shard is complete, so merge_shards never reads a shard cut short.
+
+    def __init__(self,settings,path,fingerprint):
+        super().__init__(settings)
+        self.path = path
+        self.fingerprint = fingerprint
+        self.shard = None
+
+    def open(self,header):
+        self.shard = open(self.path + '.part','w')
+        self.shard.write(json.dumps({'settings':self.fingerprint}) + '\n')
+
+    def write(self,event,result):
+        self.shard.write(json.dumps({'id':event.event_id,'location':event.location,'time':event.time.iso(),
+                                     'weight':event.weight,'result':result}) + '\n')
+
+    def close(self,complete=True):
+        # Closes the shard file, and gives it its own name once complete. Does nothing if open failed.
+        if self.shard == None:
+            return
+        self.shard.close()
+        self.shard = None
+        if complete:
+            os.replace(self.path + '.part',self.path)
+            logging.info("Wrote shard " + self.path)
+
+def compute_samples(events,settings,db_object,batch_size=256,gust_index=None):
+    # Generator of (event, get_max_gust result) for events, in order. Events are computed in batches
+    # of batch_size with get_max_gust_batch, or one at a time from gust_index if one is given.
+    # Batches only group samples at the same location, so each radius query is the one recorded
+    # for the location by prefetch_climatology.
+    (timetpl,timeoffset,geotpl) = (settings['time_windows'],settings['time_offset'],settings['distance_windows'])
+    for ifirst in range(0,len(events),batch_size):
+        batch = events[ifirst:ifirst+batch_size]
+        if gust_index != None:
+            results = [weather_utils.get_max_gust(ev.latitude,ev.longitude,ev.time,timetpl,timeoffset,geotpl,db_object,
+                                                  gust_index=gust_index) for ev in batch]
+        else:
+            results = weather_utils.get_max_gust_batch([(ev.latitude,ev.longitude,ev.time) for ev in batch],
+                                                       timetpl,timeoffset,geotpl,db_object,group_miles=0.0)
+        logging.info("Computed samples " + str(ifirst) + " to " + str(ifirst + len(batch) - 1))
+        for (event,result) in zip(batch,results):
+            yield (event,result)
+
+def run_mc(settings,db_object,nsamples=None,seed=None,batch_size=256,writer=None,reader=None,gust_index=None,
+           sampling=None,shard=None):
+    # Runs a control sample for settings (see weather_pipeline.load_settings, plus EVENTS, the
+    # number of samples, START_DATE, END_DATE, ROW_OFFSET, MC_SEED, MC_SAMPLING, MC_MONTH_FACTORS
+    # and MC_SHARD_FILE). nsamples, seed and sampling default to the configuration. With shard
+    # (i, N), only shard i of N is run, from its spawned stream, and written with a ShardWriter;
+    # the master seed must then be given. Returns the seed used.
+    conf = settings['config']
+    settings = dict(settings,weighted=True)
+    if nsamples == None:
+        nsamples = int(conf['EVENTS'])
+    if seed == None:
+        if shard != None and 'MC_SEED' not in conf:
+            raise ValueError("A sharded run needs a master seed, --seed or MC_SEED")
+        seed = get_mc_seed(settings)
+    if sampling == None:
+        sampling = conf.get('MC_SAMPLING','uniform').lower()
+    (ishard,nshards) = shard if shard != None else (1,1)
+    (first,count) = shard_slice(nsamples,ishard,nshards)
+    logging.info("Monte Carlo seed " + str(seed) + ", " + str(nsamples) + " samples, " + sampling + " sampling" +
+                 (", shard " + str(ishard) + "/" + str(nshards) + " of " + str(count) if shard != None else ""))
+    (locations,header) = read_location_events(settings,reader)
+    if shard != None:
+        rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(nshards)[ishard-1])
+    else:
+        rng = np.random.default_rng(seed)
+    (tstart,tend) = get_sample_period(settings)
+    (sample_locations,sample_epochs,sample_weights) = draw_samples(rng,len(locations),count,tstart,tend,sampling,
+                                                                   get_month_factors(settings))
+    first_id = settings['first_row'] + int(conf.get('ROW_OFFSET','0') or 0) + first
+    events = sample_events(locations,sample_locations,sample_epochs,sample_weights,first_id)
+    if writer == None and shard != None:
+        writer = ShardWriter(settings,shard_file(settings,ishard,nshards),
+                             mc_fingerprint(settings,nsamples,seed,sampling,nshards))
+    elif writer == None:
+        writer = weather_pipeline.WRITERS[settings['writer']](settings)
+    complete = False
+    try:
+        writer.open(header)
+        for (event,result) in compute_samples(events,settings,db_object,batch_size,gust_index):
+            writer.write(event,result)
+        complete = True
+    finally:
+        writer.close(complete)
+    return seed
+
+def merge_shards(settings,nshards,reader=None,writer=None):
+    # Writes the samples of the nshards shard files of a run, shard by shard and each in its own
+    # order, with writer (default: WRITERS[settings['writer']]). Raises ValueError if a shard is
+    # missing or incomplete, or the shards are not of one run. Returns the number of samples written.
+    settings = dict(settings,weighted=True)
+    paths = [shard_file(settings,ishard,nshards) for ishard in range(1,nshards+1)]
+    missing = [path for path in paths if not os.path.isfile(path)]
+    if missing != []:
+        raise ValueError("Missing or incomplete shards: " + ', '.join(missing))
+    (locations,header) = read_location_events(settings,reader)
+    if writer == None:
+        writer = weather_pipeline.WRITERS[settings['writer']](settings)
+    fingerprint = None
+    nwritten = 0
+    complete = False
+    try:
+        writer.open(header)
+        for (ishard,path) in enumerate(paths,1):
+            with open(path) as shard:
+                record = json.loads(shard.readline())['settings']
+                if fingerprint == None:
+                    fingerprint = record
+                    if (fingerprint['shards'],fingerprint['time_windows'],fingerprint['distance_windows']) != \
+                       (nshards,list(settings['time_windows']),list(settings['distance_windows'])):
+                        raise ValueError("Shard " + path + " is not one of " + str(nshards) + " with these windows")
+                elif record != fingerprint:
+                    raise ValueError("Shard " + path + " is from a different run, " + str(record))
+                nshard = 0
+                for line in shard:
+                    record = json.loads(line)
+                    event = Sample(record['id'],locations,record['location'],weather_utils.TimeUtils(record['time']),
+                                   record['weight'])
+                    writer.write(event,record['result'])
+                    nshard += 1
+            if nshard != shard_slice(fingerprint['samples'],ishard,nshards)[1]:
+                raise ValueError("Shard " + path + " has " + str(nshard) + " samples, not " +
+                                 str(shard_slice(fingerprint['samples'],ishard,nshards)[1]))
+            nwritten += nshard
+        complete = True
+    finally:
+        writer.close(complete)
+    logging.info("Merged " + str(nwritten) + " samples from " + str(nshards) + " shards")
+    return nwritten
+
+def run_section(section,overrides=None,nsamples=None,seed=None,batch_size=256,sampling=None,shard=None):
+    # Runs a control sample for a configuration section, with its WEATHER_DB. With GUST_INDEX in the
+    # section, the gust series around every location are loaded into a weather_index.GustIndex for
+    # the whole sampling period first.
+    settings = weather_pipeline.load_settings(section,overrides)
+    db_object = weather_pipeline.open_weather_db(settings['weather_db'])
+    try:
+        gust_index = None
+        if settings['config'].get('GUST_INDEX','no').lower() in ('1','yes','true','on'):
+            gust_index = load_gust_index(settings,db_object)
+        return run_mc(settings,db_object,nsamples,seed,batch_size,gust_index=gust_index,sampling=sampling,shard=shard)
+    finally:
+        db_object.close()
+
+def merge_section(section,nshards,overrides=None):
+    # Runs merge_shards for a configuration section
+    return merge_shards(weather_pipeline.load_settings(section,overrides),nshards)
+
+def load_gust_index(settings,db_object):
+    # weather_index.GustIndex holding every station within the largest radius of each location for
+    # the sampling period, widened by the largest time window. The data must already be in the
+    # database.
+    import weather_index
+    twmax = max(settings['time_windows'])*3600
+    (tstart,tend) = get_sample_period(settings)
+    (index_start,index_end) = weather_utils.iso_times([tstart - twmax,tend + twmax])
+    gust_index = weather_index.GustIndex(db_object)
+    for (lat,lon) in read_locations(settings):
+        gust_index.load_radius(lat,lon,settings['distance_windows'][-1],index_start,index_end)
+    return gust_index
+
+def read_locations(settings,reader=None):
+    # Distinct (latitude, longitude) of the events of settings, in input order
+    if reader == None:
+        reader = weather_pipeline.READERS[settings['reader']](settings)
+    locations = {}
+    try:
+        for loc in reader.events():
+            if loc.latitude != None and loc.longitude != None:
+                locations[(float(loc.latitude),float(loc.longitude))] = True
+    finally:
+        reader.close()
+    return list(locations)
+
+def get_climatology_window(settings):
+    # (tlo, thi) TimeUtils objects bounding the data any sample can need: the window of a sample at
+    # START_DATE to the window of a sample at END_DATE, with the largest time window
+    (conf,timetpl,timeoffset) = (settings['config'],settings['time_windows'],settings['time_offset'])
+    tlo = weather_utils.get_event_window(weather_utils.TimeUtils(conf['START_DATE']),timetpl,timeoffset)[0]
+    thi = weather_utils.get_event_window(weather_utils.TimeUtils(conf['END_DATE']),timetpl,timeoffset)[1]
+    return (tlo,thi)
+
+def get_location_stations(latitude,longitude,radius,tlo,thi,db_object):
+    # Stations within radius miles of (latitude, longitude) with observations between tlo and thi,
+    # from the Synoptic metadata service. The stations are added to db_object. Returns the list of
+    # station ids, or None if the request failed.
+    api_arguments = {'radius':','.join(map(str,(latitude,longitude,radius))),'sensorvars':1,
+                     'obrange':tlo.synop()[0:8] + ',' + thi.synop()[0:8]}
+    try:
+        data = weather_utils.get_synoptic_client().get(weather_utils.get_base_api_request_url('station'),api_arguments)
+    except Exception as e:
+        logging.warning("Station search around " + str((latitude,longitude)) + " failed: " + str(e))
+        return None
+    rc = data['SUMMARY']['RESPONSE_CODE']
+    if rc == 2:                          # No stations
+        return []
+    if rc != 1:
+        logging.warning("Station search around " + str((latitude,longitude)) + " failed: " +
+                        str(data['SUMMARY'].get('RESPONSE_MESSAGE')))
+        return None
+    db_object.add_station(data)
+    return [station['STID'] for station in data.get('STATION',[])]
+
+def record_climatology_coverage(location_stations,radius,tlo,thi,db_object):
+    # Record in the coverage ledger each location of location_stations, a dict of
+    # (latitude, longitude): station ids, for which every station is in the station coverage ledger
+    # from tlo to thi. Returns the number of locations recorded.
+    (dtlow,dthigh) = (weather_utils.EpochTime.parse(tlo.synop()).iso(),weather_utils.EpochTime.parse(thi.synop()).iso())
+    ncovered = 0
+    for ((lat,lon),stids) in location_stations.items():
+        if all(db_object.get_station_gaps(stid,dtlow,dthigh) == [] for stid in stids):
+            db_object.add_coverage(lat,lon,radius,dtlow,dthigh)
+            ncovered += 1
+    return ncovered
+
+def prefetch_climatology(settings,db_object,reader=None,concurrency=None):
+    # Loads the whole history, over get_climatology_window, of every station within the largest
+    # radius of each location of settings into db_object. The station histories are fetched with
+    # weather_async in chunks of at most STID_CHUNK_DAYS, skipping what the station coverage ledger
+    # already holds. Locations whose stations are all loaded are recorded in the coverage ledger, so
+    # that radius queries for any sample there are answered from the database. Returns
+    # (number of locations covered, number of locations).
+    radius = max(settings['distance_windows'])
+    (tlo,thi) = get_climatology_window(settings)
+    (dtlow,dthigh) = (weather_utils.EpochTime.parse(tlo.synop()).iso(),weather_utils.EpochTime.parse(thi.synop()).iso())
+    locations = read_locations(settings,reader)
+    logging.info("Prefetching " + dtlow + " to " + dthigh + " within " + str(radius) + " miles of " +
+                 str(len(locations)) + " locations")
+    location_stations = {}
+    ncovered = 0
+    for (lat,lon) in locations:
+        if db_object.check_coverage(lat,lon,radius,dtlow,dthigh):
+            ncovered += 1
+            continue
+        stids = get_location_stations(lat,lon,radius,tlo,thi,db_object)
+        if stids != None:
+            location_stations[(lat,lon)] = stids
+    stids = sorted(set(stid for stlist in location_stations.values() for stid in stlist))
+    (nfetched,failed) = weather_async.prefetch_observations([(stid,tlo,thi) for stid in stids],db_object,concurrency)
+    logging.info("Fetched " + str(nfetched) + " chunks for " + str(len(stids)) + " stations")
+    if failed != []:
+        logging.warning(str(len(failed)) + " chunks failed, rerun prefetch to retry them")
+    ncovered += record_climatology_coverage(location_stations,radius,tlo,thi,db_object)
+    logging.info(str(ncovered) + " of " + str(len(locations)) + " locations covered")
+    return (ncovered,len(locations))
+
+def prefetch_section(section,overrides=None,concurrency=None):
+    # Runs prefetch_climatology for a configuration section, with its WEATHER_DB
+    settings = weather_pipeline.load_settings(section,overrides)
+    db_object = weather_pipeline.open_weather_db(settings['weather_db'])
+    try:
+        return prefetch_climatology(settings,db_object,concurrency=concurrency)
+    finally:
+        db_object.close()
+
+def add_arguments(parser):
+    # Arguments of the weather_utils mc command
+    parser.add_argument('-u','--utility',required=True,help='Configuration section, e.g. PGE, SCE, SDGE')
+    parser.add_argument('-n','--samples',type=int,help='Number of samples (default EVENTS)')
+    parser.add_argument('--seed',type=int,help='Random seed (default MC_SEED, or a fresh seed that is logged)')
+    parser.add_argument('--batch',type=int,default=256,help='Samples per batch')
+    parser.add_argument('--sampling',choices=SAMPLING,help='Sampling of times and locations (default MC_SAMPLING, or uniform)')
+    parser.add_argument('--db',help='Weather database, e.g. a local replica (default WEATHER_DB)')
+    shards = parser.add_mutually_exclusive_group()
+    shards.add_argument('--shard',help='Run only shard i of N, given as i/N, into a shard file')
+    shards.add_argument('--merge',type=int,metavar='N',help='Write the table of a run from its N shard files')
+
+def run_command(args):
+    # The weather_utils mc command
+    overrides = {'WEATHER_DB':args.db} if args.db != None else None
+    if args.merge != None:
+        merge_section(args.utility,args.merge,overrides)
+        return
+    run_section(args.utility,overrides,nsamples=args.samples,seed=args.seed,batch_size=args.batch,sampling=args.sampling,
+                shard=parse_shard(args.shard) if args.shard != None else None)
+
+def add_prefetch_arguments(parser):
+    # Arguments of the weather_utils prefetch command
+    parser.add_argument('-u','--utility',required=True,help='Configuration section, e.g. PGE, SCE, SDGE')
+    parser.add_argument('-c','--concurrency',type=int,help='Requests in flight (default FETCH_CONCURRENCY)')
+
+def run_prefetch_command(args):
+    # The weather_utils prefetch command
+    prefetch_section(args.utility,concurrency=args.concurrency)
@@ -0,0 +1,138 @@
+# Module for computing weather_utils event results on a pool of worker processes.
+#
+# The spreadsheet drivers compute one event per row in sequence, and once the data is in the
+# database the gust scan and time handling keep a single core busy. run_events spreads the events
+# over a ProcessPoolExecutor. Each worker opens its own read only WeatherDB connection. A worker
+# that has to fetch from Synoptic does not write the response itself: the writes it would have made
+# come back with its result, and the calling process, the only writer, makes them. Results are
+# yielded in event order, so the caller can fill its workbook row by row.
+#
+# Workers are forked from the calling process, which has already read the configuration. Where
+# fork is not available the events are run in the calling process. The calling process closes its
+# database connection while the workers are forked, so that no sqlite connection crosses the fork.
+#
+import weather_config
+import weather_utils
+import concurrent.futures
+import multiprocessing
+import logging
+import os
+
+def get_parallel_workers():
+    # Number of worker processes, from PARALLEL_WORKERS in the [Default] section, or one per core
+    return int(weather_config.config['Default'].get('PARALLEL_WORKERS',str(os.cpu_count() or 1)))
+
+class DeferredWriteDB(weather_utils.WeatherDB):
+
+    # Class DeferredWriteDB is a read only WeatherDB that records the stations, observations and
+    # ledger entries added through it instead of writing them. take_writes returns the recorded
+    # writes, which replay_writes makes on a writable WeatherDB. Stations recorded are also
+    # returned by get_station until the writes are taken.
+
+    def __init__(self,db_name):
+        super().__init__(db_name,read_only=True)
+        self.pending = []
+        self.stations = {}
+
+    def add_station(self,data):
+        if data == None:
+            raise ValueError('No station data has been provided')
+        self.pending.append(('add_station',(data,)))
+        for station in data.get('STATION',[data] if 'STID' in data else []):
+            self.stations[station['STID']] = station_row(station)
+
+    def get_station(self,stid):
+        station = super().get_station(stid)
+        if station == {} and stid in self.stations:
+            station = dict(self.stations[stid])
+        return station
+
+    def add_observations(self,data):
+        self.pending.append(('add_observations',(data,)))
+
+    def add_coverage(self,latitude,longitude,radius,dtlow,dthigh):
+        self.pending.append(('add_coverage',(latitude,longitude,radius,dtlow,dthigh)))
+
+    def add_station_coverage(self,stid,dtlow,dthigh):
+        self.pending.append(('add_station_coverage',(stid,dtlow,dthigh)))
+
+    def take_writes(self):
+        (writes,self.pending) = (self.pending,[])
+        self.stations = {}
+        return writes
+
+def station_row(station):
+    # A station from a Synoptic payload in the format of WeatherDB.get_station, as the station
+    # table would hold it
+    row = {}
+    for (key,val) in station.items():
+        if key in ('OBSERVATIONS','QC'):
+            continue
+        elif key == 'PERIOD_OF_RECORD':
+            (row['PERIOD_OF_RECORD_START'],row['PERIOD_OF_RECORD_STOP']) = (val['start'],val['end'])
+        elif key == 'UNITS':
+            (row['UNITS_POSITION'],row['UNITS_ELEVATION']) = (val['position'],val['elevation'])
+        else:
+            row[key.upper()] = val
+    return row
+
+def replay_writes(writes,db_object):
+    # Make the writes recorded by a DeferredWriteDB on db_object, in the order they were recorded
+    for (method,args) in writes:
+        getattr(db_object,method)(*args)
+
+def compute_event(event,timetpl,timeoffset,geotpl,db_object,specs=None):
+    # get_max_gust for event (latitude, longitude, time), or get_window_extremes if specs are given.
+    # The time is a TimeUtils object or anything TimeUtils accepts.
+    (lat,lon,evtime) = event
+    mgtime = evtime if isinstance(evtime,weather_utils.TimeUtils) else weather_utils.TimeUtils(evtime)
+    if specs == None:
+        return weather_utils.get_max_gust(lat,lon,mgtime,timetpl,timeoffset,geotpl,db_object)
+    return weather_utils.get_window_extremes(lat,lon,mgtime,timetpl,timeoffset,geotpl,specs,db_object)
+
+_worker = {}
+
+def _init_worker(db_name,timetpl,timeoffset,geotpl,specs):
+    weather_utils.synoptic_client = None      # Each worker makes its own HTTP session
+    _worker['db'] = DeferredWriteDB(db_name) if db_name != None else None
+    _worker['args'] = (timetpl,timeoffset,geotpl,specs)
+
+def _run_worker_event(event):
+    db_object = _worker['db']
+    result = compute_event(event,*_worker['args'][0:3],db_object,_worker['args'][3])
+    return (result,db_object.take_writes() if db_object != None else [])
+
+def run_events(events,timetpl,timeoffset,geotpl,db_object,specs=None,workers=None,chunksize=1):
+    # Generator of compute_event results for each of events, in order, computed by up to workers
+    # processes (default get_parallel_workers()). db_object is the writable WeatherDB, or None. Fetched
+    # data is stored in db_object as the results arrive, so later events, in any worker, find it in
+    # the database. Workers may still fetch the same data for events close together that are
+    # computed at the same time; prefetching (weather_async) first avoids this.
+    if workers == None:
+        workers = get_parallel_workers()
+    if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        logging.warning("Worker processes need the fork start method, running events in one process")
+        workers = 1
+    if workers <= 1:
+        for event in events:
+            yield compute_event(event,timetpl,timeoffset,geotpl,db_object,specs)
+        return
+    db_name = None
+    if db_object != None:
+        db_name = db_object.db_name
+        db_object.release()       # Commits, so workers see the data, and closes before the fork
+    logging.info("Running events on " + str(workers) + " worker processes")
+    try:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('fork'),
+                                                          initializer=_init_worker,
+                                                          initargs=(db_name,timetpl,timeoffset,geotpl,specs))
+        # With fork, the first submission starts every worker, and map submits all events at once
+        results = executor.map(_run_worker_event,events,chunksize=chunksize)
+    finally:
+        if db_object != None:
+            db_object.reconnect()
+    with executor:
+        for (result,writes) in results:
+            if db_object != None:
+                replay_writes(writes,db_object)
+            yield result
@@ -0,0 +1,686 @@
+# Module providing the event analysis pipeline behind the weather_utils events command.
+#
+# The spreadsheet drivers in examples all do the same thing: read events (a time and a location) from
+# the rows of an input sheet, convert their local times to UTC, find the maximum wind gusts around
+# each event and write them next to the event in an output sheet. run_pipeline does this in stages:
+#
+#   load       an event reader yields the events of the input
+#   normalize  event times are parsed, localized and converted to UTC TimeUtils objects
+#   prefetch   the data for all events is fetched concurrently into the WeatherDB (weather_async)
+#   compute    get_max_gust for each event, on worker processes (weather_parallel)
+#   write      an event writer writes each event with its result, in input order
+#
+# Everything is set from a configuration section, see load_settings. Readers and writers are made by
+# the classes or functions named in READERS and WRITERS (EVENT_READER and EVENT_WRITER in the
+# section, excel by default), so new formats are added by registering them there.
+#
+#   python weather_utils.py -f weather_sdge_ign.ini events -u SDGE
+#
+import weather_config
+import weather_utils
+import weather_async
+import weather_parallel
+import csv
+import datetime
+from datetime import timedelta
+import json
+import logging
+import os
+import pytz
+
+EXCEL_EPOCH = datetime.datetime(1899,12,30)     # Day 0 of Excel serial dates (1900 date system)
+
+def parse_windows(raw):
+    # Tuple of integers from a comma separated configuration value such as '1,2' or '72,'
+    return tuple(int(win) for win in raw.split(',') if win.strip() != '')
+
+def load_settings(section,overrides=None):
+    # Pipeline settings from a configuration section. overrides is a dict of configuration keys
+    # and string values that take precedence over the section. Keys used, beyond the usual
+    # XL_DATA_FILE, XL_INPUT_SHEET, XL_OUTPUT_SHEET, WEATHER_DB, TIME_WINDOWS, DISTANCE_WINDOWS,
+    # FIRST_ROW, LAST_ROW and FREE_CELL:
+    #   XL_DATETIME_COLUMN, or XL_DATE_COLUMN and XL_TIME_COLUMN: event time columns
+    #   XL_LAT_COLUMN and XL_LONG_COLUMN (or XL_LATITUDE_COLUMN and XL_LONGITUDE_COLUMN)
+    #   XL_OUTPUT_FILE: workbook written, default XL_DATA_FILE. A different file is written as a new
+    #                   workbook holding just XL_OUTPUT_SHEET, streamed row by row
+    #   XL_OUTPUT_ROWS: SAME to write each event on its input row (default), or COMPACT to write
+    #                   the events from row 2, under a copy of the header row
+    #   TIME_ZONE: zone of the event times, default America/Los_Angeles
+    #   TIME_OFFSET: -1, 0 or 1, see weather_utils.get_event_window
+    #   TIME_SHIFT_HOURS: hours added to each event time, default 0
+    #   PREFETCH: fetch the data for all events before computing, default yes
+    #   CHECKPOINT_FILE: checkpoint ledger, default next to the output, see EventCheckpoint
+    #   EVENT_READER, EVENT_WRITER: names in READERS and WRITERS, default excel. The csv and parquet
+    #                   readers and writers use event tables, see TableEventReader and
+    #                   event_table_columns, in EVENT_FILE and EVENT_OUTPUT_FILE
+    # weighted is set by weather_mc: writers then add the weight of each event after its result.
+    conf = {key.upper():val for (key,val) in weather_config.config[section].items()}
+    if overrides != None:
+        conf.update({key.upper():val for (key,val) in overrides.items()})
+    data_file = conf.get('XL_DATA_FILE')
+    return {'section': section,
+            'config': conf,
+            'reader': conf.get('EVENT_READER','excel').lower(),
+            'writer': conf.get('EVENT_WRITER','excel').lower(),
+            'data_file': data_file,
+            'input_sheet': conf.get('XL_INPUT_SHEET'),
+            'output_file': conf.get('XL_OUTPUT_FILE',data_file),
+            'event_file': conf.get('EVENT_FILE'),
+            'event_output_file': conf.get('EVENT_OUTPUT_FILE'),
+            'output_sheet': conf.get('XL_OUTPUT_SHEET'),
+            'output_rows': conf.get('XL_OUTPUT_ROWS','same').lower(),
+            'datetime_column': conf.get('XL_DATETIME_COLUMN'),
+            'date_column': conf.get('XL_DATE_COLUMN'),
+            'time_column': conf.get('XL_TIME_COLUMN'),
+            'lat_column': conf.get('XL_LAT_COLUMN',conf.get('XL_LATITUDE_COLUMN')),
+            'lon_column': conf.get('XL_LONG_COLUMN',conf.get('XL_LONGITUDE_COLUMN')),
+            'first_row': int(conf.get('FIRST_ROW','2')),
+            'last_row': int(conf['LAST_ROW']) if 'LAST_ROW' in conf else None,
+            'free_cell': int(conf['FREE_CELL']) if 'FREE_CELL' in conf else None,
+            'weather_db': conf.get('WEATHER_DB'),
+            'time_windows': parse_windows(conf['TIME_WINDOWS']),
+            'distance_windows': parse_windows(conf['DISTANCE_WINDOWS']),
+            'time_offset': float(conf.get('TIME_OFFSET','0')),
+            'time_shift': float(conf.get('TIME_SHIFT_HOURS','0')),
+            'time_zone': conf.get('TIME_ZONE','America/Los_Angeles'),
+            'prefetch': conf.get('PREFETCH','yes').lower() in ('1','yes','true','on'),
+            'weighted': False}
+
+class Event(object):
+
+    # Class Event is one row of an event table: an id (the input row number for spreadsheets), the
+    # location, and the raw date and time values as read. values holds the whole input row, for
+    # writers that copy it. time is set to a UTC TimeUtils object by normalize_times. weight is the
+    # sampling weight of a Monte Carlo sample, written when the settings are weighted.
+
+    def __init__(self,event_id,latitude,longitude,date_value,time_value=None,values=None):
+        self.event_id = event_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.date_value = date_value
+        self.time_value = time_value
+        self.values = values
+        self.time = None
+        self.weight = None
+
+def parse_event_time(date_value,time_value=None):
+    # Naive local datetime from the date and time values of an event, or an aware datetime for ISO
+    # text with a zone. Spreadsheets hold these in several ways:
+    #   Excel datetime, with no time value or an Excel datetime time value
+    #   Excel date (midnight), with an Excel time or a 'HH:MM' string
+    #   'YYYY/MM/DD' string, with a 'HH:MM' string
+    #   ISO text, as in event tables
+    #   Excel serial datetime, or serial date plus serial time (fraction of a day), or serial date
+    #   with a full serial datetime as the time value
+    # Raises ValueError for anything else.
+    if isinstance(date_value,datetime.datetime):
+        if isinstance(time_value,datetime.time):
+            return datetime.datetime.combine(date_value.date(),time_value)
+        if date_value.hour == 0 and date_value.minute == 0 and time_value != None:
+            if isinstance(time_value,str):
+                tt = time_value.split(':')
+                return date_value.replace(hour=int(tt[0]),minute=int(tt[1]))
+            if isinstance(time_value,datetime.datetime):
+                return datetime.datetime.combine(date_value.date(),time_value.time())
+        return date_value
+    if isinstance(date_value,str):
+        if '/' in date_value and isinstance(time_value,str):
+            dd = date_value.split('/')
+            tt = time_value.split(':')
+            return datetime.datetime(int(dd[0]),int(dd[1]),int(dd[2]),int(tt[0]),int(tt[1]))
+        try:
+            return datetime.datetime.fromisoformat(date_value.replace('Z','+00:00'))
+        except ValueError:
+            raise ValueError("Unrecognized time value pair " + str(date_value) + ", " + str(time_value))
+    if isinstance(date_value,(int,float)) and 40000.0 < float(date_value) < 50000.0:
+        serial = float(date_value)
+        if serial.is_integer() and time_value != None:
+            if 40000.0 < float(time_value) < 50000.0:
+                serial = float(time_value)
+            elif float(time_value) < 1.0:
+                serial = serial + float(time_value)
+            else:
+                raise ValueError("Unrecognized time value pair " + str(date_value) + ", " + str(time_value))
+        return EXCEL_EPOCH + timedelta(seconds=round(serial*86400))
+    raise ValueError("Unrecognized time value pair " + str(date_value) + ", " + str(time_value))
+
+def normalize_times(events,settings):
+    # Sets the UTC time of each event from its local date and time values. Generator.
+    zone = pytz.timezone(settings['time_zone'])
+    shift = timedelta(hours=settings['time_shift'])
+    for event in events:
+        local = parse_event_time(event.date_value,event.time_value)
+        if local.tzinfo == None:
+            local = zone.localize(local)
+        event.time = weather_utils.TimeUtils(local.astimezone(pytz.utc) + shift)
+        yield event
+
+def prefetch_events(events,settings,db_object):
+    # Fetch the data for every event into db_object, concurrently. Requests that fail are left
+    # for the compute stage to retry.
+    fetch_requests = {}
+    radius = settings['distance_windows'][-1]
+    for event in events:
+        (tlo,thi) = weather_utils.get_event_window(event.time,settings['time_windows'],settings['time_offset'])
+        freq = (float(event.latitude),float(event.longitude),radius,tlo.synop(),thi.synop())
+        fetch_requests[freq] = True
+    (nfetched,failed) = weather_async.prefetch_observations(list(fetch_requests),db_object)
+    logging.info("Prefetched " + str(nfetched) + " of " + str(len(fetch_requests)) + " event windows")
+    if failed != []:
+        logging.warning(str(len(failed)) + " prefetch requests failed, they will be retried")
+
+def flatten_result(result):
+    # Values of a get_max_gust result in the order they are written: time windows, then radii,
+    # then the fields of each cell
+    values = []
+    for item in result:
+        if isinstance(item,(list,tuple)):
+            values.extend(flatten_result(item))
+        else:
+            values.append(item)
+    return values
+
+class EventReader(object):
+
+    # Base class for event readers. events yields Event objects in input order; header returns the
+    # rows (lists of values) that precede the events, for writers that copy them.
+
+    def __init__(self,settings):
+        self.settings = settings
+
+    def header(self):
+        return []
+
+    def events(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class EventWriter(object):
+
+    # Base class for event writers. open is called once with the reader's header rows, write once
+    # per event in input order, and close at the end, with complete False if the run stopped on an
+    # error.
+
+    def __init__(self,settings):
+        self.settings = settings
+
+    def open(self,header):
+        pass
+
+    def write(self,event,result):
+        raise NotImplementedError
+
+    def close(self,complete=True):
+        pass
+
+def column_index(column):
+    # Zero based index of a spreadsheet column letter, e.g. 'A' is 0 and 'AB' is 27
+    index = 0
+    for letter in column.strip().upper():
+        index = 26*index + ord(letter) - ord('A') + 1
+    return index - 1
+
+def output_row(values,free_cell,results):
+    # Output row values: the input row values, with the result values from column free_cell
+    # (1 based) on
+    row = list(values) if values != None else []
+    if len(row) < free_cell - 1:
+        row.extend([None]*(free_cell - 1 - len(row)))
+    row[free_cell-1:free_cell-1+len(results)] = results
+    return row
+
+def output_results(settings,event,values):
+    # Result values written for event: the flattened result, and with weighted settings the
+    # padding to the full result width and the event weight
+    if not settings['weighted']:
+        return values
+    width = len(settings['time_windows'])*len(settings['distance_windows'])*len(GUST_FIELDS)
+    return values + [None]*(width - len(values)) + [event.weight]
+
+class ExcelEventReader(EventReader):
+
+    # Reads events from rows FIRST_ROW to LAST_ROW (or the last row) of XL_INPUT_SHEET in
+    # XL_DATA_FILE, with the columns given in the settings. The workbook is opened read only and its
+    # rows are streamed, so large workbooks are not held in memory.
+
+    def __init__(self,settings):
+        super().__init__(settings)
+        from openpyxl import load_workbook     #Needs pip install
+        logging.info('Opening workbook ' + settings['data_file'])
+        self.workbook = load_workbook(filename=settings['data_file'],read_only=True)
+        self.sheet = self.workbook[settings['input_sheet']]
+
+    def header(self):
+        if self.settings['first_row'] <= 1:
+            return []
+        return [list(values) for values in self.sheet.iter_rows(min_row=1,max_row=self.settings['first_row']-1,
+                                                                 values_only=True)]
+
+    def events(self):
+        settings = self.settings
+        if settings['datetime_column'] != None:
+            (idate,itime) = (column_index(settings['datetime_column']),None)
+        else:
+            (idate,itime) = (column_index(settings['date_column']),column_index(settings['time_column']))
+        (ilat,ilon) = (column_index(settings['lat_column']),column_index(settings['lon_column']))
+        value = lambda values, icol: values[icol] if icol != None and icol < len(values) else None
+        irow = settings['first_row']
+        for values in self.sheet.iter_rows(min_row=settings['first_row'],max_row=settings['last_row'],values_only=True):
+            if settings['last_row'] != None or any(val != None for val in values):    # Skip blank rows at the end
+                yield Event(irow,value(values,ilat),value(values,ilon),value(values,idate),value(values,itime),
+                            list(values))
+            irow += 1
+
+    def close(self):
+        self.workbook.close()
+
+class ExcelEventWriter(EventWriter):
+
+    # Writes each event row, followed by its result from column FREE_CELL on, into XL_OUTPUT_SHEET
+    # of XL_OUTPUT_FILE, keeping the other sheets of the workbook, and saves the workbook on close,
+    # also after an error. Used when XL_OUTPUT_FILE is XL_DATA_FILE, see excel_writer. If the output
+    # sheet does not exist and the rows are kept in place, it starts as a copy of XL_INPUT_SHEET,
+    # with its formatting and non-event rows, and only the result cells are written.
+
+    def __init__(self,settings):
+        super().__init__(settings)
+        from openpyxl import load_workbook, Workbook     #Needs pip install
+        if os.path.isfile(settings['output_file']):
+            self.workbook = load_workbook(filename=settings['output_file'])
+        else:
+            self.workbook = Workbook()
+        self.results_only = False
+        if settings['output_sheet'] in self.workbook.sheetnames:
+            self.sheet = self.workbook[settings['output_sheet']]
+        elif settings['output_rows'] != 'compact' and settings['input_sheet'] in self.workbook.sheetnames:
+            self.sheet = self.workbook.copy_worksheet(self.workbook[settings['input_sheet']])
+            self.sheet.title = settings['output_sheet']
+            self.results_only = True
+        else:
+            self.sheet = self.workbook.create_sheet(settings['output_sheet'])
+        self.next_row = 1
+
+    def open(self,header):
+        if self.results_only:          # Already in the copied sheet
+            return
+        if self.settings['output_rows'] == 'compact':
+            header = header[0:1]
+        for values in header:
+            self._write_values(self.next_row,values)
+            self.next_row += 1
+
+    def write(self,event,result):
+        orow = self.next_row if self.settings['output_rows'] == 'compact' else event.event_id
+        logging.info("Writing line " + str(orow))
+        values = flatten_result(result)
+        if values == []:
+            logging.warning("No max gusts found for line " + str(orow))
+        results = output_results(self.settings,event,values)
+        if self.results_only:
+            for (icol,val) in enumerate(results):
+                self.sheet.cell(row=orow,column=self.settings['free_cell']+icol).value = val
+        else:
+            self._write_values(orow,output_row(event.values,self.settings['free_cell'],results))
+        self.next_row = orow + 1
+
+    def _write_values(self,irow,values):
+        for (icol,val) in enumerate(values):
+            self.sheet.cell(row=irow,column=icol+1).value = val
+
+    def close(self,complete=True):
+        if complete:
+            logging.info("Complete. Saving workbook " + self.settings['output_file'])
+        else:
+            logging.warning("Exiting on error. Saving workbook " + self.settings['output_file'])
+        self.workbook.save(self.settings['output_file'])
+
+class ExcelStreamWriter(ExcelEventWriter):
+
+    # Writes the output rows, in order and each once, to a new write only workbook XL_OUTPUT_FILE
+    # with the single sheet XL_OUTPUT_SHEET, replacing any existing file. Rows are streamed to
+    # disk as they are written.
+
+    def __init__(self,settings):
+        EventWriter.__init__(self,settings)
+        from openpyxl import Workbook     #Needs pip install
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(settings['output_sheet'])
+        self.results_only = False
+        self.next_row = 1
+
+    def _write_values(self,irow,values):
+        while self.next_row < irow:       # Rows between events, e.g. skipped blank rows
+            self.sheet.append([])
+            self.next_row += 1
+        self.sheet.append(values)
+
+def excel_writer(settings):
+    # Excel output: into the input workbook (ExcelEventWriter), or streamed to a separate
+    # XL_OUTPUT_FILE (ExcelStreamWriter)
+    if os.path.abspath(settings['output_file']) == os.path.abspath(settings['data_file']):
+        return ExcelEventWriter(settings)
+    return ExcelStreamWriter(settings)
+
+GUST_FIELDS = ('stid','mnet','dist','time','max_gust','count')    # Fields of a get_max_gust cell
+GUST_TYPES = ('string','string','float64','string','float64','int64')
+
+def result_columns(timetpl,geotpl):
+    # Names of the result columns of an event table, one per (time window, radius, field), in the
+    # order of flatten_result, e.g. max_gust_2h_8mi
+    return [field + '_' + format(tw,'g') + 'h_' + format(gw,'g') + 'mi'
+            for tw in timetpl for gw in geotpl for field in GUST_FIELDS]
+
+def event_table_columns(settings):
+    # (names, pyarrow type names) of the columns of an event results table: id, time (UTC),
+    # lat and lon, then result_columns, then weight with weighted settings
+    names = ['id','time','lat','lon'] + result_columns(settings['time_windows'],settings['distance_windows'])
+    types = ['string','timestamp','float64','float64'] + list(GUST_TYPES)*(len(names) - 4)
+    types = types[0:len(names)]
+    if settings['weighted']:
+        names.append('weight')
+        types.append('float64')
+    return (names,types)
+
+def event_table_row(settings,event,result):
+    # Values of the event results table row for event
+    return [str(event.event_id),event.time.datetime.datetime,float(event.latitude),float(event.longitude)] + \
+        output_results(settings,event,flatten_result(result))
+
+class TableEventReader(EventReader):
+
+    # Base class for readers of event tables with columns id, time, lat and lon (names set with
+    # EVENT_ID_COLUMN, EVENT_TIME_COLUMN, EVENT_LAT_COLUMN and EVENT_LON_COLUMN) from EVENT_FILE.
+    # Times without a zone are in TIME_ZONE. Without an id column the row number (from 1) is used.
+    # Subclasses provide rows, yielding a dict per row.
+
+    def events(self):
+        conf = self.settings['config']
+        (idcol,timecol) = (conf.get('EVENT_ID_COLUMN','id'),conf.get('EVENT_TIME_COLUMN','time'))
+        (latcol,loncol) = (conf.get('EVENT_LAT_COLUMN','lat'),conf.get('EVENT_LON_COLUMN','lon'))
+        for (irow,row) in enumerate(self.rows()):
+            yield Event(row.get(idcol,irow+1),float(row[latcol]),float(row[loncol]),row[timecol])
+
+class CsvEventReader(TableEventReader):
+
+    def rows(self):
+        with open(self.settings['event_file'],newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                yield row
+
+class ParquetEventReader(TableEventReader):
+
+    def rows(self):
+        import pyarrow.parquet as pq     #Needs pip install
+        for batch in pq.ParquetFile(self.settings['event_file']).iter_batches():
+            for row in batch.to_pylist():
+                yield row
+
+class CsvEventWriter(EventWriter):
+
+    # Writes the event results table to EVENT_OUTPUT_FILE as CSV, a row per event as it comes.
+    # Times are ISO text in UTC.
+
+    def open(self,header):
+        self.csvfile = open(self.settings['event_output_file'],'w',newline='')
+        self.writer = csv.writer(self.csvfile)
+        self.writer.writerow(event_table_columns(self.settings)[0])
+
+    def write(self,event,result):
+        row = event_table_row(self.settings,event,result)
+        row[1] = event.time.iso()
+        self.writer.writerow(row)
+
+    def close(self,complete=True):
+        self.csvfile.close()
+
+class ParquetEventWriter(EventWriter):
+
+    # Writes the event results table to EVENT_OUTPUT_FILE as Parquet, in row groups of
+    # PARQUET_ROW_GROUP events (default 10000).
+
+    def open(self,header):
+        import pyarrow as pa     #Needs pip install
+        import pyarrow.parquet as pq
+        self.pa = pa
+        (names,types) = event_table_columns(self.settings)
+        self.schema = pa.schema([(name,pa.timestamp('s',tz='UTC') if tp == 'timestamp' else pa.type_for_alias(tp))
+                                 for (name,tp) in zip(names,types)])
+        self.group_size = int(self.settings['config'].get('PARQUET_ROW_GROUP','10000'))
+        self.writer = pq.ParquetWriter(self.settings['event_output_file'],self.schema)
+        self.rows = []
+
+    def write(self,event,result):
+        self.rows.append(event_table_row(self.settings,event,result))
+        if len(self.rows) >= self.group_size:
+            self._flush()
+
+    def _flush(self):
+        if self.rows != []:
+            columns = [list(col) for col in zip(*self.rows)]
+            self.writer.write_table(self.pa.Table.from_arrays([self.pa.array(col,type=field.type)
+                                                               for (col,field) in zip(columns,self.schema)],
+                                                              schema=self.schema))
+            self.rows = []
+
+    def close(self,complete=True):
+        self._flush()
+        self.writer.close()
+
+READERS = {'excel': ExcelEventReader, 'csv': CsvEventReader, 'parquet': ParquetEventReader}
+WRITERS = {'excel': excel_writer, 'csv': CsvEventWriter, 'parquet': ParquetEventWriter}
+
+def convert_events(settings,output_file):
+    # Writes the events of the settings' reader, e.g. an Excel sheet, to output_file as an event
+    # table with columns id, time (UTC), lat and lon: Parquet if output_file ends in .parquet,
+    # otherwise CSV. Returns the number of events written.
+    reader = READERS[settings['reader']](settings)
+    try:
+        events = list(normalize_times(reader.events(),settings))
+    finally:
+        reader.close()
+    rows = [[str(event.event_id),event.time.iso(),float(event.latitude),float(event.longitude)] for event in events]
+    if output_file.endswith('.parquet'):
+        import pyarrow as pa     #Needs pip install
+        import pyarrow.parquet as pq
+        columns = [list(col) for col in zip(*rows)] if rows != [] else [[],[],[],[]]
+        table = pa.table({'id': pa.array(columns[0],type=pa.string()),
+                          'time': pa.array([event.time.datetime.datetime for event in events],type=pa.timestamp('s',tz='UTC')),
+                          'lat': pa.array(columns[2],type=pa.float64()),
+                          'lon': pa.array(columns[3],type=pa.float64())})
+        pq.write_table(table,output_file)
+    else:
+        with open(output_file,'w',newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['id','time','lat','lon'])
+            writer.writerows(rows)
+    logging.info(str(len(rows)) + " events written to " + output_file)
+    return len(rows)
+
+def open_weather_db(db_name):
+    # The WeatherDB of a run, created if it does not exist yet
+    if os.path.isfile(db_name):
+        return weather_utils.WeatherDB(db_name)
+    return weather_utils.WeatherDB.create(db_name)
+
+class EventCheckpoint(object):
+
+    # Class EventCheckpoint keeps a ledger of the events completed in a run, so that an interrupted
+    # run can be resumed without recomputing them. The ledger is a JSON lines file: a first line
+    # with the settings that shape the results and pick the events, then one line per completed
+    # event with its id, location, UTC time and result, flushed as it is written. A line cut short
+    # by a crash is ignored on loading.
+
+    FINGERPRINT = ('reader','data_file','input_sheet','event_file','first_row','last_row','time_zone','weather_db',
+                   'time_windows','distance_windows','time_offset','time_shift')
+
+    def __init__(self,path,settings):
+        self.path = path
+        self.fingerprint = {key:list(settings[key]) if isinstance(settings[key],tuple) else settings[key]
+                            for key in self.FINGERPRINT}
+        self.ledger = None
+
+    def load(self,events):
+        # Returns {event id: result} from an existing ledger for those of events it holds, or {} if
+        # there is none. An event whose location or time differs from its ledger line, e.g. after
+        # rows were inserted in the input, is left out so that it is computed again. Raises
+        # ValueError if the ledger was made with different settings or its settings line is unreadable.
+        if not os.path.isfile(self.path):
+            return {}
+        (settings,records) = (None,{})
+        with open(self.path) as ledger:
+            for (iline,line) in enumerate(ledger):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if iline == 0:
+                        raise ValueError("Checkpoint " + self.path + " has no readable settings line")
+                    logging.warning("Skipping incomplete checkpoint line " + str(iline+1) + " in " + self.path)
+                    continue
+                if iline == 0:
+                    if not isinstance(record,dict) or 'settings' not in record:
+                        raise ValueError("Checkpoint " + self.path + " has no readable settings line")
+                    settings = record['settings']
+                    if settings != self.fingerprint:
+                        raise ValueError("Checkpoint " + self.path + " was made with different settings " + str(settings))
+                else:
+                    records[record['id']] = record
+        if settings == None:
+            raise ValueError("Checkpoint " + self.path + " has no readable settings line")
+        done = {}
+        nchanged = 0
+        for event in events:
+            record = records.get(str(event.event_id))
+            if record == None:
+                continue
+            if [record.get('lat'),record.get('lon'),record.get('time')] == self.event_key(event):
+                done[str(event.event_id)] = record['result']
+            else:
+                nchanged += 1
+        if nchanged > 0:
+            logging.warning(str(nchanged) + " events changed since " + self.path + " was written, computing them again")
+        return done
+
+    def event_key(self,event):
+        # Location and UTC time of event as recorded in the ledger, after a JSON round trip
+        return json.loads(json.dumps([event.latitude,event.longitude,event.time.iso()]))
+
+    def open(self,resume):
+        # Opens the ledger for appending, keeping the events already recorded if resuming
+        if resume and os.path.isfile(self.path):
+            self.ledger = open(self.path,'a')
+        else:
+            self.ledger = open(self.path,'w')
+            self.ledger.write(json.dumps({'settings':self.fingerprint}) + '\n')
+            self.ledger.flush()
+
+    def record(self,event,result):
+        (lat,lon,time) = self.event_key(event)
+        self.ledger.write(json.dumps({'id':str(event.event_id),'lat':lat,'lon':lon,'time':time,'result':result}) + '\n')
+        self.ledger.flush()
+
+    def close(self,complete=True):
+        # Closes the ledger, and removes it once the run is complete
+        if self.ledger != None:
+            self.ledger.close()
+            self.ledger = None
+        if complete and os.path.isfile(self.path):
+            os.remove(self.path)
+
+def checkpoint_file(settings):
+    # Ledger file of a run: CHECKPOINT_FILE, or next to the output, or None if the output is not
+    # known
+    conf = settings['config']
+    if 'CHECKPOINT_FILE' in conf:
+        return conf['CHECKPOINT_FILE']
+    output = settings['output_file'] if settings['writer'] == 'excel' else settings['event_output_file']
+    return output + '.checkpoint.jsonl' if output != None else None
+
+def run_pipeline(settings,db_object,reader=None,writer=None,workers=None,prefetch=None,resume=False):
+    # Runs the events of reader (default: READERS[settings['reader']]) through the stages and writes
+    # them with writer (default: WRITERS[settings['writer']]). workers is as for
+    # weather_parallel.run_events, and prefetch defaults to settings['prefetch'].
+    # Each result is recorded in a checkpoint ledger (see checkpoint_file) as it is computed. With
+    # resume, events already in the ledger are not computed again: their recorded results are
+    # written in their place. The ledger is removed when the run completes.
+    # Returns the number of events written.
+    if reader == None:
+        reader = READERS[settings['reader']](settings)
+    if prefetch == None:
+        prefetch = settings['prefetch']
+    try:
+        events = list(normalize_times(reader.events(),settings))
+        header = reader.header()
+    finally:
+        reader.close()
+    logging.info(str(len(events)) + " events loaded")
+    checkpoint = None
+    done = {}
+    if checkpoint_file(settings) != None:
+        if len(set(str(event.event_id) for event in events)) == len(events):
+            checkpoint = EventCheckpoint(checkpoint_file(settings),settings)
+            if resume:
+                done = checkpoint.load(events)
+                logging.info(str(len(done)) + " events already done in " + checkpoint.path)
+        else:
+            logging.warning("Event ids are not unique, no checkpoint is kept")
+    pending = [event for event in events if str(event.event_id) not in done]
+    if prefetch and db_object != None and pending != []:
+        prefetch_events(pending,settings,db_object)
+    if writer == None:
+        writer = WRITERS[settings['writer']](settings)
+    nwritten = 0
+    complete = False
+    try:
+        if checkpoint != None:
+            checkpoint.open(resume)
+        writer.open(header)
+        results = weather_parallel.run_events([(event.latitude,event.longitude,event.time) for event in pending],
+                                              settings['time_windows'],settings['time_offset'],
+                                              settings['distance_windows'],db_object,workers=workers)
+        for event in events:
+            if str(event.event_id) in done:
+                result = done[str(event.event_id)]
+            else:
+                result = next(results)
+                if checkpoint != None:
+                    checkpoint.record(event,result)
+            writer.write(event,result)
+            nwritten += 1
+        results.close()
+        complete = True
+    finally:
+        writer.close(complete)
+        if checkpoint != None:
+            checkpoint.close(complete)
+    return nwritten
+
+def run_section(section,overrides=None,workers=None,prefetch=None,resume=False):
+    # Runs the pipeline for a configuration section, see load_settings, with its WEATHER_DB
+    settings = load_settings(section,overrides)
+    db_object = open_weather_db(settings['weather_db'])
+    try:
+        return run_pipeline(settings,db_object,workers=workers,prefetch=prefetch,resume=resume)
+    finally:
+        db_object.close()
+
+def add_arguments(parser):
+    # Arguments of the weather_utils events command
+    parser.add_argument('-u','--utility',required=True,help='Configuration section, e.g. PGE, SCE, SDGE')
+    parser.add_argument('-j','--jobs',type=int,help='Number of worker processes (default PARALLEL_WORKERS or one per core)')
+    parser.add_argument('--no-prefetch',action='store_true',help='Skip the prefetch stage')
+    parser.add_argument('--resume',action='store_true',help='Continue an interrupted run from its checkpoint')
+
+def run_command(args):
+    # The weather_utils events command
+    run_section(args.utility,workers=args.jobs,prefetch=False if args.no_prefetch else None,resume=args.resume)
+
+def add_convert_arguments(parser):
+    # Arguments of the weather_utils convert command
+    parser.add_argument('-u','--utility',required=True,help='Configuration section, e.g. PGE, SCE, SDGE')
+    parser.add_argument('-o','--output',required=True,help='Event table to write, .csv or .parquet')
+
+def run_convert_command(args):
+    # The weather_utils convert command
+    convert_events(load_settings(args.utility),args.output)
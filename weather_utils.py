@@ -1,11 +1,14 @@
 # Module of weather utilities to be used with Synoptic API and sqlite
 #
 import weather_config
+import weather_client
+import argparse
 import urllib.request as req
 from requests.exceptions import HTTPError
 import requests
 import os
 import os.path
+import pathlib
 import json
 import random
 import sqlite3    #needs pip install
@@ -15,6 +18,18 @@ from datetime import timedelta
 import pytz
 import zulu       #Needs pip install
 import logging
+import math
+import re
+import itertools
+import functools
+import numpy as np   #Needs pip install
+
+if __name__ == '__main__':
+    # Run as a command, see main below. The configuration named by -f is needed by the settings
+    # that follow.
+    _config_parser = argparse.ArgumentParser(add_help=False)
+    _config_parser.add_argument('-f','--config',default=weather_config.DEFAULT_CONFIG)
+    weather_config.init(_config_parser.parse_known_args()[0].config)
 
 logging.basicConfig(level=weather_config.config['Default']['LOG_LEVEL'])
 
@@ -23,6 +38,38 @@ token = weather_config.config['Default']['API_TOKEN']
 units = weather_config.config['Default']['UNITS']
 db_schema_raw = weather_config.config['Schema']['DB_SCHEMA']
 db_schema = json.loads(db_schema_raw)
+# Number of recently parsed time strings kept by parse_time_string
+time_cache_size = int(weather_config.config['Default'].get('TIME_CACHE_SIZE','4096'))
+
+EARTH_RADIUS_MILES = 3958.8
+SCHEMA_EPOCH_TIMES = 1        # PRAGMA user_version of databases storing observations.date_time as epoch seconds
+# Hourly rollup columns: (rollup column, observations column, aggregate)
+ROLLUP_COLUMNS = (('max_gust','wind_gust_set_1','max'),('max_wind','wind_speed_set_1','max'),
+                  ('min_rh','relative_humidity_set_1','min'),('max_temp','air_temp_set_1','max'))
+
+synoptic_client = None
+
+def get_synoptic_client():
+    # Returns the shared SynopticClient used for all API calls, creating it on first use.
+    # Timeouts, retries and pool size can be set in the [Default] section of the configuration.
+    # Setting RESPONSE_CACHE_DIR there keeps the raw responses on disk as well, see
+    # weather_client.ResponseCache.
+    global synoptic_client
+    if synoptic_client == None:
+        defaults = weather_config.config['Default']
+        cache = None
+        if defaults.get('RESPONSE_CACHE_DIR'):
+            cache = weather_client.ResponseCache(defaults['RESPONSE_CACHE_DIR'],
+                                                 max_bytes=int(float(defaults.get('RESPONSE_CACHE_MB','1024'))*1024**2),
+                                                 mode=defaults.get('RESPONSE_CACHE_MODE','readwrite'),
+                                                 compression=defaults.get('RESPONSE_CACHE_COMPRESSION','gzip'))
+        synoptic_client = weather_client.SynopticClient(token,
+                                                        timeout=float(defaults.get('HTTP_TIMEOUT','60')),
+                                                        retries=int(defaults.get('HTTP_RETRIES','5')),
+                                                        backoff=float(defaults.get('HTTP_BACKOFF','1.0')),
+                                                        pool_size=int(defaults.get('HTTP_POOL_SIZE','10')),
+                                                        cache=cache)
+    return synoptic_client
 
 def get_base_api_request_url(query_type):
     query_type_address = ''
@@ -55,10 +102,9 @@ def python_to_sql(obj):
 def get_example_radius_dataset():
     radius = (38.09,-122.65,3)
     st_radius = ",".join(map(str,radius))
-    api_arguments = {"token":token,"start":"202210092300","end":"202210100400","radius":st_radius,"units":"metric"}
+    api_arguments = {"start":"202210092300","end":"202210100400","radius":st_radius,"units":"metric"}
     api_request_url = get_base_api_request_url("timeseries")
-    req = requests.get(api_request_url, params=api_arguments)
-    data = req.json()
+    data = get_synoptic_client().get(api_request_url,api_arguments)
     return(data)
 
 def get_station_by_stid(stid,db_object):
@@ -74,9 +120,8 @@ def get_station_by_stid(stid,db_object):
     if station == {}:
         # Call API to find station
         api_request_url = get_base_api_request_url('station')
-        api_arguments = {'token':token,'stid':stid,'sensorvars':1}
-        req = requests.get(api_request_url, params=api_arguments)
-        station = req.json()
+        api_arguments = {'stid':stid,'sensorvars':1}
+        station = get_synoptic_client().get(api_request_url,api_arguments)
         rc = station['SUMMARY']['RESPONSE_CODE']
         if rc == 2:
             estr = "stid " + stid + " is not a valid station"
@@ -89,67 +134,143 @@ def get_station_by_stid(stid,db_object):
 def get_observations_by_stid_datetime(stid,firstdt,lastdt,db_object):
     # Get a set of observations from a specified weather station in a specified time range.
     # Zulu time is used for the timestamps. 
-    # Checks whether the database contains a complete record. If not, re-fills from time range.
+    # The station coverage ledger in the database records which intervals have already been fetched
+    # for the station. Only the missing gaps are requested from the API, in chunks of at most
+    # STID_CHUNK_DAYS days ([Default] section, 30 if unset).
 
     get_station_by_stid(stid,db_object)
-    if db_object!=None:
-        obs = db_object.get_observations(stid,firstdt,lastdt)
-        firzdt = TimeUtils(firstdt)
-        laszdt = TimeUtils(lastdt)
-        needsapi = False
-        if obs != []:
-            nobs = len(obs)
-            if nobs > 1:
-                secobtime = obs[1]['DATE_TIME']
-                secztime = TimeUtils(secobtime)
-                tdelta = secztime.datetime - firzdt.datetime
-                trange = laszdt.datetime - firzdt.datetime 
-                ticks = int(trange.seconds / tdelta.seconds)
-                difobsticks = abs(nobs-ticks)
-                if difobsticks > 1:
-                    needsapi = True
-    else:
-        needsapi = True
-        
-    if needsapi:
-        # There are missing observations within the time range.
-        # Call the API to get missing data over the entire range.
-        api_arguments = {"token":token,"start":firzdt.synop(),"end":laszdt.synop(),"stid":stid,"units":units}
-        api_request_url = get_base_api_request_url("timeseries")
-        req = requests.get(api_request_url, params=api_arguments)
-        data = req.json()
-        if db_object != Null :
-            db_object.add_observations(data)
-            obs = db_object.get_observations(stid,firstdt,lastdt)
+    firzdt = TimeUtils(firstdt)
+    laszdt = TimeUtils(lastdt)
+    api_request_url = get_base_api_request_url("timeseries")
+
+    if db_object == None:
+        api_arguments = {"start":firzdt.synop(),"end":laszdt.synop(),"stid":stid,"units":units}
+        data = get_synoptic_client().get(api_request_url,api_arguments)
+        return observation_rows(data,stid)
+
+    for (clo,chi) in get_station_fetch_chunks(stid,firzdt,laszdt,db_object):
+        api_arguments = {"start":clo.synop(),"end":chi.synop(),"stid":stid,"units":units}
+        data = get_synoptic_client().get(api_request_url,api_arguments)
+        store_station_observations(data,stid,clo,chi,db_object)
+    obs = db_object.get_observations(stid,firzdt.iso(),laszdt.iso())
 
     return(obs)
 
+def get_station_fetch_chunks(stid,firstdt,lastdt,db_object):
+    # Returns the (start, end) TimeUtils pairs that still need to be fetched for a station: the gaps
+    # in its coverage ledger between firstdt and lastdt, split into chunks of at most STID_CHUNK_DAYS.
+    chunk = timedelta(days=float(weather_config.config['Default'].get('STID_CHUNK_DAYS','30')))
+    chunks = []
+    (dtlow,dthigh) = (EpochTime.parse(firstdt.synop()).iso(),EpochTime.parse(lastdt.synop()).iso())
+    for (glo,ghi) in db_object.get_station_gaps(stid,dtlow,dthigh):
+        clo = TimeUtils(glo).datetime.datetime
+        ghi = TimeUtils(ghi).datetime.datetime
+        while True:
+            chi = min(clo + chunk,ghi)
+            chunks.append((TimeUtils(clo),TimeUtils(chi)))
+            if chi >= ghi:
+                break
+            clo = chi
+    return chunks
+
+def store_station_observations(data,stid,firstdt,lastdt,db_object):
+    # Add the observations from a station query response to the database and record the interval
+    # in the station coverage ledger.
+    db_object.add_observations(data)
+    if data['SUMMARY']['RESPONSE_CODE'] in (1,2):
+        db_object.add_station_coverage(stid,EpochTime.parse(firstdt.synop()).iso(),EpochTime.parse(lastdt.synop()).iso())
+
+def observation_rows(data,stid):
+    # Converts the observations for one station in a Synoptic timeseries response into the list of
+    # dicts format returned by WeatherDB.get_observations, with upper case keys.
+    oblist = []
+    for station in data.get('STATION',[]):
+        if station['STID'] != stid:
+            continue
+        obs = station['OBSERVATIONS']
+        keys = [okey for okey in obs.keys() if okey.lower() in db_schema]
+        for i in range(len(obs['date_time'])):
+            obdict = {okey.upper():obs[okey][i] for okey in keys}
+            obdict['STID'] = stid
+            oblist.append(obdict)
+    return oblist
+
 def get_observations_by_radius_datetime(latitude,longitude,radius,firstdt,lastdt,db_object):
     # This will return all observations within the radius and time window. Will check for existence
     # in database first. The time variables firstdt and lastdt are TimeUtils objects.
 
-    obsdb = check_db_radius_datetime(latitude,longitude,radius,firstdt,lastdt,db_object) # Stubbed
+    obsdb = check_db_radius_datetime(latitude,longitude,radius,firstdt,lastdt,db_object)
 
     if obsdb == False:
-        georadius = (latitude,longitude,radius)
-        st_radius = ",".join(map(str,georadius))
-        api_arguments = {"token":token,"start":firstdt.synop(),"end":lastdt.synop(),"radius":st_radius,"units":units}
+        api_arguments = get_radius_api_arguments(latitude,longitude,radius,firstdt,lastdt)
         api_request_url = get_base_api_request_url("timeseries")
-        req = requests.get(api_request_url, params=api_arguments)
-        data = req.json()
-        db_object.add_observations(data)
+        data = get_synoptic_client().get(api_request_url,api_arguments)
+        if db_object != None:
+            store_radius_observations(data,latitude,longitude,radius,firstdt,lastdt,db_object)
+        return(data)
+
+    return(obsdb)
 
-    return(data or obsdb)
+def get_radius_api_arguments(latitude,longitude,radius,firstdt,lastdt):
+    # Synoptic timeseries arguments for a radius query, without the token
+    georadius = (latitude,longitude,radius)
+    st_radius = ",".join(map(str,georadius))
+    return {"start":firstdt.synop(),"end":lastdt.synop(),"radius":st_radius,"units":units}
+
+def store_radius_observations(data,latitude,longitude,radius,firstdt,lastdt,db_object):
+    # Add the observations from a radius query response to the database and record the query
+    # footprint in the coverage ledger, and the time window in the station coverage ledger.
+    db_object.add_observations(data)
+    # Only a successful answer (including "no stations found") means the footprint is known
+    if data['SUMMARY']['RESPONSE_CODE'] in (1,2):
+        dtlow = EpochTime.parse(firstdt.synop()).iso()
+        dthigh = EpochTime.parse(lastdt.synop()).iso()
+        db_object.add_coverage(latitude,longitude,radius,dtlow,dthigh)
+        # Every station returned has all of its observations in the window
+        for station in data.get('STATION',[]):
+            db_object.add_station_coverage(station['STID'],dtlow,dthigh)
 
 def check_db_radius_datetime(latitude,longitude,radius,firstdt,lastdt,db_object):
-    # Stubbed because this is hard.
-    # Proposed solution: 1) Return all stations within radius at firstdt. 2) Iterate over stations,
-    # getting all observations and checking completeness within time window 3) Merge all station
-    # observations into one object 4) As soon as any missing station or data is found, exit returning
-    # False.
-    return False
-
-def get_max_gust(latitude,longitude, mgtime, timetpl, timeoffset, geotpl, db_object):
+    # Returns the observations within the radius and time window from the database, in the same
+    # {'SUMMARY':..., 'STATION':[...]} format as the Synoptic API, if the coverage ledger shows that
+    # the whole footprint and time window have already been fetched. Otherwise returns False.
+    # The time window is truncated to whole minutes, as it is for the API request.
+    if db_object == None:
+        return False
+    dtlow = EpochTime.parse(firstdt.synop()).iso()
+    dthigh = EpochTime.parse(lastdt.synop()).iso()
+    if not db_object.check_coverage(latitude,longitude,radius,dtlow,dthigh):
+        return False
+    logging.debug("Radius query " + str((latitude,longitude,radius)) + " answered from " + db_object.db_name)
+    return db_object.get_observations_by_radius(latitude,longitude,radius,dtlow,dthigh)
+
+def get_radius_observation_arrays(latitude,longitude,radius,firstdt,lastdt,db_object,variable='wind_gust_set_1'):
+    # Same as observation_arrays(get_observations_by_radius_datetime(...)), but reads the arrays
+    # straight from the database columns when the coverage ledger already holds the query.
+    # variable may be a list of variables, as for observation_arrays.
+    # Returns (station arrays, {stid: (latitude, longitude)}).
+    if db_object != None:
+        dtlow = EpochTime.parse(firstdt.synop()).iso()
+        dthigh = EpochTime.parse(lastdt.synop()).iso()
+        if db_object.check_coverage(latitude,longitude,radius,dtlow,dthigh):
+            return db_object.get_observation_arrays(latitude,longitude,radius,dtlow,dthigh,variable)
+    wmobs = get_observations_by_radius_datetime(latitude,longitude,radius,firstdt,lastdt,db_object)
+    stpos = {}
+    if wmobs['SUMMARY']['NUMBER_OF_OBJECTS'] > 0 :
+        stpos = {wo['STID']:(wo['LATITUDE'],wo['LONGITUDE']) for wo in wmobs['STATION']}
+    return (observation_arrays(wmobs,variable),stpos)
+
+def haversine(lat1,lon1,lat2,lon2):
+    # Great circle distance in miles between two points given in decimal degrees. Synoptic
+    # radius queries and station DISTANCE values are in miles.
+    phi1 = math.radians(float(lat1))
+    phi2 = math.radians(float(lat2))
+    dphi = phi2 - phi1
+    dlam = math.radians(float(lon2) - float(lon1))
+    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlam/2)**2
+    return 2*EARTH_RADIUS_MILES*math.asin(min(1.0,math.sqrt(a)))
+
+def get_max_gust(latitude,longitude, mgtime, timetpl, timeoffset, geotpl, db_object, rollup=True, gust_index=None):
     # Returns the maximum wind gust speed at a location during a time window.
     # Accepts real latitude, longitude, and radius. 'time' is a TimeUtils object.
     # The timetpl is a tuple object containing time windows in hours. For example (1,2) would be a
@@ -159,64 +280,404 @@ def get_max_gust(latitude,longitude, mgtime, timetpl, timeoffset, geotpl, db_obj
     # get_max_gust returns an m X n array of tuples, where m is the number of time windows and n is the
     # number of radius windows. The tuple returned for each is (time, weather station stid,
     # weather station mesonet,  maximum gust, count of readings).
+    # With rollup, the result is read from the hourly rollup table instead of the observations when
+    # the database already holds the data and every time bin starts and ends on the hour.
+    # An optional weather_index.GustIndex answers any windows it has loaded, before the rollup.
     
-    twindows = len(timetpl)
     gwindows = len(geotpl)
 
     # Get data for maximum radius and time window. Uses time offset to determine where measurements start
 
-    if timeoffset == 0: 
-        thi = TimeUtils(mgtime.datetime.datetime + timedelta(hours=timetpl[twindows-1]/2))
-        tlo = TimeUtils(mgtime.datetime.datetime - timedelta(hours=timetpl[twindows-1]/2))
-    elif timeoffset == -1:
-        thi = TimeUtils(mgtime.datetime.datetime)
-        tlo = TimeUtils(mgtime.datetime.datetime) - timedelta(hours=timetpl[twindows-1])
-    elif timeoffset == 1:
-        thi = TimeUtils(mgtime.datetime.datetime) + timedelta(hours=timetpl[twindows-1])
-        tlo = TimeUtils(mgtime.datetime.datetime)
-    else:   #Backwards compatibility
-        thi = TimeUtils(mgtime.datetime.datetime + timedelta(hours=timetpl[twindows-1]/2))
-        tlo = TimeUtils(mgtime.datetime.datetime - timedelta(hours=timetpl[twindows-1]/2))
-
+    (tlo,thi) = get_event_window(mgtime,timetpl,timeoffset)
         
-    wmobs = get_observations_by_radius_datetime(latitude,longitude,geotpl[gwindows-1],tlo,thi,db_object)
+    if gust_index != None and db_object != None:
+        womax = get_max_gust_index(latitude,longitude,mgtime,timetpl,geotpl,tlo,thi,db_object,gust_index)
+        if womax != None:
+            return womax
+    if rollup and db_object != None:
+        womax = get_max_gust_rollup(latitude,longitude,mgtime,timetpl,geotpl,tlo,thi,db_object)
+        if womax != None:
+            return womax
 
     # Return data object: time bins X radius bins X [stid, mnet, distance, datetime, max gust, count]
+    extremes = get_window_extremes(latitude,longitude,mgtime,timetpl,timeoffset,geotpl,[('wind_gust_set_1','max')],
+                                   db_object)
+    return [[gust_cell(cells[0]) for cells in row] for row in extremes]
+
+def get_window_extremes(latitude, longitude, mgtime, timetpl, timeoffset, geotpl, specs, db_object):
+    # Generalization of get_max_gust to any (variable, reducer) specs, e.g.
+    # [('air_temp_set_1','max'), ('relative_humidity_set_1','min'), ('wind_gust_set_1','p95')].
+    # Makes one fetch and one scan for all specs. Returns time bins X radius bins X specs X
+    # [stid, mnet, distance, datetime, value, count], see window_extremes_kernel.
+    (tlo,thi) = get_event_window(mgtime,timetpl,timeoffset)
+    variables = list(dict.fromkeys(parse_reducer(spec)[0] for spec in specs))
+    (starr,stpos) = get_radius_observation_arrays(latitude,longitude,geotpl[len(geotpl)-1],tlo,thi,db_object,variables)
+    return window_extremes_kernel(starr,get_time_bins(mgtime,timetpl),timetpl,geotpl,specs)
+
+def get_max_gust_rollup(latitude, longitude, mgtime, timetpl, geotpl, tlo, thi, db_object):
+    # get_max_gust answered from the hourly rollup table, for the data window (tlo, thi) from
+    # get_event_window. Returns None if the coverage ledger does not hold the window or a time bin
+    # edge is not on the hour. A bin [lo, hi] is made up of the rollup hours lo to hi - 1h plus the
+    # observations at exactly hi; ties go to the later reading and the later station, as in
+    # max_gust_kernel.
+    twindows = len(timetpl)
+    gwindows = len(geotpl)
+    radius = geotpl[gwindows-1]
+    wlo = EpochTime.parse(tlo.synop()).epoch
+    whi = EpochTime.parse(thi.synop()).epoch
+    centers = get_time_bins(mgtime,timetpl)
+    edges = []
+    for ti in range(twindows):
+        (lo,hi) = (max(centers[ti] - timetpl[ti]*3600,wlo),min(centers[ti] + timetpl[ti]*3600,whi))
+        if lo % 3600 != 0 or hi % 3600 != 0:
+            return None
+        edges.append((int(lo),int(hi)))
+    if not db_object.check_coverage(latitude,longitude,radius,EpochTime.parse(tlo.synop()).iso(),EpochTime.parse(thi.synop()).iso()):
+        return None
+    logging.debug("Max gust for " + str((latitude,longitude)) + " answered from hourly rollup")
+
+    stdist = db_object.stations_within(latitude,longitude,radius)
+    stids = [st for (st,dist) in stdist]
+    stinfo = db_object.station_info(stids)
+    hourly = db_object.get_rollup_columns(stids,min(lo for (lo,hi) in edges),max(hi for (lo,hi) in edges))
+    points = {}
+    for hi in set(hi for (lo,hi) in edges):
+        iso = iso_times([hi])[0]
+        points[hi] = db_object.get_observations_columns(stids,iso,iso)
     womax = [[[None,None,None,None,0,0] for i in range(gwindows)] for j in range(twindows)]
-        
-    wtlst = []
-    i = 0
+    for (ti,(lo,hi)) in enumerate(edges):
+        if lo > hi:                   # Bin lies outside the data window
+            continue
+        inhours = (hourly['hour'] >= lo) & (hourly['hour'] < hi) & (hourly['max_gust_count'] > 0)
+        atend = ~np.isnan(points[hi]['wind_gust_set_1'])
+        for (ist,(stid,dist)) in enumerate(stdist):
+            strad = round(dist,2)
+            gbins = [gi for gi in range(gwindows) if strad <= geotpl[gi]]
+            hmask = inhours & (hourly['station'] == ist)
+            values = hourly['max_gust'][hmask]
+            times = hourly['max_gust_time'][hmask]
+            count = int(hourly['max_gust_count'][hmask].sum())
+            pmask = atend & (points[hi]['station'] == ist)
+            if pmask.any():
+                values = np.append(values,points[hi]['wind_gust_set_1'][pmask])
+                times = np.append(times,hi)
+                count += 1
+            if count == 0 or gbins == []:
+                continue
+            gmax = float(values.max())
+            gtime = int(times[values == gmax].max())       # Last reading equal to the maximum
+            merge_station_max(womax[ti],gbins,(stid,stinfo[stid][0],strad),gmax,gtime,count)
+    return womax
 
-    for tw in [-0.5,0.5]:
-        for tm in timetpl:
-            wtlst.append(mgtime.datetime.datetime + timedelta(hours=tm*tw))
+def get_max_gust_index(latitude, longitude, mgtime, timetpl, geotpl, tlo, thi, db_object, gust_index):
+    # get_max_gust answered from a weather_index.GustIndex, for the data window (tlo, thi) from
+    # get_event_window. Returns None unless the coverage ledger holds the window and the index has
+    # every station within the largest radius loaded for it.
+    twindows = len(timetpl)
+    gwindows = len(geotpl)
+    radius = geotpl[gwindows-1]
+    wlo = EpochTime.parse(tlo.synop()).epoch
+    whi = EpochTime.parse(thi.synop()).epoch
+    stdist = db_object.stations_within(latitude,longitude,radius)
+    if not all(gust_index.covers(stid,wlo,whi) for (stid,dist) in stdist):
+        return None
+    if not db_object.check_coverage(latitude,longitude,radius,EpochTime.parse(tlo.synop()).iso(),EpochTime.parse(thi.synop()).iso()):
+        return None
+    stinfo = db_object.station_info([st for (st,dist) in stdist])
+    centers = get_time_bins(mgtime,timetpl)
+    womax = [[[None,None,None,None,0,0] for i in range(gwindows)] for j in range(twindows)]
+    for ti in range(twindows):
+        (lo,hi) = (max(centers[ti] - timetpl[ti]*3600,wlo),min(centers[ti] + timetpl[ti]*3600,whi))
+        for (stid,dist) in stdist:
+            strad = round(dist,2)
+            gbins = [gi for gi in range(gwindows) if strad <= geotpl[gi]]
+            (gmax,gtime,count) = gust_index.window_max(stid,lo,hi)
+            if count == 0 or gbins == []:
+                continue
+            merge_station_max(womax[ti],gbins,(stid,stinfo[stid][0],strad),gmax,gtime,count)
+    return womax
+
+def merge_station_max(wobins,gbins,station,gmax,gtime,count):
+    # Merge one station's maximum for a time bin into the radius bins gbins of wobins, as in
+    # max_gust_kernel: counts add up, and the later station wins a tie. station is
+    # (stid, mnet, distance) and gtime is in epoch seconds.
+    for gi in gbins:
+        wobins[gi][5] += count
+        if gmax >= wobins[gi][4]:
+            wobins[gi][0:5] = [station[0],station[1],station[2],iso_times([gtime])[0],gmax]
+
+def get_event_window(mgtime,timetpl,timeoffset):
+    # Returns (tlo, thi) TimeUtils objects bounding the data needed for the largest time window.
+    # A time offset of -1 ends the window at mgtime, 1 starts it at mgtime, and 0 (or any other
+    # value, for backwards compatibility) centers it on mgtime.
+    twmax = timedelta(hours=timetpl[len(timetpl)-1])
+    if timeoffset == -1:
+        thi = TimeUtils(mgtime.datetime.datetime)
+        tlo = TimeUtils(mgtime.datetime.datetime - twmax)
+    elif timeoffset == 1:
+        thi = TimeUtils(mgtime.datetime.datetime + twmax)
+        tlo = TimeUtils(mgtime.datetime.datetime)
+    else:
+        thi = TimeUtils(mgtime.datetime.datetime + twmax/2)
+        tlo = TimeUtils(mgtime.datetime.datetime - twmax/2)
+    return (tlo,thi)
+
+def get_time_bins(mgtime,timetpl):
+    # Returns the epoch seconds of the time bin centers used by get_max_gust. The centers are the
+    # earliest of the times mgtime +/- half of each window, in time order, one per window.
+    t0 = mgtime.datetime.timestamp()
+    wtlst = [t0 + tm*tw*3600 for tw in [-0.5,0.5] for tm in timetpl]
+    wtlst.sort()
+    return np.array(wtlst[0:len(timetpl)])
+
+def epoch_seconds(date_times):
+    # Converts a list of Synoptic Zulu strings (YYYY-MM-DDTHH:MM:SSZ) into an int64 array of epoch
+    # seconds in one vectorized parse.
+    return np.array([dt.rstrip('Z') for dt in date_times],dtype='datetime64[s]').astype(np.int64)
 
-    wtlst.sort(key=datetime.datetime.isoformat)
+def iso_times(epochs):
+    # Converts epoch seconds into a list of Synoptic Zulu strings (YYYY-MM-DDTHH:MM:SSZ)
+    isoarr = np.datetime_as_string(np.asarray(epochs,dtype=np.int64).astype('datetime64[s]'),unit='s')
+    return np.char.add(isoarr,'Z').tolist()
 
-    if wmobs['SUMMARY']['NUMBER_OF_OBJECTS'] > 0 : 
+def observation_arrays(wmobs,variable='wind_gust_set_1'):
+    # Converts each station of a Synoptic timeseries response into NumPy arrays, once per fetch.
+    # Returns a list of (stid, mnet, distance, epoch seconds, values, date_time list), skipping stations
+    # that do not report the variable. Missing values (None) become NaN.
+    # variable may also be a list of variables, in which case values is a dict of arrays by variable,
+    # NaN for variables a station does not report, and only stations reporting none are skipped.
+    multi = isinstance(variable,(list,tuple))
+    starr = []
+    if wmobs['SUMMARY']['NUMBER_OF_OBJECTS'] > 0 :
         for wo in wmobs['STATION']:
-            stid = wo['STID']
-            stnet = wo['MNET_ID']
-            strad = wo['DISTANCE']
-            for wmevi in range(len(wo['OBSERVATIONS']['date_time'])):   # For each event in the time range
-                for gi in range(gwindows):                              # For each distance bin   
-                    for ti in range(twindows):                          # For each time bin
-                        tevt = TimeUtils(wo['OBSERVATIONS']['date_time'][wmevi])   # Get event TimeUtils object
-                        tdelta = abs(wtlst[ti] - tevt.datetime.datetime).seconds/3600 # Get evt-time bin diff (hrs)
-                        if tdelta <= timetpl[ti]:                       # Is time difference in time bin?
-                            if strad <= geotpl[gi]:                     # Is dist within dist bin?
-                                if 'wind_gust_set_1' in wo['OBSERVATIONS'] and \
-                                   wo['OBSERVATIONS']['wind_gust_set_1'][wmevi] != None:  # Check station monitors gusts
-                                    womax[ti][gi][5] += 1       # Count per time/radius bin
-                                    if wo['OBSERVATIONS']['wind_gust_set_1'][wmevi] >= womax[ti][gi][4]: # Largest
-                                        womax[ti][gi][0] = stid
-                                        womax[ti][gi][1] = stnet
-                                        womax[ti][gi][2] = strad
-                                        womax[ti][gi][3] = wo['OBSERVATIONS']['date_time'][wmevi]
-                                        womax[ti][gi][4] = wo['OBSERVATIONS']['wind_gust_set_1'][wmevi]
+            obs = wo['OBSERVATIONS']
+            nobs = len(obs.get('date_time',[]))
+            if nobs == 0:
+                continue
+            if multi:
+                if not any(var in obs for var in variable):
+                    continue
+                values = {var:np.array(obs[var],dtype=float) if var in obs else np.full(nobs,np.nan)
+                          for var in variable}
+            elif variable not in obs:
+                continue
+            else:
+                values = np.array(obs[variable],dtype=float)
+            starr.append((wo['STID'],wo['MNET_ID'],wo['DISTANCE'],epoch_seconds(obs['date_time']),
+                          values,obs['date_time']))
+    return starr
 
-    return womax
+def parse_reducer(spec):
+    # Checks a window extremes spec (variable, reducer) and returns (variable, reducer, percentile).
+    # Reducers are 'max', 'min', 'mean' and 'pNN' for the NNth percentile, e.g. 'p95' or 'p99.9'.
+    (variable,reducer) = spec
+    reducer = reducer.lower()
+    if reducer in ('max','min','mean'):
+        return (variable,reducer,None)
+    if re.fullmatch(r'p\d+(\.\d+)?',reducer) and float(reducer[1:]) <= 100:
+        return (variable,'percentile',float(reducer[1:]))
+    raise ValueError("Unknown reducer " + str(reducer) + " for " + str(variable))
+
+def window_extremes_kernel(starr, centers, timetpl, geotpl, specs, window=None):
+    # Window extremes for several variables in one pass over the station arrays from
+    # observation_arrays(..., variables). Time and radius bins are as in max_gust_kernel, and the
+    # time masks are computed once per station for all specs. specs is a list of (variable,
+    # reducer), see parse_reducer.
+    # Returns time bins X radius bins X specs X [stid, mnet, distance, datetime, value, count]. For
+    # max and min, the station, distance and time are those of the extreme, with ties to the later
+    # observation and the later station; for mean and percentiles, which pool the readings of all
+    # stations in the bin, they are None. value is None when there are no readings.
+    specs = [parse_reducer(spec) for spec in specs]
+    twindows = len(timetpl)
+    gwindows = len(geotpl)
+    extremes = [[[[None,None,None,None,None,0] for spec in specs] for i in range(gwindows)] for j in range(twindows)]
+    pooled = [[[[] for spec in specs] for i in range(gwindows)] for j in range(twindows)]
+    halfwidth = np.array(timetpl,dtype=float)*3600
+    for (stid,stnet,strad,epoch,values,date_times) in starr:
+        gbins = [gi for gi in range(gwindows) if strad <= geotpl[gi]]
+        if gbins == []:
+            continue
+        intime = np.abs(epoch[np.newaxis,:] - centers[:,np.newaxis]) <= halfwidth[:,np.newaxis]
+        if window != None:
+            intime &= (epoch >= window[0]) & (epoch <= window[1])
+        for (si,(variable,reducer,pct)) in enumerate(specs):
+            vals = values.get(variable) if isinstance(values,dict) else values
+            if vals is None:
+                continue
+            inbin = intime & ~np.isnan(vals)
+            counts = inbin.sum(axis=1)
+            if reducer in ('max','min'):
+                sign = 1.0 if reducer == 'max' else -1.0
+                masked = np.where(inbin,sign*vals,-np.inf)
+                last = masked.shape[1] - 1 - np.argmax(masked[:,::-1],axis=1)   # Last index of each extreme
+            for ti in range(twindows):
+                if counts[ti] == 0:
+                    continue
+                if reducer in ('max','min'):
+                    vext = float(vals[last[ti]])
+                    if date_times is None:
+                        dtext = iso_times([epoch[last[ti]]])[0]
+                    else:
+                        dtext = str(date_times[last[ti]])
+                for gi in gbins:
+                    cell = extremes[ti][gi][si]
+                    cell[5] += int(counts[ti])           # Count per time/radius bin
+                    if reducer in ('max','min'):
+                        if cell[4] == None or sign*vext >= sign*cell[4]:
+                            cell[0:5] = [stid,stnet,strad,dtext,vext]
+                    else:
+                        pooled[ti][gi][si].append(vals[inbin[ti]])
+    for (si,(variable,reducer,pct)) in enumerate(specs):
+        if reducer in ('mean','percentile'):
+            for ti in range(twindows):
+                for gi in range(gwindows):
+                    if extremes[ti][gi][si][5] > 0:
+                        readings = np.concatenate(pooled[ti][gi][si])
+                        value = np.mean(readings) if reducer == 'mean' else np.percentile(readings,pct)
+                        extremes[ti][gi][si][4] = float(value)
+    return extremes
+
+def max_gust_kernel(starr, centers, timetpl, geotpl, window=None):
+    # Vectorized gust scan over the station arrays from observation_arrays. For each station the
+    # masks for all time bins are computed at once: an observation is in time bin ti if it is within
+    # timetpl[ti] hours of centers[ti], and a station is in distance bin gi if it is within geotpl[gi]
+    # miles. Returns time bins X radius bins X [stid, mnet, distance, datetime, max gust, count].
+    # As in a sequential scan with >=, ties go to the later observation and the later station.
+    # An optional window (lo, hi) of epoch seconds restricts the scan to observations that a fetch
+    # for that window alone would have returned. Stations read from the database have no date_time
+    # list (None); their datetime is formatted from the epoch of the maximum only.
+    # This is window_extremes_kernel for the single spec ('wind_gust_set_1', 'max').
+    extremes = window_extremes_kernel(starr,centers,timetpl,geotpl,[('wind_gust_set_1','max')],window)
+    return [[gust_cell(cells[0]) for cells in row] for row in extremes]
+
+def gust_cell(cell):
+    # get_max_gust reports a maximum of 0 for bins with no readings
+    return cell[0:4] + [0 if cell[4] == None else cell[4],cell[5]]
     
+def get_max_gust_batch(events, timetpl, timeoffset, geotpl, db_object, group_miles=10.0, group_hours=24.0):
+    # Batch version of get_max_gust for many events. events is a sequence of (latitude, longitude,
+    # time) rows, where time is a TimeUtils object or anything TimeUtils accepts. Returns a list of
+    # get_max_gust results in the same order as events.
+    # Events are grouped when they are within group_miles of the first event of a group and their
+    # data windows all fall within group_hours plus the largest time window. Each group makes one
+    # radius query covering the union of its events, converts the data to arrays once, and then
+    # computes each event's result with distances measured from that event. Results match
+    # separate get_max_gust calls, since each event only sees data from its own time window.
+    gwindows = len(geotpl)
+    gmax = geotpl[gwindows-1]
+    span = (group_hours + timetpl[len(timetpl)-1])*3600
+
+    evts = []
+    for (lat,lon,evtime) in events:
+        mgtime = evtime if isinstance(evtime,TimeUtils) else TimeUtils(evtime)
+        (tlo,thi) = get_event_window(mgtime,timetpl,timeoffset)
+        evts.append((float(lat),float(lon),mgtime,tlo,thi))
+
+    # Greedy grouping in time order. Groups stop accepting events once they would span too long.
+    order = sorted(range(len(evts)),key=lambda ie: evts[ie][3].datetime.timestamp())
+    groups = []
+    opengrps = []
+    for ie in order:
+        (lat,lon,mgtime,tlo,thi) = evts[ie]
+        tstart = tlo.datetime.timestamp()
+        tend = thi.datetime.timestamp()
+        opengrps = [grp for grp in opengrps if tend - grp['start'] <= span]
+        for grp in opengrps:
+            if haversine(grp['latitude'],grp['longitude'],lat,lon) <= group_miles:
+                grp['events'].append(ie)
+                grp['end'] = max(grp['end'],tend)
+                break
+        else:
+            grp = {'latitude':lat,'longitude':lon,'start':tstart,'end':tend,'events':[ie]}
+            groups.append(grp)
+            opengrps.append(grp)
+
+    results = [None]*len(evts)
+    for grp in groups:
+        radius = gmax + max(haversine(grp['latitude'],grp['longitude'],evts[ie][0],evts[ie][1])
+                            for ie in grp['events'])
+        tlo = min((evts[ie][3] for ie in grp['events']),key=lambda tu: tu.datetime.timestamp())
+        thi = max((evts[ie][4] for ie in grp['events']),key=lambda tu: tu.datetime.timestamp())
+        logging.debug("Batch of " + str(len(grp['events'])) + " events, radius " + str(round(radius,2)))
+        (starr,stpos) = get_radius_observation_arrays(grp['latitude'],grp['longitude'],math.ceil(radius*100)/100,
+                                                      tlo,thi,db_object)
+        for ie in grp['events']:
+            (lat,lon,mgtime,etlo,ethi) = evts[ie]
+            evstarr = []
+            for (stid,stnet,strad,epoch,gust,date_times) in starr:
+                dist = haversine(lat,lon,*stpos[stid])
+                if dist <= gmax:
+                    evstarr.append((dist,(stid,stnet,round(dist,2),epoch,gust,date_times)))
+            evstarr = [st for (dist,st) in sorted(evstarr,key=lambda ds: ds[0])]   # Nearest first
+            window = (EpochTime.parse(etlo.synop()).epoch,EpochTime.parse(ethi.synop()).epoch)
+            results[ie] = max_gust_kernel(evstarr,get_time_bins(mgtime,timetpl),timetpl,geotpl,window)
+    return results
+
+# The fixed formats of Synoptic data (YYYY-MM-DDTHH:MM:SSZ) and API (YYYYMMDDHHMM) time strings
+ISO_TIME_PATTERN = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}):([0-9]{2}):([0-9]{2})Z\Z')
+SYNOP_TIME_PATTERN = re.compile(r'([0-9]{4})([0-9]{2})([0-9]{2})([0-9]{2})([0-9]{2})\Z')
+
+@functools.lru_cache(maxsize=time_cache_size)
+def parse_time_string(timestr):
+    # Zulu object for a time string. The two fixed Synoptic formats are read directly; any other
+    # string goes to zulu.parse, and failing that is sliced as YYYYMMDDHHMM. Raises ValueError for
+    # strings that are not times. The last time_cache_size strings parsed are cached; Zulu objects
+    # are immutable, so they can be shared.
+    match = ISO_TIME_PATTERN.match(timestr) or SYNOP_TIME_PATTERN.match(timestr)
+    if match != None:
+        return zulu.Zulu(*map(int,match.groups()))
+    try:
+        return zulu.parse(timestr)
+    except zulu.parser.ParseError:  # Now try synopt string
+        dt = datetime.datetime(int(timestr[0:4]),int(timestr[4:6]),int(timestr[6:8]),
+                               int(timestr[8:10]),int(timestr[10:12]))
+        return zulu.Zulu.fromdatetime(dt)
+
+@functools.lru_cache(maxsize=time_cache_size)
+def parse_epoch(timestr):
+    # Epoch seconds of a time string, as parse_time_string, cached in the same way
+    return int(parse_time_string(timestr).timestamp())
+
+class EpochTime(object):
+
+    # Class EpochTime is a light UTC time for internal use: whole epoch seconds, with no Zulu object
+    # behind it. Used where a time is only compared, stored or formatted, e.g. the whole minute
+    # query bounds EpochTime.parse(tu.synop()).
+
+    __slots__ = ('epoch',)
+
+    def __init__(self,epoch):
+        self.epoch = int(epoch)
+
+    def parse(timestr):
+        # EpochTime for any string TimeUtils accepts, through the parse_epoch cache
+        return EpochTime(parse_epoch(timestr))
+    parse = staticmethod(parse)
+
+    def utc(self):
+        return datetime.datetime.fromtimestamp(self.epoch,datetime.timezone.utc)
+
+    def iso(self):
+        return self.utc().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def synop(self):
+        return self.utc().strftime('%Y%m%d%H%M')
+
+    def timeutils(self):
+        return TimeUtils(self.utc())
+
+    def __eq__(self,other):
+        return isinstance(other,EpochTime) and self.epoch == other.epoch
+
+    def __lt__(self,other):
+        return self.epoch < other.epoch
+
+    def __hash__(self):
+        return hash(self.epoch)
+
+    def __repr__(self):
+        return 'EpochTime(' + str(self.epoch) + ')'
+
 class TimeUtils(object):
 
     # The TimeUtils class handles coversion between synoptic API (YYYYMMDDHHSS, UTC), synoptic data
@@ -238,15 +699,10 @@ class TimeUtils(object):
         elif isinstance(timeobj,zulu.zulu.Zulu):
             self.datetime = timeobj
         elif isinstance(timeobj,str):
-            try:     #Zulu string
-                self.datetime = zulu.parse(timeobj)
-            except zulu.parser.ParseError:  # Now try synopt string
-                try:
-                    dt = datetime.datetime(int(timeobj[0:4]),int(timeobj[4:6]),int(timeobj[6:8]),
-                                           int(timeobj[8:10]),int(timeobj[10:12]))
-                    self.datetime = zulu.Zulu.fromdatetime(dt)
-                except AttributeError:
-                    logging.error("Invalid time string format for " + timeobj)
+            try:     #Zulu or synopt string, see parse_time_string
+                self.datetime = parse_time_string(timeobj)
+            except AttributeError:
+                logging.error("Invalid time string format for " + timeobj)
 
     def __sub__(self,tut):
         # Subtraction operation returns datetime.timedelta object
@@ -263,6 +719,10 @@ class TimeUtils(object):
             str(ztpl[3]).zfill(2) + str(ztpl[4]).zfill(2)
         return synopstr
 
+    def iso(self):
+        # Zulu string is YYYY-MM-DDTHH:MM:SSZ, as used for observation date_time in the database
+        return self.datetime.format('%Y-%m-%dT%H:%M:%SZ')
+
     def randtime(start,end):
         dt1 = TimeUtils(start)
         dt2 = TimeUtils(end)
@@ -284,30 +744,147 @@ class WeatherDB(object):
     # method WeatherDB.create(newdbfilename), which returns a WeatherDB object. Binding a
     # WeatherDB object to an existing database simply uses the constructor
     # WeatherDB(existingdbfilename).
+    # WeatherDB(existingdbfilename, read_only=True) opens a connection that can only read, for
+    # worker processes (see weather_parallel). It makes no schema changes, so the database must
+    # already have been opened once for writing.
 
-    def __init__(self,db_name):
+    def __init__(self,db_name,read_only=False):
         if not os.path.isfile(db_name):
             raise FileExistsError(db_name + " does not exist, use WeatherDB.create(db_name)")
-        logging.info("Opening " + db_name)
+        logging.info("Opening " + db_name + (" read only" if read_only else ""))
+        self.db_name = db_name
+        self.read_only = read_only
+        self._connect()
+
+        # Databases at schema version SCHEMA_EPOCH_TIMES store observations.date_time as integer epoch
+        # seconds instead of ISO text. Callers always see ISO text, converted here at the boundary.
+        self.cursor.execute('PRAGMA user_version;')
+        self.epoch_times = self.cursor.fetchone()[0] >= SCHEMA_EPOCH_TIMES
+
+        if read_only:
+            self.cursor.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='station_rtree'")
+            self.rtree = self.cursor.fetchone()[0] == 1
+            return
+
+        # The coverage ledger records each radius query footprint and time window that has been
+        # fetched from Synoptic. Older databases do not have it, so it is added on open.
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS coverage (latitude REAL NOT NULL,
+                               longitude REAL NOT NULL, radius REAL NOT NULL, start TEXT NOT NULL,
+                               stop TEXT NOT NULL);''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS coverage_footprint ON coverage (latitude, longitude, radius, start);')
+        # The station coverage ledger records the merged intervals fetched for each station
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS station_coverage (stid TEXT NOT NULL,
+                               start TEXT NOT NULL, stop TEXT NOT NULL);''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS station_coverage_stid ON station_coverage (stid, start);')
+
+        # Spatial index over station positions, kept in step with the station table by add_station.
+        # Falls back to a bounding box scan of the station table if sqlite lacks the R*Tree module.
+        try:
+            self.cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS station_rtree USING
+                                   rtree(sid, minlat, maxlat, minlon, maxlon);''')
+            self.rtree = True
+        except sqlite3.OperationalError:
+            logging.warning("sqlite R*Tree module unavailable, station searches will scan " + db_name)
+            self.rtree = False
+        self._sync_station_index()
+        self._create_indexes()
+
+        # Hourly rollup of the observations table, kept up to date by add_observations. Built on
+        # first open of an older database.
+        self.cursor.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='hourly'")
+        rollup_exists = self.cursor.fetchone()[0] == 1
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS hourly (stid TEXT NOT NULL, hour INTEGER NOT NULL, ' +
+                            ''.join(name + ' REAL, ' + name + '_count INTEGER NOT NULL DEFAULT 0, '
+                                    for (name,obcol,agg) in ROLLUP_COLUMNS) +
+                            'max_gust_time INTEGER, PRIMARY KEY (stid, hour));')
+        self.connection.commit()
+        self.cursor.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='observations'")
+        if not rollup_exists and self.cursor.fetchone()[0] == 1:
+            self.rebuild_rollup()
+
+    def _connect(self):
+        # Opens the connection and cursor.
+        # Connection profile for large caches: write-ahead logging so readers do not block the writer,
+        # fewer fsyncs (safe with WAL), a larger page cache and memory mapped reads. Cache and mmap
+        # sizes can be set with DB_CACHE_MB and DB_MMAP_MB in the [Default] section.
         try:
-            connection = sqlite3.connect(db_name)
+            if self.read_only:
+                connection = sqlite3.connect(pathlib.Path(os.path.abspath(self.db_name)).as_uri() + '?mode=ro',uri=True)
+            else:
+                connection = sqlite3.connect(self.db_name)
         except Error as e:
             logging.error(e)
         self.connection = connection
         self.cursor = connection.cursor()
-        self.db_name = db_name
+        defaults = weather_config.config['Default']
+        if not self.read_only:
+            self.cursor.execute('PRAGMA journal_mode=WAL;')
+            self.cursor.execute('PRAGMA synchronous=NORMAL;')
+        self.cursor.execute('PRAGMA cache_size=' + str(-1024*int(defaults.get('DB_CACHE_MB','64'))) + ';')
+        self.cursor.execute('PRAGMA mmap_size=' + str(1024**2*int(defaults.get('DB_MMAP_MB','256'))) + ';')
+        self.cursor.execute('PRAGMA temp_store=MEMORY;')
+
+    def release(self):
+        # Commits and closes the connection, keeping the object, e.g. so that no sqlite connection is
+        # open across a fork (see weather_parallel). reconnect opens it again.
+        self.connection.commit()
+        self.connection.close()
+        self.connection = None
+        self.cursor = None
+
+    def reconnect(self):
+        self._connect()
+
+    def _create_indexes(self):
+        # Indexes on the observations table beyond its (stid, date_time) primary key: date_time first,
+        # for time range scans across stations, and a covering index for the wind gust maximum
+        # queries, so they are answered without reading table rows. Building these on an existing
+        # large database takes a while, once.
+        self.cursor.execute("PRAGMA table_info(observations);")
+        columns = [col[1] for col in self.cursor.fetchall()]
+        if columns == []:                        # Not yet created by WeatherDB.create
+            return
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='observations';")
+        indexes = [idx[0] for idx in self.cursor.fetchall()]
+        if 'observations_date_time' not in indexes:
+            logging.info("Creating index observations_date_time in " + self.db_name)
+            self.cursor.execute('CREATE INDEX observations_date_time ON observations (date_time, stid);')
+        if 'observations_gust' not in indexes and 'wind_gust_set_1' in columns:
+            logging.info("Creating index observations_gust in " + self.db_name)
+            self.cursor.execute('CREATE INDEX observations_gust ON observations (stid, date_time, wind_gust_set_1);')
+
+    def optimize(self):
+        # Routine maintenance: let sqlite refresh statistics where they are stale, and fold the
+        # write-ahead log back into the database file.
+        self.cursor.execute('PRAGMA optimize;')
+        self.cursor.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        self.connection.commit()
+
+    def analyze(self):
+        # Gather full query planner statistics. Worth doing after a large load.
+        self.cursor.execute('ANALYZE;')
+        self.connection.commit()
         
-    def create(db_name):
+    def create(db_name,radius_data=None,epoch_times=None):
+        # Creates a new database. With epoch_times, observation times are stored as integer epoch
+        # seconds (schema version SCHEMA_EPOCH_TIMES). The default is DB_EPOCH_TIMES in the [Default]
+        # section, or ISO text if that is not set.
+        if epoch_times == None:
+            epoch_times = weather_config.config['Default'].getboolean('DB_EPOCH_TIMES',False)
         if os.path.isfile(db_name):
             raise ValueError(db_name + " already exists. Use WeatherDB(db_name).")
         logging.info("Creating " + db_name)
         db_file = open(db_name,'w')
         db_file.close()
         mydb = WeatherDB(db_name)
+        if epoch_times:
+            mydb.cursor.execute('PRAGMA user_version=' + str(SCHEMA_EPOCH_TIMES) + ';')
+            mydb.epoch_times = True
         
         # Get example dataset - Currently this is dynamically pulled from Synoptic, probably
-        # should be static data
-        radius_data = get_example_radius_dataset()
+        # should be static data. A dataset in the same format may be passed in instead.
+        if radius_data == None:
+            radius_data = get_example_radius_dataset()
 
         # Create table for UNITS
         mydb.cursor.execute('''SELECT count(name) FROM sqlite_master WHERE type='table' AND name='units' ''')
@@ -367,7 +944,7 @@ class WeatherDB(object):
         mydb.cursor.execute('''SELECT count(name) FROM sqlite_master WHERE type='table' AND name='observations' ''')
         if mydb.cursor.fetchone()[0] ==1:        #Error if table exists
             raise RuntimeError("SQL table observations already exists")
-        sql = 'CREATE TABLE observations (date_time TEXT,' 
+        sql = 'CREATE TABLE observations (date_time ' + ('INTEGER' if epoch_times else 'TEXT') + ','
         iv = 0
         vlen = len(radius_data['STATION'][0]['OBSERVATIONS'].keys())
         for v in radius_data['STATION'][0]['OBSERVATIONS'].keys():
@@ -385,13 +962,13 @@ class WeatherDB(object):
         except Error as e:
             logging.error(e)
 
+        mydb._create_indexes()
         mydb.connection.commit()
         return mydb
 
     create = staticmethod(create)
 
     def add_station(self,data):
-        starr = []
         #Determine nesting of data structure containing station data and pack into array
         if data == None:
             raise ValueError('No station data has been provided')
@@ -402,44 +979,62 @@ class WeatherDB(object):
                 sttest = data['SID']
                 starr = [data]         #Single station data
             except KeyError:
-                logging.error("Unrecognized station data structure")           
+                logging.error("Unrecognized station data structure")
+                starr = []
+        self._insert_stations(starr)
+        self.connection.commit()
+
+    def _insert_stations(self,starr):
+        # Insert the stations in starr that are not yet in the database, one statement for each
+        # distinct set of station keys (normally one for a whole payload). Does not commit.
+        batches = {}
         for st in starr:
-            sql = 'INSERT OR IGNORE INTO station('
-            dbtuple = ()
-            qm = ''
+            cols = []
+            dbtuple = []
             for sd in st.keys():
                 if sd not in ['OBSERVATIONS','QC','PERIOD_OF_RECORD','UNITS','SENSOR_VARIABLES']:
-                    var = sd.lower()
-                    val = (st[sd],)
-                    sql = sql + var + ','
-                    dbtuple = dbtuple + val
-                    qm = qm + '?,'
+                    cols.append(sd.lower())
+                    dbtuple.append(st[sd])
                 elif sd == 'PERIOD_OF_RECORD':
-                    por_start =  st[sd]['start']
-                    por_end = st[sd]['end']
-                    sql = sql + 'period_of_record_start, period_of_record_stop,'
-                    dbtuple = dbtuple + (por_start,por_end)
-                    qm = qm + '?,?,'
+                    cols.extend(['period_of_record_start','period_of_record_stop'])
+                    dbtuple.extend([st[sd]['start'],st[sd]['end']])
                 elif sd == 'UNITS':
-                    units_position = st[sd]['position']
-                    units_elevation = st[sd]['elevation']
-                    sql = sql + 'units_position, units_elevation,'
-                    dbtuple = dbtuple + (units_position,units_elevation)
-                    qm = qm + '?,?,'
+                    cols.extend(['units_position','units_elevation'])
+                    dbtuple.extend([st[sd]['position'],st[sd]['elevation']])
                 elif sd == 'SENSOR_VARIABLES':
-                    var = sd.lower()                
-                    sql = sql + var + ','
-                    qm = qm + '?,'
-                    pdat = pickle.dumps(st[sd],pickle.HIGHEST_PROTOCOL)
-                    val = (pdat,)
-                    dbtuple = dbtuple + val
-
-            sql = sql.rstrip(',')
-            qm = qm.strip(',')
-            sql = sql + ') VALUES('+ qm + ')'
-
-            self.cursor.execute(sql,dbtuple)
-        self.connection.commit()
+                    cols.append(sd.lower())
+                    dbtuple.append(pickle.dumps(st[sd],pickle.HIGHEST_PROTOCOL))
+            batches.setdefault(tuple(cols),[]).append(tuple(dbtuple))
+        for (cols,rows) in batches.items():
+            sql = 'INSERT OR IGNORE INTO station(' + ','.join(cols) + ') VALUES(' + ','.join(['?']*len(cols)) + ')'
+            self.cursor.executemany(sql,rows)
+        self._sync_station_index([st['STID'] for st in starr if 'STID' in st])
+
+    def _sync_station_index(self,stids=None):
+        # Add stations missing from the spatial index. Stations are never updated in place
+        # (INSERT OR IGNORE), so stations already indexed do not need to be revisited. With stids,
+        # only those stations are looked at (by the stid and sid keys), so ingest does not scan the
+        # station table; the full scan (stids None) is the one-time backfill when the db is opened.
+        if not self.rtree:
+            return
+        self.cursor.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='station'")
+        if self.cursor.fetchone()[0] == 0:       # Not yet created by WeatherDB.create
+            return
+        insert = 'INSERT INTO station_rtree(sid, minlat, maxlat, minlon, maxlon) '
+        select = '''SELECT sid, CAST(latitude AS REAL), CAST(latitude AS REAL), CAST(longitude AS REAL),
+                    CAST(longitude AS REAL) FROM station WHERE latitude IS NOT NULL AND longitude IS NOT NULL'''
+        if stids is None:
+            self.cursor.execute(insert + select + ' AND sid NOT IN (SELECT sid FROM station_rtree);')
+            return
+        # The R*Tree cannot be read by the statement inserting into it, so select first
+        select = select + ' AND NOT EXISTS (SELECT 1 FROM station_rtree WHERE station_rtree.sid = station.sid)'
+        stids = list(dict.fromkeys(stids))
+        rows = []
+        for i in range(0,len(stids),500):                   # Stay under SQLITE_MAX_VARIABLE_NUMBER
+            chunk = stids[i:i+500]
+            self.cursor.execute(select + ' AND stid IN (' + ','.join(['?']*len(chunk)) + ')',chunk)
+            rows.extend(self.cursor.fetchall())
+        self.cursor.executemany(insert + 'VALUES(?,?,?,?,?)',rows)
 
     def get_station(self, stid):
         sql = 'SELECT * FROM station WHERE stid = \'' + stid + '\';'
@@ -471,7 +1066,7 @@ class WeatherDB(object):
             starr = data['STATION']    #Station array
         except KeyError:
             try:
-                sttest = data['SID']
+                sttest = data['STID']
                 starr = [data]         #Single station data
             except KeyError:
                 if data['SUMMARY']['NUMBER_OF_OBJECTS'] == 0 :
@@ -480,38 +1075,39 @@ class WeatherDB(object):
                 else:
                     logging.error("Unrecognized station data structure")
                     raise
-        for station in data['STATION']:
-            sql = 'INSERT OR IGNORE INTO observations ('
-            stid = station['STID']
-            stdat = self.get_station(stid)
-            obar = []
-            qm = ''
-            if stdat == {}:
-                self.add_station(data)
-            for i in range(len(station['OBSERVATIONS']['date_time'])):
-                obtuple = ()
-                for okey in station['OBSERVATIONS'].keys():
-                    var = okey.lower()
-                    if var in db_schema:
-                        val = (station['OBSERVATIONS'][okey][i],)
-                        if i == 0:
-                            sql = sql + var + ','
-                            qm = qm + '?,'
-                        obtuple = obtuple + val
-                obtuple = obtuple + (stid,)
-                obar.append(obtuple)
-            qm.strip(',')
-            sql = sql + 'stid) VALUES('+ qm + '?);'
-            logging.debug(sql)
-            self.connection.executemany(sql,obar)
-        self.connection.commit()
+        # Bulk ingest: stations and observations for the whole payload go in one transaction, and
+        # each station's dict of lists is transposed into rows with zip rather than built cell by cell.
+        with self.connection:
+            self._insert_stations(starr)
+            statements = {}
+            for station in starr:
+                obs = station['OBSERVATIONS']
+                keys = [okey for okey in obs.keys() if okey.lower() in db_schema]
+                if keys == []:
+                    continue
+                cols = tuple(okey.lower() for okey in keys)
+                if cols not in statements:
+                    statements[cols] = 'INSERT OR IGNORE INTO observations (' + ','.join(cols) + \
+                        ',stid) VALUES(' + ','.join(['?']*len(cols)) + ',?);'
+                    logging.debug(statements[cols])
+                values = [obs[okey] for okey in keys]
+                idt = cols.index('date_time')
+                epoch = epoch_seconds(values[idt])
+                if self.epoch_times:
+                    values[idt] = epoch.tolist()
+                rows = zip(*values,itertools.repeat(station['STID']))
+                self.connection.executemany(statements[cols],rows)
+                if len(epoch) > 0:
+                    self.update_rollup(station['STID'],epoch.min(),epoch.max())
 
     def get_observations(self,stid,dtlow,dthigh):
-        sql = f'''SELECT * FROM observations WHERE stid = \'{stid}\' AND \
-        date_time BETWEEN \'{dtlow}\' AND \'{dthigh}\' \
-        ;'''
-        self.cursor.execute(sql)
+        sql = 'SELECT * FROM observations WHERE stid = ? AND date_time BETWEEN ? AND ?;'
+        self.cursor.execute(sql,(stid,self._db_time(dtlow),self._db_time(dthigh)))
         obstuplist = self.cursor.fetchall()
+        if self.epoch_times and len(obstuplist) != 0:
+            idt = [obk[0] for obk in self.cursor.description].index('date_time')
+            dtiso = iso_times([obtup[idt] for obtup in obstuplist])
+            obstuplist = [obtup[:idt] + (dt,) + obtup[idt+1:] for (obtup,dt) in zip(obstuplist,dtiso)]
         oblist = []
         if len(obstuplist) != 0:        # Found some observations in database  
             # sqlite returns data in a tuple format. This needs to be converted into the
@@ -528,15 +1124,330 @@ class WeatherDB(object):
                     attr += 1
                 oblist.append(obdict)
         return oblist
-        
+
+    def get_observations_columns(self,stids,dtlow,dthigh,variables=('wind_gust_set_1',)):
+        # Columnar version of get_observations for one or more stations, without a dict per row.
+        # Returns a dict with 'stids' (the station list), 'station' (int32 index into stids for each
+        # observation), 'epoch' (int64 epoch seconds) and one array per variable, all in station then
+        # time order. REAL columns are float arrays with NaN for missing values, other columns are
+        # object arrays. Raises ValueError for a variable that is not an observations column.
+        if isinstance(stids,str):
+            stids = [stids]
+        stids = list(dict.fromkeys(stids))
+        self.cursor.execute('PRAGMA table_info(observations);')
+        coltypes = {col[1]:col[2].upper() for col in self.cursor.fetchall()}
+        variables = [var.lower() for var in variables]
+        for var in variables:
+            if var not in coltypes or var in ('stid','date_time'):
+                raise ValueError('Unknown observation variable ' + var)
+        columns = {'stids':stids}
+        rows = []
+        if stids != []:
+            sql = 'SELECT stid, date_time' + ''.join(', ' + var for var in variables) + \
+                ' FROM observations WHERE stid IN (' + ','.join('?'*len(stids)) + ') AND date_time BETWEEN ? AND ?;'
+            self.cursor.execute(sql,tuple(stids) + (self._db_time(dtlow),self._db_time(dthigh)))
+            rows = self.cursor.fetchall()
+        cols = list(zip(*rows)) if rows != [] else [()]*(len(variables)+2)
+        stindex = {stid:ist for (ist,stid) in enumerate(stids)}
+        station = np.fromiter((stindex[stid] for stid in cols[0]),dtype=np.int32,count=len(rows))
+        if self.epoch_times:
+            epoch = np.array(cols[1],dtype=np.int64)         # No parsing needed
+        else:
+            epoch = epoch_seconds(cols[1])
+        order = np.lexsort((epoch,station))
+        columns['station'] = station[order]
+        columns['epoch'] = epoch[order]
+        for (ivar,var) in enumerate(variables):
+            dtype = float if coltypes[var] == 'REAL' else object
+            columns[var] = np.array(cols[ivar+2],dtype=dtype)[order]
+        return columns
+
+    def get_observation_arrays(self,latitude,longitude,radius,dtlow,dthigh,variable='wind_gust_set_1'):
+        # Database version of observation_arrays(get_observations_by_radius(...)), built from
+        # get_observations_columns: stations within radius miles, nearest first, with DISTANCE
+        # rounded as in get_observations_by_radius. Returns (station arrays, {stid: (latitude, longitude)}).
+        # variable may be a list, as for observation_arrays. Variables that are not columns of the
+        # observations table are all NaN.
+        multi = isinstance(variable,(list,tuple))
+        variables = list(variable) if multi else [variable]
+        stdist = self.stations_within(latitude,longitude,radius)
+        stids = [st for (st,dist) in stdist]
+        self.cursor.execute('PRAGMA table_info(observations);')
+        obcols = [col[1] for col in self.cursor.fetchall()]
+        columns = self.get_observations_columns(stids,dtlow,dthigh,[var for var in variables if var.lower() in obcols])
+        stinfo = self.station_info(stids)
+        bounds = np.searchsorted(columns['station'],np.arange(len(stids)+1))
+        starr = []
+        for (ist,(stid,dist)) in enumerate(stdist):
+            (lo,hi) = (bounds[ist],bounds[ist+1])
+            values = {var:columns[var.lower()][lo:hi] if var.lower() in columns else np.full(hi-lo,np.nan)
+                      for var in variables}
+            if hi == lo or all(np.isnan(vals).all() for vals in values.values()):
+                continue
+            starr.append((stid,stinfo[stid][0],round(dist,2),columns['epoch'][lo:hi],
+                          values if multi else values[variable],None))
+        return (starr,{stid:info[1:] for (stid,info) in stinfo.items()})
+
+    def station_info(self,stids):
+        # Returns {stid: (mnet_id, latitude, longitude)} for the stations in stids
+        if stids == []:
+            return {}
+        self.cursor.execute('SELECT stid, mnet_id, latitude, longitude FROM station WHERE stid IN (' +
+                            ','.join('?'*len(stids)) + ');',tuple(stids))
+        return {stid:(mnet,lat,lon) for (stid,mnet,lat,lon) in self.cursor.fetchall()}
+
+    def get_rollup_columns(self,stids,hlo,hhi):
+        # Hourly rollup rows for the stations in stids with hour start times from hlo to hhi epoch
+        # seconds, in the columnar form of get_observations_columns: 'stids', 'station', 'hour', and
+        # per ROLLUP_COLUMNS a value array (NaN where there were no readings) and a count array,
+        # plus 'max_gust_time', the epoch seconds of the last reading equal to max_gust.
+        names = ['hour','max_gust_time'] + [name for rc in ROLLUP_COLUMNS for name in (rc[0],rc[0] + '_count')]
+        columns = {'stids':list(stids)}
+        rows = []
+        if stids != []:
+            sql = 'SELECT stid, ' + ', '.join(names) + ' FROM hourly WHERE stid IN (' + ','.join('?'*len(stids)) + \
+                ') AND hour BETWEEN ? AND ?;'
+            self.cursor.execute(sql,tuple(stids) + (int(hlo),int(hhi)))
+            rows = self.cursor.fetchall()
+        cols = list(zip(*rows)) if rows != [] else [()]*(len(names)+1)
+        stindex = {stid:ist for (ist,stid) in enumerate(stids)}
+        station = np.fromiter((stindex[stid] for stid in cols[0]),dtype=np.int32,count=len(rows))
+        hour = np.array(cols[1],dtype=np.int64)
+        order = np.lexsort((hour,station))
+        columns['station'] = station[order]
+        for (iname,name) in enumerate(names):
+            if name.endswith('_count') or name == 'hour':
+                columns[name] = np.array(cols[iname+1],dtype=np.int64)[order]
+            else:
+                columns[name] = np.array(cols[iname+1],dtype=float)[order]
+        return columns
+
+    def update_rollup(self,stid,tlow,thigh):
+        # Recomputes the hourly rollup rows of station stid for every hour from the one holding tlow
+        # to the one holding thigh, epoch seconds, from the observations table. Does not commit.
+        hlo = int(tlow)//3600*3600
+        hhi = int(thigh)//3600*3600
+        self.cursor.execute('PRAGMA table_info(observations);')
+        obcols = [col[1] for col in self.cursor.fetchall()]
+        if self.epoch_times:
+            epoch = 'date_time'
+            dbtime = lambda expr: expr
+        else:
+            epoch = "CAST(strftime('%s',date_time) AS INTEGER)"
+            dbtime = lambda expr: "strftime('%Y-%m-%dT%H:%M:%SZ'," + expr + ",'unixepoch')"
+        aggs = []
+        for (name,obcol,agg) in ROLLUP_COLUMNS:
+            if obcol in obcols:
+                aggs.append(agg + '(' + obcol + '), count(' + obcol + ')')
+            else:
+                aggs.append('NULL, 0')
+        names = [name for rc in ROLLUP_COLUMNS for name in (rc[0],rc[0] + '_count')]
+        self.cursor.execute('DELETE FROM hourly WHERE stid = ? AND hour BETWEEN ? AND ?;',(stid,hlo,hhi))
+        sql = 'INSERT INTO hourly (stid, hour, ' + ', '.join(names) + ') SELECT stid, ' + epoch + '/3600*3600, ' + \
+            ', '.join(aggs) + ' FROM observations WHERE stid = ? AND date_time BETWEEN ' + dbtime('?') + \
+            ' AND ' + dbtime('?') + ' GROUP BY 2;'
+        self.cursor.execute(sql,(stid,hlo,hhi + 3599))
+        if 'wind_gust_set_1' in obcols:
+            sql = 'UPDATE hourly SET max_gust_time = (SELECT max(' + epoch + ') FROM observations WHERE \
+            observations.stid = hourly.stid AND date_time BETWEEN ' + dbtime('hourly.hour') + ' AND ' + \
+            dbtime('hourly.hour + 3599') + ' AND wind_gust_set_1 = hourly.max_gust) \
+            WHERE stid = ? AND hour BETWEEN ? AND ? AND max_gust IS NOT NULL;'
+            self.cursor.execute(sql,(stid,hlo,hhi))
+
+    def rebuild_rollup(self):
+        # Recomputes the whole hourly rollup table from the observations table
+        logging.info("Building hourly rollup for " + self.db_name)
+        with self.connection:
+            self.cursor.execute('SELECT stid, min(date_time), max(date_time) FROM observations GROUP BY stid;')
+            for (stid,dtlow,dthigh) in self.cursor.fetchall():
+                if not self.epoch_times:
+                    (dtlow,dthigh) = epoch_seconds([dtlow,dthigh]).tolist()
+                self.update_rollup(stid,dtlow,dthigh)
+
+    def _db_time(self,dt):
+        # ISO text time as stored in observations.date_time
+        if self.epoch_times:
+            return int(epoch_seconds([dt])[0])
+        return dt
+
+    def migrate_epoch_times(self):
+        # Converts observations.date_time from ISO text to integer epoch seconds, rebuilding the
+        # table and its indexes in one transaction, and sets the schema version. Does nothing if the
+        # database already stores epoch seconds. Run vacuum afterwards to reclaim the space.
+        if self.epoch_times:
+            logging.info(self.db_name + " already stores epoch times")
+            return
+        self.cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='observations';")
+        (sql,) = self.cursor.fetchone()
+        sql = re.sub(r'date_time\s+TEXT','date_time INTEGER',sql,count=1,flags=re.IGNORECASE)
+        sql = sql.replace('observations','observations_epoch',1)
+        self.cursor.execute('PRAGMA table_info(observations);')
+        columns = [col[1] for col in self.cursor.fetchall()]
+        select = ', '.join("CAST(strftime('%s',date_time) AS INTEGER)" if col == 'date_time' else col
+                           for col in columns)
+        logging.info("Migrating " + self.db_name + " to epoch times")
+        with self.connection:
+            self.cursor.execute(sql)
+            self.cursor.execute('INSERT INTO observations_epoch (' + ', '.join(columns) + ') SELECT ' + select +
+                                ' FROM observations;')
+            self.cursor.execute('DROP TABLE observations;')
+            self.cursor.execute('ALTER TABLE observations_epoch RENAME TO observations;')
+            self.cursor.execute('PRAGMA user_version=' + str(SCHEMA_EPOCH_TIMES) + ';')
+            self.epoch_times = True
+            self._create_indexes()
+
+    def vacuum(self):
+        self.connection.commit()
+        self.cursor.execute('VACUUM;')
+
+    def add_coverage(self,latitude,longitude,radius,dtlow,dthigh):
+        # Record in the coverage ledger that all observations within radius miles of
+        # (latitude, longitude) between the Zulu strings dtlow and dthigh have been fetched.
+        # Overlapping or touching intervals of the same footprint are merged, so repeated fetches
+        # around one location (e.g. Monte Carlo samples) do not grow the ledger.
+        footprint = (float(latitude),float(longitude),float(radius))
+        sql = 'SELECT rowid, start, stop FROM coverage WHERE latitude = ? AND longitude = ? AND radius = ? AND \
+        stop >= ? AND start <= ?;'
+        self.cursor.execute(sql,footprint + (dtlow,dthigh))
+        overlaps = self.cursor.fetchall()
+        for (rowid,start,stop) in overlaps:
+            dtlow = min(dtlow,start)
+            dthigh = max(dthigh,stop)
+        self.cursor.executemany('DELETE FROM coverage WHERE rowid = ?;',[(ov[0],) for ov in overlaps])
+        sql = 'INSERT INTO coverage(latitude,longitude,radius,start,stop) VALUES(?,?,?,?,?)'
+        self.cursor.execute(sql,footprint + (dtlow,dthigh))
+        self.connection.commit()
+
+    def check_coverage(self,latitude,longitude,radius,dtlow,dthigh):
+        # True if the ledger shows the footprint and time window have been fetched. A ledger entry
+        # counts only if its circle contains the whole query circle. The time window may be covered
+        # by the union of several entries, e.g. successive fetches for overlapping windows.
+        latitude = float(latitude)
+        longitude = float(longitude)
+        radius = float(radius)
+        sql = 'SELECT latitude, longitude, radius, start, stop FROM coverage WHERE radius >= ? AND \
+        stop >= ? AND start <= ?;'
+        self.cursor.execute(sql,(radius,dtlow,dthigh))
+        intervals = []
+        for (lat,lon,rad,start,stop) in self.cursor.fetchall():
+            if haversine(latitude,longitude,lat,lon) + radius <= rad + 1.0e-9:
+                intervals.append((start,stop))
+        intervals.sort()
+        covered = dtlow
+        for (start,stop) in intervals:
+            if start > covered:
+                break
+            if stop > covered:
+                covered = stop
+            if covered >= dthigh:
+                return True
+        return covered >= dthigh
+
+    def add_station_coverage(self,stid,dtlow,dthigh):
+        # Record in the station coverage ledger that all observations for stid between the Zulu
+        # strings dtlow and dthigh have been fetched. Overlapping or touching intervals are merged,
+        # so each station keeps a short list of disjoint intervals.
+        sql = 'SELECT rowid, start, stop FROM station_coverage WHERE stid = ? AND stop >= ? AND start <= ?;'
+        self.cursor.execute(sql,(stid,dtlow,dthigh))
+        overlaps = self.cursor.fetchall()
+        for (rowid,start,stop) in overlaps:
+            dtlow = min(dtlow,start)
+            dthigh = max(dthigh,stop)
+        self.cursor.executemany('DELETE FROM station_coverage WHERE rowid = ?;',[(ov[0],) for ov in overlaps])
+        sql = 'INSERT INTO station_coverage(stid,start,stop) VALUES(?,?,?)'
+        self.cursor.execute(sql,(stid,dtlow,dthigh))
+        self.connection.commit()
+
+    def get_station_gaps(self,stid,dtlow,dthigh):
+        # Returns the list of (start, stop) Zulu string intervals between dtlow and dthigh that the
+        # station coverage ledger does not cover, in time order.
+        sql = 'SELECT start, stop FROM station_coverage WHERE stid = ? AND stop >= ? AND start <= ? \
+        ORDER BY start;'
+        self.cursor.execute(sql,(stid,dtlow,dthigh))
+        gaps = []
+        covered = dtlow
+        for (start,stop) in self.cursor.fetchall():
+            if start > covered:
+                gaps.append((covered,start))
+            covered = max(covered,stop)
+        if covered < dthigh:
+            gaps.append((covered,dthigh))
+        return gaps
+
+    def get_observations_by_radius(self,latitude,longitude,radius,dtlow,dthigh):
+        # Returns observations for every station within radius miles of (latitude, longitude) between
+        # dtlow and dthigh, in the Synoptic timeseries format: a dict of lists per station under
+        # 'OBSERVATIONS', with DISTANCE measured from the query point. Variables with no data for a
+        # station are left out, as the API does, and stations are ordered by distance.
+        stdist = self.stations_within(latitude,longitude,radius)
+        stations = []
+        if stdist != []:
+            stids = [st for (st,dist) in stdist]
+            qm = ','.join('?'*len(stids))
+            sql = 'SELECT * FROM observations WHERE stid IN (' + qm + ') AND date_time BETWEEN ? AND ? \
+            ORDER BY stid, date_time;'
+            self.cursor.execute(sql,tuple(stids) + (self._db_time(dtlow),self._db_time(dthigh)))
+            obkeys = [obk[0].lower() for obk in self.cursor.description]
+            istid = obkeys.index('stid')
+            obsbystid = {}
+            for obtup in self.cursor.fetchall():
+                obdict = obsbystid.setdefault(obtup[istid],{k:[] for k in obkeys if k != 'stid'})
+                for attr in range(len(obkeys)):
+                    if attr != istid:
+                        obdict[obkeys[attr]].append(obtup[attr])
+            for (stid,dist) in stdist:
+                if stid not in obsbystid:
+                    continue
+                if self.epoch_times:
+                    obsbystid[stid]['date_time'] = iso_times(obsbystid[stid]['date_time'])
+                station = self.get_station(stid)
+                station['DISTANCE'] = round(dist,2)
+                station['OBSERVATIONS'] = {k:v for (k,v) in obsbystid[stid].items()
+                                           if any(val != None for val in v)}
+                stations.append(station)
+        self.cursor.execute('SELECT variable, units FROM units;')
+        data = {'UNITS': dict(self.cursor.fetchall()),
+                'SUMMARY': {'NUMBER_OF_OBJECTS': len(stations), 'RESPONSE_CODE': 1,
+                            'RESPONSE_MESSAGE': 'OK', 'FUNCTION_USED': 'weather_db'},
+                'STATION': stations}
+        return data
+
+    def stations_within(self,latitude,longitude,miles):
+        # List of (stid, distance) for stations in the database within the given number of miles of
+        # (latitude, longitude), nearest first. Distances are great circle (haversine) miles. The
+        # spatial index narrows the candidates to a latitude/longitude box before the exact check.
+        latitude = float(latitude)
+        longitude = float(longitude)
+        miles = float(miles)
+        dlat = math.degrees(miles/EARTH_RADIUS_MILES)
+        dlon = dlat/max(math.cos(math.radians(latitude)),1.0e-6)
+        box = (latitude-dlat,latitude+dlat,longitude-dlon,longitude+dlon)
+        if self.rtree:
+            sql = 'SELECT s.stid, s.latitude, s.longitude FROM station_rtree r JOIN station s ON s.sid = r.sid \
+            WHERE r.maxlat >= ? AND r.minlat <= ? AND r.maxlon >= ? AND r.minlon <= ?;'
+        else:
+            sql = 'SELECT stid, latitude, longitude FROM station WHERE \
+            CAST(latitude AS REAL) BETWEEN ? AND ? AND CAST(longitude AS REAL) BETWEEN ? AND ?;'
+        self.cursor.execute(sql,box)
+        stdist = []
+        for (stid,lat,lon) in self.cursor.fetchall():
+            dist = haversine(latitude,longitude,lat,lon)
+            if dist <= miles:
+                stdist.append((stid,dist))
+        stdist.sort(key=lambda sd: sd[1])
+        return stdist
+
     
     def close(self):
+        if not self.read_only:
+            self.cursor.execute('PRAGMA optimize;')
         self.db_name = None
         self.cursor = None
         self.connection.close()
 
     
-if __name__ == '__main__':
+def run_example():
+    # Example session: creates test_example.db and queries it
 
     radius_data = get_example_radius_dataset()    
     mydb0 = WeatherDB.create("test_example.db")
@@ -555,3 +1466,34 @@ if __name__ == '__main__':
     rt1X = TimeUtils.randtime(bt1,'201809010000')
 
     mydb0.close()
+
+def main(argv=None):
+    # Commands, e.g.
+    #   python weather_utils.py -f weather_sdge_ign.ini events -u SDGE -j 8
+    #   python weather_utils.py -f weather_sdge_ign.ini convert -u SDGE -o sdge_events.parquet
+    #   python weather_utils.py -f weather_sdge_ign_mc.ini prefetch -u SDGE
+    #   python weather_utils.py -f weather_sdge_ign_mc.ini mc -u SDGE --seed 1
+    import weather_pipeline
+    import weather_mc
+    parser = argparse.ArgumentParser(description='Weather utilities for the Synoptic API')
+    parser.add_argument('-f','--config',default=weather_config.DEFAULT_CONFIG,help='Configuration file')
+    subparsers = parser.add_subparsers(dest='command',required=True)
+    events = subparsers.add_parser('events',help='Find the maximum gusts around the events of a spreadsheet')
+    weather_pipeline.add_arguments(events)
+    events.set_defaults(func=weather_pipeline.run_command)
+    convert = subparsers.add_parser('convert',help='Write the events of a spreadsheet as a CSV or Parquet event table')
+    weather_pipeline.add_convert_arguments(convert)
+    convert.set_defaults(func=weather_pipeline.run_convert_command)
+    mc = subparsers.add_parser('mc',help='Draw a Monte Carlo control sample around the locations of a spreadsheet')
+    weather_mc.add_arguments(mc)
+    mc.set_defaults(func=weather_mc.run_command)
+    prefetch = subparsers.add_parser('prefetch',help='Load the station histories a Monte Carlo control sample needs')
+    weather_mc.add_prefetch_arguments(prefetch)
+    prefetch.set_defaults(func=weather_mc.run_prefetch_command)
+    example = subparsers.add_parser('example',help='Run the example session')
+    example.set_defaults(func=lambda args: run_example())
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    main()